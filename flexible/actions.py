@@ -17,11 +17,54 @@ class Action(PolymorphicModel):
         'model_field_mismatch': "Provided model contains field named % but type does not match",
     }
 
+    # the fields stored in the programs of field expressions, None when the action cannot be stored
+    serialised_fields = None
+
     model = models.ForeignKey(Model, on_delete=NON_POLYMORPHIC_CASCADE)
 
     def execute(self, obj):
         raise NotImplementedError
 
+    def compile(self):
+        """
+        Compiles the action into a callable, actions reading
+        fields should override this to resolve them up front
+        :return: callable
+            The callable executing the action against an object
+        """
+        return self.execute
+
+    def dependencies(self):
+        """
+        The names of the fields the action reads, actions reading fields should override this
+        :return: set<string>
+            The field names, None when the action may read any field
+        """
+        return set()
+
+    def serialise(self):
+        """
+        Serialises the action for the program of a field expression,
+        actions reading fields should override this along with deserialise
+        :return: list
+            The opcode, the model name of the action, and the serialised fields
+        """
+        if self.serialised_fields is None:
+            raise NotImplementedError
+
+        return [self._meta.model_name] + [self._meta.get_field(x).value_to_string(self)
+                                          for x in self.serialised_fields]
+
+    @classmethod
+    def deserialise(cls, args):
+        """
+        :param args: list
+            The arguments of the serialised action
+        :return: Action
+            The unsaved action, to compile
+        """
+        return cls(**{x: cls._meta.get_field(x).to_python(y) for x, y in zip(cls.serialised_fields, args)})
+
     def js(self, indent=''):
         raise NotImplementedError
 
@@ -44,6 +87,22 @@ class ShowFieldAction(Action):
         if self.field.required and not value or value is None:
             raise ValidationError(f"{self.field} is shown and required but is not found")
 
+    def compile(self):
+        name = self.field.name
+        required = self.field.required
+        message = f"{self.field} is shown and required but is not found"
+
+        def execute(obj):
+            # field is shown, so ensure it is there if required
+            value = obj.get(name)
+            if required and not value or value is None:
+                raise ValidationError(message)
+
+        return execute
+
+    def dependencies(self):
+        return {self.field.name}
+
     def js(self, indent=''):
         js = f'$(\'#{self.field.div_id}\').prop(\'hidden\', false);'
         if self.field.required:
@@ -80,6 +139,9 @@ class HideFieldAction(Action):
     def execute(self, obj):
         pass
 
+    def dependencies(self):
+        return {self.field.name}
+
     def js(self, indent=''):
         js = f'$(\'#{self.field.div_id}\').prop(\'hidden\', true);'
         if self.field.required:
@@ -111,6 +173,8 @@ class HideFieldAction(Action):
 
 
 class ReturnIntegerAction(Action):
+    serialised_fields = ('value',)
+
     value = models.IntegerField(default=0)
 
     def execute(self, obj):
@@ -137,6 +201,8 @@ class ReturnIntegerAction(Action):
 
 
 class LogMessageAction(Action):
+    serialised_fields = ('message',)
+
     message = models.CharField(max_length=256, blank=False)
 
     def execute(self, obj):
@@ -174,6 +240,29 @@ class FormatDateFieldAction(Action):
 
         return field.value.strftime(self.format)
 
+    def compile(self):
+        name = self.field.name
+        format = self.format
+
+        def execute(obj):
+            field = obj.get(name)
+            if field is None:
+                return None
+
+            return field.value.strftime(format)
+
+        return execute
+
+    def dependencies(self):
+        return {self.field.name}
+
+    def serialise(self):
+        return [self._meta.model_name, self.field.name, self.format]
+
+    @classmethod
+    def deserialise(cls, args):
+        return cls(field=DateField(name=args[0]), format=args[1])
+
     def js(self, indent=''):
         super().js(indent)
 
@@ -202,6 +291,8 @@ class FormatDateFieldAction(Action):
 
 
 class ReturnAttributeAction(Action):
+    serialised_fields = ('attribute_name',)
+
     attribute_name = models.CharField(max_length=256, blank=False)
 
     def execute(self, obj):
@@ -210,6 +301,10 @@ class ReturnAttributeAction(Action):
         else:
             logger.info(f"obj does not have attribute {self.attribute_name}", stack=True)
 
+    def dependencies(self):
+        # any attribute of the object may be read
+        return None
+
     def js(self, indent=''):
         super().js(indent)
 
@@ -231,6 +326,8 @@ class ReturnAttributeAction(Action):
 
 
 class ReturnStringAction(Action):
+    serialised_fields = ('value',)
+
     value = models.TextField(blank=False)
 
     def execute(self, obj):
@@ -257,6 +354,8 @@ class ReturnStringAction(Action):
 
 
 class ReturnDecimalAction(Action):
+    serialised_fields = ('value',)
+
     value = models.DecimalField(max_digits=DecimalField.max_digits,
                                 decimal_places=DecimalField.decimal_places)
 
@@ -284,6 +383,8 @@ class ReturnDecimalAction(Action):
 
 
 class ReturnBooleanAction(Action):
+    serialised_fields = ('value',)
+
     value = models.BooleanField(default=False)
 
     def execute(self, obj):
@@ -310,6 +411,8 @@ class ReturnBooleanAction(Action):
 
 
 class ReturnDateAction(Action):
+    serialised_fields = ('value',)
+
     value = models.DateField()
 
     def execute(self, obj):
@@ -336,6 +439,8 @@ class ReturnDateAction(Action):
 
 
 class ReturnDurationAction(Action):
+    serialised_fields = ('value',)
+
     value = models.DurationField()
 
     def execute(self, obj):
@@ -362,6 +467,8 @@ class ReturnDurationAction(Action):
 
 
 class ReturnEmailAction(Action):
+    serialised_fields = ('value',)
+
     value = models.EmailField()
 
     def execute(self, obj):
@@ -400,6 +507,31 @@ class ReturnDaysBetweenDatesAction(Action):
 
         return (end.value - start.value).days
 
+    def compile(self):
+        start_name = self.start.name
+        end_name = self.end.name
+
+        def execute(obj):
+            start = obj.get(start_name)
+            end = obj.get(end_name)
+
+            if start is None or end is None:
+                return None
+
+            return (end.value - start.value).days
+
+        return execute
+
+    def dependencies(self):
+        return {self.start.name, self.end.name}
+
+    def serialise(self):
+        return [self._meta.model_name, self.start.name, self.end.name]
+
+    @classmethod
+    def deserialise(cls, args):
+        return cls(start=DateField(name=args[0]), end=DateField(name=args[1]))
+
     def js(self, indent=''):
         super().js(indent)
 
@@ -10,6 +10,7 @@ from flexible.expressions_admin import *
 from flexible.actions_admin import *
 from flexible.conditions_admin import *
 from flexible.imports_admin import *
+from flexible.metrics_admin import *
 
 field_fields = [
     'name',
@@ -20,6 +21,7 @@ field_fields = [
     'hidden',
     'evaluated',
     'generate_metrics',
+    'index_json',
 ]
 
 
@@ -131,6 +133,8 @@ class ModelAdmin(PolymorphicInlineSupportMixin, admin.ModelAdmin):
     fields = [
         'name',
         'ready',
+        'index_json',
+        'project',
         'created',
         'modified',
     ]
@@ -142,6 +146,7 @@ class ModelAdmin(PolymorphicInlineSupportMixin, admin.ModelAdmin):
 
     actions = [
         'copy',
+        'update_projections',
     ]
 
     def copy(self, request, queryset):
@@ -154,6 +159,12 @@ class ModelAdmin(PolymorphicInlineSupportMixin, admin.ModelAdmin):
                 else:
                     self.message_user(request, f"Copied model {model} to {model.copy()}")
 
+    def update_projections(self, request, queryset):
+        for model in queryset:
+            model.update_projection()
+            self.message_user(request, f"Updated the projection of model {model}")
+    update_projections.short_description = "Update projections of selected models"
+
     def get_readonly_fields(self, request, obj=None):
         if obj is not None:
             return self.readonly_fields + [
@@ -4,3 +4,7 @@ JS_INDENT = '  '
 
 class FlexibleConfig(AppConfig):
     name = 'flexible'
+
+    def ready(self):
+        # connect the signal receivers
+        from flexible import signals
@@ -78,6 +78,7 @@ class TextFieldChoice(FieldChoice):
 
     class Meta:
         verbose_name_plural = "Text Field choices"
+        ordering = ('index', 'value')
         unique_together = (('field', 'value'), ('field', 'slug'))
 
     def __str__(self):
@@ -103,6 +104,7 @@ class IntegerFieldChoice(FieldChoice):
 
     class Meta:
         verbose_name_plural = "Integer Field choices"
+        ordering = ('index',)
         unique_together = (('field', 'value'), ('field', 'slug'))
 
     def __str__(self):
@@ -129,6 +131,7 @@ class DecimalFieldChoice(FieldChoice):
 
     class Meta:
         verbose_name_plural = "Decimal Field choices"
+        ordering = ('index',)
         unique_together = (('field', 'value'), ('field', 'slug'))
 
     def __str__(self):
@@ -154,6 +157,7 @@ class DurationFieldChoice(FieldChoice):
 
     class Meta:
         verbose_name_plural = "Duration Field choices"
+        ordering = ('index',)
         unique_together = (('field', 'value'), ('field', 'slug'))
 
     def __str__(self):
@@ -179,6 +183,7 @@ class DateFieldChoice(FieldChoice):
 
     class Meta:
         verbose_name_plural = "Date Field choices"
+        ordering = ('index',)
         unique_together = (('field', 'value'), ('field', 'slug'))
 
     def __str__(self):
@@ -204,6 +209,7 @@ class EmailFieldChoice(FieldChoice):
 
     class Meta:
         verbose_name_plural = "Email Field choices"
+        ordering = ('index',)
         unique_together = (('field', 'value'), ('field', 'slug'))
 
     def __str__(self):
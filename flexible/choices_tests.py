@@ -105,3 +105,23 @@ class FlexibleChoicesTestCase(TestCase):
         self.assertIsNotNone(copied_choice)
         self.assertNotEqual(choice, copied_choice)
         self.assertEqual(choice.value, copied_choice.value)
+
+    def test_text_field_choice_index(self):
+        model = create_mock_model()
+        field = TextField.objects.create(model=model, index=100, verbose_name='TestChoicesTextField', required=False)
+        field.create_choice('First Choice', index=0)
+        field.create_choice('Second Choice', index=1)
+
+        # values are matched to choices regardless of case, without queries once indexed
+        field = model.schema.get(field.name)
+        self.assertEqual('First Choice', field.clean_value(' first CHOICE '))
+        with self.assertNumQueries(0):
+            self.assertEqual('Second Choice', field.clean_value('SECOND choice'))
+            self.assertEqual('Third Choice', field.clean_value('Third Choice', ignore_choices=True))
+            with self.assertRaises(ValidationError):
+                field.clean_value('Third Choice')
+
+        # new choices are indexed
+        field.create_choice('Third Choice', index=2)
+        self.assertEqual('Third Choice', field.clean_value('third choice'))
+        self.assertEqual('Third Choice', model.schema.get(field.name).clean_value('third choice'))
@@ -1,12 +1,13 @@
 from django.db import models
+from django.db.models import Q
 
 from polymorphic.models import PolymorphicModel
 
-from flexible.expressions import Operator, ModelExpression, FieldExpression
+from flexible.expressions import Operator, ModelExpression, FieldExpression, compile_error
 from flexible.models import Model, TextField, IntegerField, \
                             BooleanField, DecimalField, \
                             DateField, DurationField, \
-                            EmailField, NON_POLYMORPHIC_CASCADE
+                            EmailField, ModelInstance, NON_POLYMORPHIC_CASCADE
 from flexible.instances import TextFieldInstance, IntegerFieldInstance, \
                                 BooleanFieldInstance, DecimalFieldInstance, \
                                 DateFieldInstance, DurationFieldInstance, \
@@ -25,8 +26,9 @@ class ConditionGroup(models.Model):
     }
 
     def evaluate(self, obj, condition_set=None):
-        conditions = self.conditions
-        conditions_count = conditions.count()
+        # fetched once, rather than a query per condition
+        conditions = list(self.conditions)
+        conditions_count = len(conditions)
 
         if condition_set is None:
             condition_set = set()
@@ -50,6 +52,133 @@ class ConditionGroup(models.Model):
 
         return result
 
+    def compile(self, condition_set=None):
+        """
+        Compiles the group into a callable, loading the group's conditions once
+        :param condition_set: set
+            The conditions already compiled, used to detect cyclic references
+        :return: callable
+            The callable evaluating the group against an object
+        """
+        conditions = list(self.conditions)
+
+        if condition_set is None:
+            condition_set = set()
+        else:
+            for condition in conditions:
+                if condition in condition_set:
+                    return compile_error(RuntimeError, self.error_messages['cyclic_ref'])
+                else:
+                    condition_set.add(condition)
+
+        if len(conditions) <= 0:
+            return compile_error(RuntimeError, self.error_messages['no_conditions'])
+
+        return Operator.compile(operands=[x.compile(condition_set) for x in conditions],
+                                operators=[x.operator for x in conditions[:-1]],
+                                error_message=self.error_messages['no_previous_operator'])
+
+    def compile_many(self, condition_set=None):
+        """
+        Compiles the group into a callable evaluating many rows at once
+        :param condition_set: set
+            The conditions already compiled, used to detect cyclic references
+        :return: callable
+            The callable taking the objects, the columns of field values
+            and the rows to evaluate, returning the result for each row
+        """
+        conditions = list(self.conditions)
+
+        if condition_set is None:
+            condition_set = set()
+        else:
+            for condition in conditions:
+                if condition in condition_set:
+                    return compile_error(RuntimeError, self.error_messages['cyclic_ref'])
+                else:
+                    condition_set.add(condition)
+
+        if len(conditions) <= 0:
+            return compile_error(RuntimeError, self.error_messages['no_conditions'])
+
+        return Operator.compile_many(operands=[x.compile_many(condition_set) for x in conditions],
+                                     operators=[x.operator for x in conditions[:-1]],
+                                     error_message=self.error_messages['no_previous_operator'])
+
+    def serialise(self, condition_set=None):
+        """
+        Serialises the group for the program of an expression, see FieldExpression.serialise
+        :param condition_set: set
+            The conditions already serialised, used to detect cyclic references
+        :return: list
+            The group opcode and the conditions with their following operators,
+            or the error opcode and message when the group is invalid
+        """
+        conditions = list(self.conditions)
+
+        if condition_set is None:
+            condition_set = set()
+        else:
+            for condition in conditions:
+                if condition in condition_set:
+                    return ['error', self.error_messages['cyclic_ref']]
+                else:
+                    condition_set.add(condition)
+
+        if len(conditions) <= 0:
+            return ['error', self.error_messages['no_conditions']]
+
+        if any(x.operator is None for x in conditions[:-1]):
+            return ['error', self.error_messages['no_previous_operator']]
+
+        return ['group', [[x.condition.serialise(condition_set), x.operator] for x in conditions]]
+
+    def to_q(self, group_set=None):
+        """
+        Translates the group into a query on model instances
+        :param group_set: set
+            The groups already translated, used to detect cyclic references
+        :return: django.db.models.Q
+            The query matching the model instances the group evaluates true for
+        """
+        conditions = list(self.conditions)
+
+        if group_set is None:
+            group_set = set()
+        if self in group_set:
+            raise RuntimeError(self.error_messages['cyclic_ref'])
+        group_set.add(self)
+
+        if len(conditions) <= 0:
+            raise RuntimeError(self.error_messages['no_conditions'])
+
+        return Operator.combine(operands=[x.to_q(group_set) for x in conditions],
+                                operators=[x.operator for x in conditions[:-1]],
+                                error_message=self.error_messages['no_previous_operator'])
+
+    def dependencies(self, group_set=None):
+        """
+        The names of the fields the group's conditions read
+        :param group_set: set
+            The groups already visited, guarding against cyclic references
+        :return: set<string>
+            The field names, None when the conditions may read any field
+        """
+        if group_set is None:
+            group_set = set()
+        if self in group_set:
+            return set()
+        group_set.add(self)
+
+        dependencies = set()
+        for condition in self.conditions:
+            condition_dependencies = condition.dependencies(group_set)
+            if condition_dependencies is None:
+                return None
+            dependencies.update(condition_dependencies)
+
+        return dependencies
+
     def add_condition(self, condition, index=0, operator=None):
         raise NotImplementedError
 
@@ -72,6 +201,10 @@ class ConditionGroup(models.Model):
     def conditions(self):
         raise NotImplementedError
 
+    @property
+    def model(self):
+        raise NotImplementedError
+
     class Meta:
         abstract = True
 
@@ -81,8 +214,9 @@ class ModelExpressionConditionGroup(ConditionGroup):
     expression = models.ForeignKey(ModelExpression, on_delete=models.CASCADE)
 
     def js(self, indent=''):
-        conditions = self.conditions
-        conditions_count = conditions.count()
+        # fetched once, rather than a query per condition
+        conditions = list(self.conditions)
+        conditions_count = len(conditions)
 
         if conditions_count > 0:
             js = conditions[0].js()
@@ -117,6 +251,10 @@ class ModelExpressionConditionGroup(ConditionGroup):
     def conditions(self):
         return self.modelexpressioncondition_set.order_by('index')
 
+    @property
+    def model(self):
+        return self.expression.model
+
     class Meta:
         verbose_name_plural = "Model expression condition groups"
 
@@ -145,6 +283,10 @@ class FieldExpressionConditionGroup(ConditionGroup):
     def conditions(self):
         return self.fieldexpressioncondition_set.order_by('index')
 
+    @property
+    def model(self):
+        return self.expression.field.model
+
     class Meta:
         verbose_name_plural = "Field expression condition groups"
 
@@ -162,11 +304,84 @@ class Condition(PolymorphicModel):
         'cyclic_ref': "Cyclic reference detected"
     }
 
+    # the fields stored in the programs of expressions, None when the condition cannot be stored
+    serialised_fields = None
+
     model = models.ForeignKey(Model, on_delete=NON_POLYMORPHIC_CASCADE)
 
     def evaluate(self, obj, condition_set=None):
         raise NotImplementedError
 
+    def compile(self, condition_set=None):
+        """
+        Compiles the condition into a callable, conditions reading
+        fields or groups should override this to resolve them up front
+        :param condition_set: set
+            The conditions already compiled, used to detect cyclic references
+        :return: callable
+            The callable evaluating the condition against an object
+        """
+        return lambda obj: self.evaluate(obj)
+
+    def compile_many(self, condition_set=None):
+        """
+        Compiles the condition into a callable evaluating many rows at once,
+        conditions reading fields should override this to read the columns
+        :param condition_set: set
+            The conditions already compiled, used to detect cyclic references
+        :return: callable
+            The callable taking the objects, the columns of field values
+            and the rows to evaluate, returning the result for each row
+        """
+        evaluate = self.compile(condition_set)
+        return lambda objs, columns, rows: [evaluate(objs[row]) for row in rows]
+
+    def to_q(self, group_set=None):
+        """
+        Translates the condition into a query on model instances
+        :param group_set: set
+            The groups already translated, used to detect cyclic references
+        :return: django.db.models.Q
+            The query matching the model instances the condition evaluates true for
+        """
+        raise NotImplementedError
+
+    def dependencies(self, group_set=None):
+        """
+        The names of the fields the condition reads, conditions
+        reading fields or groups should override this
+        :param group_set: set
+            The groups already visited, guarding against cyclic references
+        :return: set<string>
+            The field names, None when the condition may read any field
+        """
+        return set()
+
+    def serialise(self, condition_set=None):
+        """
+        Serialises the condition for the program of an expression, conditions
+        reading fields or groups should override this along with deserialise
+        :param condition_set: set
+            The conditions already serialised, used to detect cyclic references
+        :return: list
+            The opcode, the model name of the condition, and the serialised fields
+        """
+        if self.serialised_fields is None:
+            raise NotImplementedError
+
+        return [self._meta.model_name] + [self._meta.get_field(x).value_to_string(self)
+                                          for x in self.serialised_fields]
+
+    @classmethod
+    def deserialise(cls, args):
+        """
+        :param args: list
+            The arguments of the serialised condition
+        :return: Condition
+            The unsaved condition, to compile
+        """
+        return cls(**{x: cls._meta.get_field(x).to_python(y) for x, y in zip(cls.serialised_fields, args)})
+
     def js(self, indent=''):
         raise NotImplementedError
 
@@ -200,6 +415,18 @@ class ModelExpressionCondition(models.Model):
     def evaluate(self, obj, condition_set=None):
         return self.condition.evaluate(obj, condition_set)
 
+    def compile(self, condition_set=None):
+        return self.condition.compile(condition_set)
+
+    def compile_many(self, condition_set=None):
+        return self.condition.compile_many(condition_set)
+
+    def dependencies(self, group_set=None):
+        return self.condition.dependencies(group_set)
+
+    def to_q(self, group_set=None):
+        return self.condition.to_q(group_set)
+
     def js(self, indent=''):
         return self.condition.js()
 
@@ -233,6 +460,18 @@ class FieldExpressionCondition(models.Model):
     def evaluate(self, obj, condition_set=None):
         return self.condition.evaluate(obj, condition_set)
 
+    def compile(self, condition_set=None):
+        return self.condition.compile(condition_set)
+
+    def compile_many(self, condition_set=None):
+        return self.condition.compile_many(condition_set)
+
+    def dependencies(self, group_set=None):
+        return self.condition.dependencies(group_set)
+
+    def to_q(self, group_set=None):
+        return self.condition.to_q(group_set)
+
     def copy(self, group):
         # simply copy the model expression condition
         expression_condition = FieldExpressionCondition.objects.get(pk=self.pk)
@@ -269,6 +508,42 @@ class NestedModelExpressionConditionGroup(Condition):
             condition_set.add(self.child_group)
         return self.child_group.evaluate(obj, condition_set)
 
+    def compile(self, condition_set=None):
+        if condition_set is None:
+            condition_set = set()
+        if self.child_group in condition_set:
+            # if already compiled, then cyclic ref detected
+            return compile_error(RuntimeError, self.error_messages['cyclic_ref'])
+        else:
+            condition_set.add(self.child_group)
+        return self.child_group.compile(condition_set)
+
+    def compile_many(self, condition_set=None):
+        if condition_set is None:
+            condition_set = set()
+        if self.child_group in condition_set:
+            # if already compiled, then cyclic ref detected
+            return compile_error(RuntimeError, self.error_messages['cyclic_ref'])
+        else:
+            condition_set.add(self.child_group)
+        return self.child_group.compile_many(condition_set)
+
+    def dependencies(self, group_set=None):
+        return self.child_group.dependencies(group_set)
+
+    def serialise(self, condition_set=None):
+        if condition_set is None:
+            condition_set = set()
+        if self.child_group in condition_set:
+            # if already serialised, then cyclic ref detected
+            return ['error', self.error_messages['cyclic_ref']]
+        else:
+            condition_set.add(self.child_group)
+        return self.child_group.serialise(condition_set)
+
+    def to_q(self, group_set=None):
+        return self.child_group.to_q(group_set)
+
     def js(self, indent=''):
         raise NotImplementedError
 
@@ -298,6 +573,42 @@ class NestedFieldExpressionConditionGroup(Condition):
             condition_set.add(self.child_group)
         return self.child_group.evaluate(obj, condition_set)
 
+    def compile(self, condition_set=None):
+        if condition_set is None:
+            condition_set = set()
+        if self.child_group in condition_set:
+            # if already compiled, then cyclic ref detected
+            return compile_error(RuntimeError, self.error_messages['cyclic_ref'])
+        else:
+            condition_set.add(self.child_group)
+        return self.child_group.compile(condition_set)
+
+    def compile_many(self, condition_set=None):
+        if condition_set is None:
+            condition_set = set()
+        if self.child_group in condition_set:
+            # if already compiled, then cyclic ref detected
+            return compile_error(RuntimeError, self.error_messages['cyclic_ref'])
+        else:
+            condition_set.add(self.child_group)
+        return self.child_group.compile_many(condition_set)
+
+    def dependencies(self, group_set=None):
+        return self.child_group.dependencies(group_set)
+
+    def serialise(self, condition_set=None):
+        if condition_set is None:
+            condition_set = set()
+        if self.child_group in condition_set:
+            # if already serialised, then cyclic ref detected
+            return ['error', self.error_messages['cyclic_ref']]
+        else:
+            condition_set.add(self.child_group)
+        return self.child_group.serialise(condition_set)
+
+    def to_q(self, group_set=None):
+        return self.child_group.to_q(group_set)
+
     def js(self, indent=''):
         raise NotImplementedError
 
@@ -345,6 +656,69 @@ class TextFieldCondition(Condition):
 
         return value == self.rhs
 
+    def compile(self, condition_set=None):
+        name = self.field.name
+        rhs = self.rhs
+
+        def value_of(obj):
+            # try to get value from choice first
+            value = obj.get(name)
+            return getattr(value, 'value', value)
+
+        if self.condition == self.CONDITION_EXISTS:
+            def evaluate(obj):
+                value = value_of(obj)
+                return value is not None and not value
+        elif self.condition == self.CONDITION_DOES_NOT_MATCH:
+            def evaluate(obj):
+                return value_of(obj) != rhs
+        else:
+            def evaluate(obj):
+                return value_of(obj) == rhs
+
+        return evaluate
+
+    def compile_many(self, condition_set=None):
+        name = self.field.name
+        rhs = self.rhs
+        condition = self.condition
+
+        def evaluate(objs, columns, rows):
+            column = columns[name]
+            # try to get value from choice first
+            values = [getattr(column[row], 'value', column[row]) for row in rows]
+
+            if condition == self.CONDITION_EXISTS:
+                return [value is not None and not value for value in values]
+            elif condition == self.CONDITION_DOES_NOT_MATCH:
+                return [value != rhs for value in values]
+            return [value == rhs for value in values]
+
+        return evaluate
+
+    def dependencies(self, group_set=None):
+        return {self.field.name}
+
+    def serialise(self, condition_set=None):
+        return [self._meta.model_name, self.field.name, self.condition, self.rhs]
+
+    @classmethod
+    def deserialise(cls, args):
+        return cls(field=TextField(name=args[0]), condition=args[1], rhs=args[2])
+
+    def to_q(self, group_set=None):
+        field_instances = TextFieldInstance.objects.filter(field_id=self.field_id)
+
+        if self.condition == self.CONDITION_EXISTS:
+            # mirrors evaluate, the value exists but is empty
+            return Q(pk__in=field_instances.filter(value='').values('model_instance_id'))
+
+        match = Q(pk__in=field_instances.filter(value=self.rhs).values('model_instance_id'))
+        if self.condition == self.CONDITION_DOES_NOT_MATCH:
+            return ~match
+
+        return match
+
     def js(self, indent=''):
         if self.condition == self.CONDITION_EXISTS:
             return f'$(\'#{self.field.input_id}\')[0].value.trim()'
@@ -386,6 +760,35 @@ class BooleanFieldCondition(Condition):
     def evaluate(self, obj, condition_set=None):
         return obj.get(self.field.name) == self.rhs
 
+    def compile(self, condition_set=None):
+        name = self.field.name
+        rhs = self.rhs
+        return lambda obj: obj.get(name) == rhs
+
+    def compile_many(self, condition_set=None):
+        name = self.field.name
+        rhs = self.rhs
+
+        def evaluate(objs, columns, rows):
+            column = columns[name]
+            return [column[row] == rhs for row in rows]
+
+        return evaluate
+
+    def dependencies(self, group_set=None):
+        return {self.field.name}
+
+    def serialise(self, condition_set=None):
+        return [self._meta.model_name, self.field.name, self.rhs]
+
+    @classmethod
+    def deserialise(cls, args):
+        return cls(field=BooleanField(name=args[0]), rhs=args[1])
+
+    def to_q(self, group_set=None):
+        field_instances = BooleanFieldInstance.objects.filter(field_id=self.field_id, value=self.rhs)
+        return Q(pk__in=field_instances.values('model_instance_id'))
+
     def js(self, indent=''):
         return f'$(\'#{self.field.input_id}\')[0].value == \'{self.rhs}\''
 
@@ -415,9 +818,17 @@ class BooleanFieldCondition(Condition):
 
 
 class AlwaysTrueCondition(Condition):
+    serialised_fields = ()
+
     def evaluate(self, obj, condition_set=None):
         return True
 
+    def compile_many(self, condition_set=None):
+        return lambda objs, columns, rows: [True] * len(rows)
+
+    def to_q(self, group_set=None):
+        return Q(pk__isnull=False)
+
     def js(self, indent=''):
         return f'true'
 
@@ -429,9 +840,17 @@ class AlwaysTrueCondition(Condition):
 
 
 class AlwaysFalseCondition(Condition):
+    serialised_fields = ()
+
     def evaluate(self, obj, condition_set=None):
         return False
 
+    def compile_many(self, condition_set=None):
+        return lambda objs, columns, rows: [False] * len(rows)
+
+    def to_q(self, group_set=None):
+        return Q(pk__in=[])
+
     def js(self, indent=''):
         return f'false'
 
@@ -443,11 +862,23 @@ class AlwaysFalseCondition(Condition):
 
 
 class HasAttributeCondition(Condition):
+    serialised_fields = ('attribute_name',)
+
     attribute_name = models.CharField(max_length=256, blank=False)
 
     def evaluate(self, obj, condition_set=None):
         return hasattr(obj, self.attribute_name)
 
+    def dependencies(self, group_set=None):
+        # any attribute of the object may be read
+        return None
+
+    def to_q(self, group_set=None):
+        # model instances all have the attributes of their class, so it matches all of them or none
+        if hasattr(ModelInstance, self.attribute_name):
+            return Q(pk__isnull=False)
+        return Q(pk__in=[])
+
     def js(self, indent=''):
         return f'false'
 
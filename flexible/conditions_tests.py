@@ -96,3 +96,116 @@ class FlexibleConditionsTestCase(TestCase):
             self.fail(e.args[0])
         else:
             pass
+
+    def test_condition_group_compile(self):
+        model = create_mock_model()
+        model_instance, values = create_mock_model_instance(model)
+        fields = list(model.get_fields())
+        expression = ModelExpression.objects.create(name='demo expression', model=model)
+
+        group = expression.create_group()
+        group.add_condition(AlwaysTrueCondition.objects.create(model=model), index=0, operator=Operator.AND())
+        nested_group = group.create_nested_group(model, index=1, operator=Operator.OR())
+        nested_group.add_condition(AlwaysFalseCondition.objects.create(model=model))
+        group.add_condition(TextFieldCondition.objects.create(model=model, field=fields[0], rhs=values[fields[0].name]),
+                            index=2)
+        group.add_condition(BooleanFieldCondition.objects.create(model=model, field=fields[3], rhs=True), index=3)
+
+        # the last condition has no previous operator
+        evaluate = group.compile()
+        ModelInstance.load_fields([model_instance])
+        with self.assertNumQueries(0):
+            with self.assertRaisesMessage(RuntimeError, ConditionGroup.error_messages['no_previous_operator']):
+                evaluate(model_instance)
+
+        condition = group.conditions[2]
+        condition.operator = Operator.AND()
+        condition.save()
+
+        evaluate = group.compile()
+        with self.assertNumQueries(0):
+            self.assertEqual(values[fields[3].name], evaluate(values))
+            result = evaluate(model_instance)
+        self.assertEqual(group.evaluate(values), values[fields[3].name])
+        self.assertEqual(group.evaluate(model_instance), result)
+
+        # evaluating many rows gives the same results, row by row
+        evaluate = group.compile_many()
+        objs = [values, model_instance]
+        columns = {x.name: [values.get(x.name), model_instance.get(x.name)] for x in fields}
+        with self.assertNumQueries(0):
+            self.assertEqual([values[fields[3].name], result], evaluate(objs, columns, range(len(objs))))
+
+    def test_condition_group_compile_cyclic_ref(self):
+        model = create_mock_model()
+        model_instance = create_mock_model_instance(model)[0]
+        expression = ModelExpression.objects.create(name='demo expression', model=model)
+
+        group = expression.create_group()
+        group.add_condition(AlwaysTrueCondition.objects.create(model=model), operator=Operator.AND())
+        nested_group = group.create_nested_group(model, index=1)
+        NestedModelExpressionConditionGroup.objects.create(model=model, parent_group=nested_group, child_group=group)
+        nested_group.add_condition(NestedModelExpressionConditionGroup.objects.get(parent_group=nested_group))
+
+        # cyclic references are only raised when evaluated, as with evaluate
+        evaluate = group.compile()
+        with self.assertRaisesMessage(RuntimeError, ConditionGroup.error_messages['cyclic_ref']):
+            evaluate(model_instance)
+        with self.assertRaisesMessage(RuntimeError, ConditionGroup.error_messages['cyclic_ref']):
+            group.evaluate(model_instance)
+
+    def test_model_instance_matching(self):
+        model = create_mock_model()
+        fields = list(model.get_fields())
+        text_field, boolean_field = fields[7], fields[3]
+
+        # instances alternating text values, the first two true, the last one missing its text value
+        model_instances = [create_mock_model_instance(model)[0] for _ in range(5)]
+        values = []
+        for i, model_instance in enumerate(model_instances):
+            text_instance = text_field.get_instance(model_instance)
+            text_instance.value = 'a' if i % 2 == 0 else 'b'
+            text_instance.save()
+            boolean_instance = boolean_field.get_instance(model_instance)
+            boolean_instance.value = i < 2
+            boolean_instance.save()
+            values.append({text_field.name: text_instance.value, boolean_field.name: boolean_instance.value})
+        text_field.get_instance(model_instances[-1]).delete()
+        values[-1][text_field.name] = None
+
+        expression = ModelExpression.objects.create(name='demo expression', model=model)
+        group = expression.create_group()
+        group.add_condition(TextFieldCondition.objects.create(model=model, field=text_field, rhs='a'),
+                            index=0, operator=Operator.AND())
+        nested_group = group.create_nested_group(model, index=1)
+        nested_group.add_condition(BooleanFieldCondition.objects.create(model=model, field=boolean_field, rhs=True),
+                                   index=0, operator=Operator.OR())
+        nested_group.add_condition(AlwaysFalseCondition.objects.create(model=model), index=1)
+
+        def expected():
+            return {x.pk for x, v in zip(model_instances, values) if group.evaluate(v)}
+
+        self.assertEqual({model_instances[0].pk}, expected())
+        self.assertEqual(expected(), {x.pk for x in ModelInstance.objects.matching(group)})
+        self.assertEqual(expected(), {x.pk for x in ModelInstance.objects.matching(expression)})
+
+        # missing values do not match
+        condition = TextFieldCondition.objects.get(field=text_field)
+        condition.condition = TextFieldCondition.CONDITION_DOES_NOT_MATCH
+        condition.save()
+        condition = BooleanFieldCondition.objects.get(field=boolean_field)
+        condition.rhs = False
+        condition.save()
+        self.assertEqual({model_instances[3].pk, model_instances[4].pk}, expected())
+        self.assertEqual(expected(), {x.pk for x in ModelInstance.objects.matching(expression)})
+
+        # instances of other models never match
+        create_mock_model_instance(create_mock_model())
+        self.assertEqual(expected(), {x.pk for x in ModelInstance.objects.matching(expression)})
+
+        # attribute conditions match the instances they evaluate true for
+        for attribute_name, matched in (('json', model_instances), ('missing', [])):
+            group = ModelExpression.objects.create(name='attribute expression', model=model).create_group()
+            group.add_condition(HasAttributeCondition.objects.create(model=model, attribute_name=attribute_name))
+            self.assertEqual({x.pk for x in matched}, {x.pk for x in model_instances if group.evaluate(x)})
+            self.assertEqual({x.pk for x in matched}, {x.pk for x in ModelInstance.objects.matching(group)})
@@ -1,13 +1,32 @@
 import logging
 
-from django.db import models
+from django.apps import apps
+from django.db import models, connection, transaction
 from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.postgres.fields import JSONField
 
 from flexible.apps import JS_INDENT
 
 logger = logging.getLogger(__file__)
 
 
+def compile_error(exception_type, *args):
+    """
+    Compiles an error found while compiling into a callable raising it,
+    so that the error is raised where evaluation would have raised it
+    :param exception_type: type
+        The type of the exception to raise
+    :param args:
+        The arguments of the exception
+    :return: callable
+        The callable raising the error, taking the arguments of any compiled callable
+    """
+    def raise_error(*objs):
+        raise exception_type(*args)
+
+    return raise_error
+
+
 class Operator:
     OPERATOR_CHOICE_AND = 'AND'
     OPERATOR_CHOICE_OR = 'OR'
@@ -29,6 +48,91 @@ class Operator:
             return a or b
         raise RuntimeError(cls.error_messages['invalid_operator'])
 
+    @classmethod
+    def compile(cls, operands, operators, error_message):
+        """
+        Compiles operands joined by operators into a single callable, every
+        operand is evaluated in order, as when operating on them one by one
+        :param operands: list<callable>
+            The compiled operands
+        :param operators: list<string>
+            The operators following each operand but the last
+        :param error_message: string
+            The error message when a previous operator is missing
+        :return: callable
+            The callable evaluating the operands
+        """
+        first = operands[0]
+        rest = tuple(zip(operators, operands[1:]))
+
+        def evaluate(obj):
+            result = first(obj)
+            for operator, operand in rest:
+                if operator is None:
+                    raise RuntimeError(error_message)
+                result = cls.operate(operator=operator, a=result, b=operand(obj))
+            return result
+
+        return evaluate
+
+    @classmethod
+    def compile_many(cls, operands, operators, error_message):
+        """
+        Compiles operands evaluated over many rows at once into a single callable,
+        combining the operands' results row by row with the operators
+        :param operands: list<callable>
+            The operands compiled to evaluate many rows
+        :param operators: list<string>
+            The operators following each operand but the last
+        :param error_message: string
+            The error message when a previous operator is missing
+        :return: callable
+            The callable evaluating the operands over many rows
+        """
+        first = operands[0]
+        rest = tuple(zip(operators, operands[1:]))
+
+        def evaluate(objs, columns, rows):
+            results = first(objs, columns, rows)
+            for operator, operand in rest:
+                if operator is None:
+                    raise RuntimeError(error_message)
+                operand_results = operand(objs, columns, rows)
+                if operator == cls.OPERATOR_CHOICE_AND:
+                    results = [a and b for a, b in zip(results, operand_results)]
+                elif operator == cls.OPERATOR_CHOICE_OR:
+                    results = [a or b for a, b in zip(results, operand_results)]
+                else:
+                    raise RuntimeError(cls.error_messages['invalid_operator'])
+            return results
+
+        return evaluate
+
+    @classmethod
+    def combine(cls, operands, operators, error_message):
+        """
+        Combines queries with the operators, in order
+        :param operands: list<django.db.models.Q>
+            The queries to combine
+        :param operators: list<string>
+            The operators following each query but the last
+        :param error_message: string
+            The error message when a previous operator is missing
+        :return: django.db.models.Q
+            The combined query
+        """
+        result = operands[0]
+        for operator, operand in zip(operators, operands[1:]):
+            if operator is None:
+                raise RuntimeError(error_message)
+            if operator == cls.OPERATOR_CHOICE_AND:
+                result = result & operand
+            elif operator == cls.OPERATOR_CHOICE_OR:
+                result = result | operand
+            else:
+                raise RuntimeError(cls.error_messages['invalid_operator'])
+        return result
+
     @classmethod
     def js(cls, operator):
         if operator == cls.OPERATOR_CHOICE_AND:
@@ -72,10 +176,63 @@ class ModelExpression(models.Model):
             return self._execute_actions(fields=fields)
         return self._execute_alternate_actions(fields=fields)
 
+    def compile(self):
+        """
+        Compiles the expression into a callable, loading the whole expression once
+        :return: callable
+            The callable executing the expression against a fields dict
+        """
+        groups = list(self.groups)
+        if len(groups) <= 0:
+            return compile_error(RuntimeError, "No condition groups found")
+
+        evaluate = Operator.compile(operands=[x.compile() for x in groups],
+                                    operators=[x.operator for x in groups[:-1]],
+                                    error_message="No previous operator found for group")
+        actions = tuple(x.action.compile() for x in self.modelexpressionaction_set.order_by('index'))
+        alternate_actions = tuple(x.action.compile() for x in self.alternatemodelexpressionaction_set.order_by('index'))
+
+        def execute(fields):
+            for action in actions if evaluate(fields) else alternate_actions:
+                action(fields)
+
+        return execute
+
+    def dependencies(self):
+        """
+        The names of the fields the expression's conditions read
+        :return: set<string>
+            The field names, None when the conditions may read any field
+        """
+        group_set = set()
+        dependencies = set()
+        for group in self.groups:
+            group_dependencies = group.dependencies(group_set)
+            if group_dependencies is None:
+                return None
+            dependencies.update(group_dependencies)
+
+        return dependencies
+
+    def to_q(self):
+        """
+        Translates the expression's condition groups into a query on model instances
+        :return: django.db.models.Q
+            The query matching the model instances the expression evaluates true for
+        """
+        groups = list(self.groups)
+        if len(groups) <= 0:
+            raise RuntimeError("No condition groups found")
+
+        return Operator.combine(operands=[x.to_q() for x in groups],
+                                operators=[x.operator for x in groups[:-1]],
+                                error_message="No previous operator found for group")
+
     def js(self, indent=''):
         try:
-            groups = self.groups
-            groups_count = groups.count()
+            # fetched once, rather than a query per group
+            groups = list(self.groups)
+            groups_count = len(groups)
             if groups_count <= 0:
                 raise RuntimeError("No condition groups found")
 
@@ -108,8 +265,8 @@ class ModelExpression(models.Model):
             js = js + indent + '}'
 
             # alternate actions
-            actions = self.alternatemodelexpressionaction_set.order_by('index')
-            if actions.count() > 0:
+            actions = list(self.alternatemodelexpressionaction_set.order_by('index'))
+            if len(actions) > 0:
                 js = js + '\n'
                 js = js + indent + 'else\n'
                 js = js + indent + '{\n'
@@ -237,10 +394,15 @@ class AlternateModelExpressionAction(ModelExpressionActionBase):
 
 
 class FieldExpression(models.Model):
+    # the version of the programs, programs of other versions are serialised again
+    program_version = 1
+
     # the name of the expression
     name = models.CharField(max_length=256)
     # the field using the expression
     field = models.OneToOneField('Field', on_delete=models.CASCADE)
+    # the whole expression serialised, serialised again once changes to the model's schema are committed
+    program = JSONField(blank=True, null=True, editable=False)
 
     def create_group(self, index=0, operator=None):
         return self.fieldexpressionconditiongroup_set.create(expression=self,
@@ -273,6 +435,265 @@ class FieldExpression(models.Model):
 
         return self.defaultfieldexpressionaction.action.execute(obj=obj)
 
+    def compile(self):
+        """
+        Compiles the expression into a callable, loading the whole expression once
+        :return: callable
+            The callable executing the expression against an object
+        """
+        groups = list(self.groups)
+        actions = list(self.actions)
+
+        if len(groups) <= 0:
+            return compile_error(RuntimeError, "No condition groups found")
+
+        if len(actions) != len(groups):
+            return compile_error(RuntimeError, "Actions count does not match groups count")
+
+        cases = tuple(zip([x.compile() for x in groups], [x.action.compile() for x in actions]))
+
+        try:
+            default_action = self.defaultfieldexpressionaction.action.compile()
+        except DefaultFieldExpressionAction.DoesNotExist as e:
+            default_action = compile_error(type(e), *e.args)
+
+        return self._compile_cases(cases, default_action)
+
+    @classmethod
+    def _compile_cases(cls, cases, default_action):
+        def execute(obj):
+            for evaluate, action in cases:
+                if evaluate(obj):
+                    return action(obj)
+            return default_action(obj)
+
+        return execute
+
+    def compile_many(self):
+        """
+        Compiles the expression into a callable executing it for many rows at once,
+        each group is evaluated as a column for the rows no previous group matched
+        :return: callable
+            The callable taking the objects, the columns of field values,
+            as returned by obj.get, and returning the result for each object
+        """
+        groups = list(self.groups)
+        actions = list(self.actions)
+
+        if len(groups) <= 0:
+            return compile_error(RuntimeError, "No condition groups found")
+
+        if len(actions) != len(groups):
+            return compile_error(RuntimeError, "Actions count does not match groups count")
+
+        cases = tuple(zip([x.compile_many() for x in groups], [x.action.compile() for x in actions]))
+
+        try:
+            default_action = self.defaultfieldexpressionaction.action.compile()
+        except DefaultFieldExpressionAction.DoesNotExist as e:
+            default_action = compile_error(type(e), *e.args)
+
+        return self._compile_many_cases(cases, default_action)
+
+    @classmethod
+    def _compile_many_cases(cls, cases, default_action):
+        def execute(objs, columns):
+            results = [None] * len(objs)
+            rows = range(len(objs))
+
+            for evaluate, action in cases:
+                if len(rows) <= 0:
+                    break
+
+                remaining_rows = []
+                for row, matched in zip(rows, evaluate(objs, columns, rows)):
+                    if matched:
+                        results[row] = action(objs[row])
+                    else:
+                        remaining_rows.append(row)
+                rows = remaining_rows
+
+            for row in rows:
+                results[row] = default_action(objs[row])
+
+            return results
+
+        return execute
+
+    def serialise(self):
+        """
+        Serialises the whole expression into a program, so that it compiles without loading its parts.
+        Groups are lists of conditions and their following operators, conditions and actions are
+        lists of their opcodes, the model names of their types, and their arguments
+        :return: dict
+            The program, holding the error instead when the expression is invalid,
+            or marked unsupported when a condition or action cannot be serialised
+        """
+        program = {'version': self.program_version}
+
+        groups = list(self.groups)
+        actions = list(self.actions)
+
+        if len(groups) <= 0:
+            program['error'] = "No condition groups found"
+            return program
+
+        if len(actions) != len(groups):
+            program['error'] = "Actions count does not match groups count"
+            return program
+
+        try:
+            program['cases'] = [[x.serialise(), y.action.serialise()] for x, y in zip(groups, actions)]
+
+            try:
+                program['default'] = self.defaultfieldexpressionaction.action.serialise()
+            except DefaultFieldExpressionAction.DoesNotExist:
+                program['default'] = None
+        except NotImplementedError:
+            return {'version': self.program_version, 'unsupported': True}
+
+        return program
+
+    def update_program(self):
+        """
+        Serialises the expression again and stores the program
+        :return: dict
+            The program
+        """
+        self.program = self.serialise()
+        # updated directly, without the signals of saving the expression
+        FieldExpression.objects.filter(pk=self.pk).update(program=self.program)
+        return self.program
+
+    @classmethod
+    def update_programs(cls, model_id):
+        """
+        Serialises the field expressions of a model again and stores their programs
+        :param model_id: int
+            The id of the model
+        """
+        with transaction.atomic():
+            for expression in cls.objects.filter(field__model_id=model_id):
+                expression.update_program()
+
+    @classmethod
+    def update_programs_on_commit(cls, model_id):
+        """
+        Serialises the field expressions of a model again once the current transaction commits,
+        once for all the changes of the transaction. Until then, they compile from their parts
+        :param model_id: int
+            The id of the model
+        """
+        if cls.has_pending_programs(model_id):
+            return
+
+        def update_programs():
+            cls.update_programs(model_id)
+
+        update_programs.program_model_id = model_id
+        transaction.on_commit(update_programs)
+
+    @classmethod
+    def has_pending_programs(cls, model_id):
+        """
+        Are the programs of a model's field expressions to be serialised again on commit?
+        :param model_id: int
+            The id of the model
+        :return: bool
+            True if the stored programs are outdated within the current transaction
+        """
+        return any(getattr(x, 'program_model_id', None) == model_id for _, x in connection.run_on_commit)
+
+    def compile_program(self, many=False):
+        """
+        Compiles the expression from its program, without loading its parts. Expressions whose
+        program is missing, outdated or cannot be serialised are compiled from their parts
+        :param many: bool
+            Should the callable evaluate many objects at once?
+        :return: callable
+            The callable executing the expression, as returned by compile or compile_many
+        """
+        program = self.program
+        # programs are outdated from the change of any part until it is committed
+        outdated = program is None or program.get('version') != self.program_version or \
+            (len(connection.run_on_commit) > 0 and self.has_pending_programs(self.field.model_id))
+
+        if outdated or program.get('unsupported'):
+            return self.compile_many() if many else self.compile()
+
+        if 'error' in program:
+            return compile_error(RuntimeError, program['error'])
+
+        cases = tuple((self._compile_node(x, many), self._compile_node(y)) for x, y in program['cases'])
+
+        if program['default'] is not None:
+            default_action = self._compile_node(program['default'])
+        else:
+            default_action = compile_error(DefaultFieldExpressionAction.DoesNotExist,
+                                           "FieldExpression has no defaultfieldexpressionaction.")
+
+        if many:
+            return self._compile_many_cases(cases, default_action)
+        return self._compile_cases(cases, default_action)
+
+    @classmethod
+    def _compile_node(cls, node, many=False):
+        """
+        Compiles a group, condition or action of a program
+        :param node: list
+            The opcode and arguments of the node
+        :param many: bool
+            Should conditions evaluate many rows at once? Actions are compiled for single objects
+        :return: callable
+            The compiled node
+        """
+        opcode, args = node[0], node[1:]
+
+        if opcode == 'error':
+            return compile_error(RuntimeError, *args)
+
+        if opcode == 'group':
+            conditions = args[0]
+            operands = [cls._compile_node(x, many) for x, _ in conditions]
+            operators = [x for _, x in conditions[:-1]]
+            compile_operands = Operator.compile_many if many else Operator.compile
+            return compile_operands(operands=operands, operators=operators,
+                                    error_message="No previous operator found for condition")
+
+        # conditions and actions are compiled from unsaved instances of their types
+        obj = apps.get_model('flexible', opcode).deserialise(args)
+        if many:
+            return obj.compile_many()
+        return obj.compile()
+
+    def dependencies(self):
+        """
+        The names of the fields the expression reads
+        :return: set<string>
+            The field names, None when the expression may read any field
+        """
+        group_set = set()
+        dependencies = set()
+        for group in self.groups:
+            group_dependencies = group.dependencies(group_set)
+            if group_dependencies is None:
+                return None
+            dependencies.update(group_dependencies)
+
+        actions = [x.action for x in self.actions]
+        try:
+            actions.append(self.defaultfieldexpressionaction.action)
+        except DefaultFieldExpressionAction.DoesNotExist:
+            pass
+
+        for action in actions:
+            action_dependencies = action.dependencies()
+            if action_dependencies is None:
+                return None
+            dependencies.update(action_dependencies)
+
+        return dependencies
+
     def copy(self, field):
         # copy the field expression first
         field_expression = FieldExpression.objects.get(pk=self.pk)
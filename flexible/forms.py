@@ -1,13 +1,19 @@
+import copy
 import logging
 
 from django import forms
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import cache
 from django.contrib import messages
+from django.urls import NoReverseMatch
+from django.utils import translation
 from django.utils.translation import gettext as _
-from django.utils.html import escape
+from django.utils.html import escape, format_html
+from django.utils.safestring import mark_safe
 
 from crispy_forms import layout
 from crispy_forms.helper import FormHelper
+from crispy_forms.utils import TEMPLATE_PACK
 
 from flexible.choices import *
 from flexible.models import *
@@ -15,28 +21,143 @@ from flexible.models import *
 logger = logging.getLogger(__file__)
 
 
+class ModelInstanceFormMedia(forms.Media):
+    def __init__(self, media, inline_js=()):
+        """
+        Media rendering scripts inline after the referenced ones, kept when combined with other media
+        :param media: forms.Media
+            The media referencing the css and scripts
+        :param inline_js: list<string>
+            The scripts to render inline
+        """
+        super().__init__()
+        self._css_lists = list(media._css_lists)
+        self._js_lists = list(media._js_lists)
+        self.inline_js = list(inline_js)
+
+    def render_js(self):
+        # the scripts may not end the script element they are rendered in
+        return super().render_js() + [format_html('<script type="text/javascript">{}</script>',
+                                                  mark_safe(x.replace('</', '<\\/')))
+                                      for x in self.inline_js]
+
+    def __add__(self, other):
+        return ModelInstanceFormMedia(super().__add__(other),
+                                      inline_js=self.inline_js + getattr(other, 'inline_js', []))
+
+    def __radd__(self, other):
+        return ModelInstanceFormMedia(forms.Media.__add__(other, self), inline_js=self.inline_js)
+
+
+class ModelInstanceFormHelper(FormHelper):
+    # the cache key of the rendered layout of blank forms, by model id, schema version,
+    # form class, template pack and language
+    rendered_cache_key = 'flexible_model_form_%d_%s_%s_%s_%s'
+    # the ids and required attributes of the cached layouts, the defaults of forms.Form
+    rendered_auto_id = 'id_%s'
+    rendered_use_required_attribute = True
+
+    def render_layout(self, form, context, template_pack=TEMPLATE_PACK):
+        # forms with values or errors are rendered each time, as are the rare customised ones
+        if form.is_bound or form.initial or not self.renders_base_layout(form):
+            return super().render_layout(form, context, template_pack=template_pack)
+
+        # blank forms render the same for every user of a version of the schema
+        key = self.rendered_cache_key % (form.schema.model_id, '_'.join(form.schema.version),
+                                         type(form).__name__, template_pack, translation.get_language())
+        html = cache.get(key)
+        if html is None:
+            html = str(super().render_layout(form, context, template_pack=template_pack))
+            cache.set(key, html)
+        else:
+            form.rendered_fields = set(form.fields)
+            form.crispy_field_template = self.field_template
+
+        return mark_safe(html)
+
+    def renders_base_layout(self, form):
+        """
+        Checks if a blank form renders the layout of its class, which is cached. Forms with a prefix,
+        other ids or required attributes, or with fields added, removed or reordered render
+        their own. Changes to the fields themselves are not seen, so blank forms must not change
+        the widgets, labels or choices of their fields
+        :param form: ModelInstanceForm
+            The blank form to check
+        :return: bool
+            True if the form renders the layout of its class
+        """
+        return form.prefix is None and form.auto_id == self.rendered_auto_id and \
+            form.use_required_attribute == self.rendered_use_required_attribute and \
+            list(form.fields) == list(form.base_fields)
+
+
 class ModelInstanceForm(forms.Form):
+    # the schema the form class was generated from, None for the base classes
+    schema = None
+    # the choices of the fields, filled in by TextField.prepare_form
+    base_field_choices = {}
+    # the django-crispy-forms helper, copied for each form like the base fields
+    base_helper = None
+    # the class of the helper, caching the rendered layout of blank forms
+    helper_class = ModelInstanceFormHelper
+
+    def __new__(cls, model, *args, **kwargs):
+        # forms are instances of the class generated for the model
+        if cls.schema is None:
+            cls = cls.get_form_class(model)
+
+        return super().__new__(cls)
+
     def __init__(self, model, instance=None, ignore_choices=False, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        # get the fields from the model
         self.model = model
-        fields = self.model.get_fields()
-        fieldset_fields = []
         self.instance = instance
         self.ignore_choices = ignore_choices
 
-        # used by typeahead, choices injected by TextField.prepare_form
-        self.field_choices = {}
+        # used by typeahead, the urls of choices injected by TextField.prepare_form,
+        # or the choices when the flexible urls are not included
+        self.field_choices = dict(self.base_field_choices)
+
+        self.helper = copy.deepcopy(self.base_helper)
 
         # create the initial dict if we have an instance
         if instance is not None:
             self.initial = {}
 
-        # set the form fields from the model fields
-        for field in fields:
-            if not field.evaluated:
-                self.fields[field.name] = field.get_form_field()
+            # if the instance has the field, fill the initial for it
+            for field in self.schema.non_evaluated_fields:
+                instance_field = instance.fields.get(field.name)
+                if instance_field is not None:
+                    if instance_field.value is not None:
+                        self.initial[field.name] = instance_field.value_form
+
+    @classmethod
+    def get_form_class(cls, model):
+        """
+        Gets the form class of a model, generated from its compiled schema once per version
+        and language, the labels and placeholders of the fields are translated when generated
+        :param model: Model
+            The model to get the form class for
+        :return: type
+            The subclass of the form with the fields of the model as its base fields
+        """
+        schema = model.schema
+        key = (cls, translation.get_language())
+        form_class = schema.form_classes.get(key)
+
+        if form_class is None:
+            form_class = type(cls)(f'{cls.__name__}{schema.model_id}', (cls,), {
+                '__module__': cls.__module__,
+                'schema': schema,
+            })
+            form_class.base_fields = {}
+            form_class.base_field_choices = {}
+            fieldset_fields = []
+
+            # set the form fields from the model fields
+            for field in schema.non_evaluated_fields:
+                form_class.base_fields[field.name] = field.get_form_field()
 
                 crispy_field = layout.Field(escape(field.name),
                                             data_toggle='tooltip',
@@ -48,28 +169,39 @@ class ModelInstanceForm(forms.Form):
 
                 fieldset_fields.append(crispy_field)
 
-                # prepare the form for the field
-                field.prepare_form(self)
+                # prepare the form class for the field
+                field.prepare_form(form_class)
 
-                # if we've got an instance and it has the field, fill the initial for it
-                if instance is not None:
-                    instance_field = instance.fields.get(field.name)
-                    if instance_field is not None:
-                        if instance_field.value is not None:
-                            self.initial[field.name] = instance_field.value_form
+            # set up the form using django-crispy-form's stuff
+            form_class.base_helper = cls.helper_class()
+            form_class.base_helper.form_show_errors = False
+            form_class.base_helper.layout = layout.Layout(
+                layout.Fieldset(None, *fieldset_fields, css_id=model.fieldset_id),
+            )
 
-        # set up the form using django-crispy-form's stuff
-        self.helper = FormHelper()
-        self.helper.form_show_errors = False
-        self.helper.layout = layout.Layout(
-            layout.Fieldset(None, *fieldset_fields, css_id=self.model.fieldset_id),
-        )
+            schema.form_classes[key] = form_class
+
+        return form_class
+
+    @property
+    def media(self):
+        # scripts/flexible.js suggests choices and binds the js of the model to the inputs,
+        # the js is served by url, rather than generated for each page
+        media = super().media + forms.Media(js=['scripts/flexible.js'])
+        js = self.model.schema.js
+        if js:
+            try:
+                media = media + forms.Media(js=[self.model.js_url])
+            except NoReverseMatch:
+                # the flexible urls are not included, render the js inline
+                media = ModelInstanceFormMedia(media, inline_js=[js])
+        return media
 
     def clean(self):
         super().clean()
 
         # clean the values for each field
-        fields = self.model.get_fields()
+        fields = self.model.schema.fields
         field_values = {}
         for field in fields:
             if not field.evaluated:
@@ -92,71 +224,17 @@ class ModelInstanceForm(forms.Form):
         return model_instance
 
     def update_model_instance(self, model_instance):
-        # alter existing fields and add new ones where needed
-        model_fields = self.model.get_fields()
-        original_fields = {}
-        try:
-            for field in model_fields:
-                if not field.evaluated:
-                    new_value = self.cleaned_data.get(field.name)
-                    # get the existing field on the instance
-                    try:
-                        field_instance = field.get_instance(model_instance)
-                    except ObjectDoesNotExist:
-                        field_instance = None
-
-                    # the field does not exist on the instance
-                    if field_instance is None:
-                        if new_value is not None:
-                            # no original value
-                            original_fields[field] = None
-                            # create the new field instance
-                            field.create_instance(model_instance, new_value)
-                    else:
-                        # update to new value if different
-                        if field_instance.value != new_value:
-                            # cache the original value
-                            original_fields[field] = field_instance.value
-                            if new_value is None:
-                                # delete the old value if new is None
-                                field_instance.delete()
-                            else:
-                                # save the new value
-                                field_instance.value = new_value
-                                field_instance.save()
-        except Exception:
-            # attempt to revert all changes on any error
-            try:
-                self.revert_update(model_instance, original_fields)
-            except Exception:
-                logger.error(f"Failed to revert {model_instance.id}, likely in invalid state.", stack=True)
-                raise
+        # write the changed values only, all or none of them
+        values = {x.name: self.cleaned_data.get(x.name) for x in self.model.schema.non_evaluated_fields}
 
-        return model_instance
+        # only the json of the changed fields needs updating
+        model_instance.mark_changed(model_instance.update_values(values))
 
-    @classmethod
-    def revert_update(cls, model_instance, cached_values):
-        for field in cached_values:
-            # no previous value, delete the new one
-            if cached_values[field] is None:
-                try:
-                    new_instance = field.get_instance(model_instance)
-                    new_instance.delete()
-                except ObjectDoesNotExist:
-                    pass
-            # revert back to the old value
-            else:
-                try:
-                    new_instance = field.get_instance(model_instance)
-                except ObjectDoesNotExist:
-                    # if the instance was deleted, recreate it
-                    field.create_instance(model_instance, cached_values[field])
-                else:
-                    new_instance.value = cached_values[field]
+        return model_instance
 
     def save_model_instance(self, model_instance):
         # create and save the field instances
-        model_fields = self.model.get_fields()
+        model_fields = self.model.schema.fields
         try:
             for field in model_fields:
                 if not field.evaluated:
@@ -278,6 +356,12 @@ class FieldForm(forms.Form):
             except ObjectDoesNotExist:
                 pass
 
+        # names taken by the model's projection are not allowed
+        name = slugify(cleaned_value)
+        if name in Field.reserved_names:
+            raise ValidationError(Field.error_messages['reserved_name'], code='reserved_name',
+                                  params={'name': name})
+
         return cleaned_value
 
 
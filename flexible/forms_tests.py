@@ -1,4 +1,11 @@
+from unittest import mock
+
 from django.db import transaction
+from django.test import override_settings
+from django.utils import translation
+
+from crispy_forms.helper import FormHelper
+from crispy_forms.utils import render_crispy_form
 
 from flexible.forms import *
 from flexible.models_tests import *
@@ -400,3 +407,124 @@ from flexible.tests_utils import *
 #             pass
 #         else:
 #             self.fail()
+
+
+class ModelInstanceFormTests(TestCase):
+    def test_model_instance_form_update_marks_changed_fields(self):
+        model = create_mock_model()
+        fields = list(model.get_fields())
+        model_instance = create_mock_model_instance(model)[0]
+        create_mock_matched_field(model, fields[7], 'rhs')
+        model_instance.update_json()
+
+        data = model_instance.to_post_dict()
+        data[fields[7].name] = 'rhs'
+
+        form = ModelInstanceForm(model, instance=model_instance, data=data)
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.assertEqual({fields[7].name}, model_instance._changed_fields)
+
+        model_instance.on_update()
+        self.assertEqual('matched', model_instance.json['testmatchedtextfield'])
+        self.assertEqual(ModelInstance.objects.get(pk=model_instance.pk).to_json(force_update=True),
+                         model_instance.json)
+
+    def test_model_instance_form_class(self):
+        model = create_mock_model()
+        model_instance = create_mock_model_instance(model)[0]
+        form = ModelInstanceForm(model, instance=model_instance)
+
+        # forms of a model share the class generated from its schema, without querying the fields again
+        with self.assertNumQueries(0):
+            other_form = ModelInstanceForm(model)
+        self.assertIs(type(form), type(other_form))
+        self.assertIsInstance(form, ModelInstanceForm)
+        self.assertEqual([x.name for x in model.schema.non_evaluated_fields], list(form.fields))
+        name = model.schema.non_evaluated_fields[0].name
+        self.assertEqual(model_instance.fields[name].value_form, form.initial[name])
+        self.assertEqual({}, other_form.initial)
+
+        # the fields of each form are copies of the base fields
+        form.fields[name].required = not form.fields[name].required
+        self.assertNotEqual(form.fields[name].required, other_form.fields[name].required)
+        self.assertIsNot(form.helper, other_form.helper)
+
+        # each language has its own generated class, translated when generated
+        with translation.override('de'):
+            self.assertIsNot(type(other_form), type(ModelInstanceForm(model)))
+            self.assertIs(ModelInstanceForm.get_form_class(model), type(ModelInstanceForm(model)))
+
+        # subclasses have their own generated classes
+        class OtherModelInstanceForm(ModelInstanceForm):
+            pass
+        self.assertIsInstance(OtherModelInstanceForm(model), OtherModelInstanceForm)
+
+        # a changed schema generates a new class
+        field = Field.objects.get(pk=model.schema.non_evaluated_fields[0].pk)
+        field.verbose_name = 'renamed'
+        field.save()
+        form = ModelInstanceForm(model)
+        self.assertIsNot(type(other_form), type(form))
+        self.assertEqual('renamed', form.fields['renamed'].label)
+
+    @override_settings(ROOT_URLCONF='flexible.views_tests')
+    def test_model_instance_form_rendered_cache(self):
+        model = create_mock_model()
+        model_instance = create_mock_model_instance(model)[0]
+        html = render_crispy_form(ModelInstanceForm(model))
+
+        with mock.patch.object(FormHelper, 'render_layout', autospec=True,
+                               side_effect=FormHelper.render_layout) as render_layout:
+            # blank forms are rendered once per version of the schema
+            self.assertEqual(html, render_crispy_form(ModelInstanceForm(model)))
+            self.assertEqual(0, render_layout.call_count)
+
+            # forms with values or errors are rendered each time
+            form = ModelInstanceForm(model, instance=model_instance)
+            self.assertNotEqual(html, render_crispy_form(form))
+            form = ModelInstanceForm(model, data={})
+            self.assertFalse(form.is_valid())
+            render_crispy_form(form)
+            self.assertEqual(2, render_layout.call_count)
+
+            # blank forms with other ids or fields render their own layout
+            form = ModelInstanceForm(model, auto_id='other_%s')
+            self.assertIn('id="other_', render_crispy_form(form))
+            form = ModelInstanceForm(model)
+            removed = list(form.fields)[0]
+            del form.fields[removed]
+            self.assertNotIn(f'name="{removed}"', render_crispy_form(form))
+            self.assertEqual(4, render_layout.call_count)
+
+            # each language has its own rendering
+            with translation.override('de'):
+                render_crispy_form(ModelInstanceForm(model))
+                render_crispy_form(ModelInstanceForm(model))
+            self.assertEqual(5, render_layout.call_count)
+
+            # a changed schema is rendered again
+            field = Field.objects.get(pk=model.schema.non_evaluated_fields[0].pk)
+            field.verbose_name = 'renamed'
+            field.save()
+            self.assertIn('renamed', render_crispy_form(ModelInstanceForm(model)))
+            self.assertEqual(6, render_layout.call_count)
+
+    def test_model_instance_form_media_without_urls(self):
+        model = Model.objects.create(name='testModel')
+        text_field = TextField.objects.create(verbose_name='testTextField', required=True, model=model)
+        int_field = IntegerField.objects.create(verbose_name='testIntegerField', required=False, model=model)
+        expression = ModelExpression.objects.create(name='testExpression', model=model)
+        group = expression.create_group()
+        condition = TextFieldCondition.objects.create(field=text_field, rhs='</script>',
+                                                      condition=TextFieldCondition.CONDITION_MATCH, model=model)
+        group.add_condition(condition=condition)
+        expression.add_action(action=ShowFieldAction.objects.create(field=int_field, model=model))
+
+        # without the flexible urls the js of the model is rendered inline, after the scripts it uses
+        media = str(ModelInstanceForm(model).media + forms.Media(js=['other.js']))
+        self.assertLess(media.index('scripts/flexible.js'), media.index('flexibleBindExpressions'))
+        self.assertIn('other.js', media)
+        self.assertEqual(1, media.count('</script>', media.index('flexibleBindExpressions')))
+        self.assertIn("'<\\/script>'", media)
+        self.assertIn('flexibleBindExpressions', str(forms.Media(js=['other.js']) + ModelInstanceForm(model).media))
@@ -1,12 +1,389 @@
-from django.db import models
+import csv
+import io
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.db import models, connections, transaction, DatabaseError
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.text import slugify
+
+from flexible.models import Model
+
+
+def import_csv_chunk(csv_file_import_id, header, start, end, batch_size):
+    """
+    Imports a chunk of a csv file, run by the worker processes of parallel imports
+    :param csv_file_import_id: int
+        The id of the csv file import
+    :param header: list<string>
+        The header row of the csv file, None when there is none
+    :param start: int
+        The offset of the first line of the chunk
+    :param end: int
+        The offset after the last line of the chunk
+    :param batch_size: int
+        The number of rows to insert at a time
+    :return: tuple
+        The rows processed, the rows imported and the errors, rows numbered from one
+    """
+    csv_file_import = CSVFileImport.objects.get(pk=csv_file_import_id)
+    return csv_file_import._import_chunk(header, start, end, batch_size)
 
 
 class CSVFileImport(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_FINISHED = 'finished'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_FINISHED, "Finished"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    error_messages = {
+        'missing_model': "No model to import into",
+        'parallel_in_transaction': "Parallel imports cannot run inside a transaction",
+    }
+
+    # the number of bytes read at a time when checking the chunks of a file for quoted values
+    quote_block_size = 1 << 20
+
     csv_file = models.FileField()
     created = models.DateTimeField(auto_now_add=True)
+    # the model to import instances into
+    model = models.ForeignKey(Model, null=True, blank=True, on_delete=models.CASCADE)
+    # does the first row hold the field names?
+    has_header = models.BooleanField(default=True)
+    # should the row validation ignore field choices?
+    ignore_choices = models.BooleanField(default=True)
+    # the optional maximum number of rows to import
+    max_rows = models.PositiveIntegerField(null=True, blank=True)
+    # the progress of the import
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    rows_processed = models.PositiveIntegerField(default=0)
+    rows_imported = models.PositiveIntegerField(default=0)
+    rows_failed = models.PositiveIntegerField(default=0)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def run(self, batch_size=1000, workers=None):
+        """
+        Imports the csv file into the model, streaming it row by row. Valid rows
+        are inserted a batch at a time, invalid rows are recorded as errors
+        :param batch_size: int
+            The number of rows to insert at a time
+        :param workers: int
+            The optional number of worker processes to import chunks of the file with, each in a
+            transaction of its own. Files with rows spanning lines and imports limited to max_rows
+            are not split. When a worker fails the chunks not yet started are cancelled, those
+            already imported are kept and the import is failed
+        """
+        if self.model is None:
+            raise RuntimeError(self.error_messages['missing_model'])
+
+        # start over, discarding the progress of any previous run
+        self.csvfileimporterror_set.all().delete()
+        self.status = self.STATUS_RUNNING
+        self.rows_processed = 0
+        self.rows_imported = 0
+        self.rows_failed = 0
+        self.started = timezone.now()
+        self.finished = None
+        self.save()
+
+        try:
+            if workers is not None and workers > 1 and self.max_rows is None:
+                self._import_file_parallel(batch_size, workers)
+            else:
+                self._import_file(batch_size)
+        except Exception:
+            self.status = self.STATUS_FAILED
+            self.finished = timezone.now()
+            self.save()
+            raise
+
+        self.status = self.STATUS_FINISHED
+        self.finished = timezone.now()
+        self.save()
+
+    def _import_file(self, batch_size):
+        # read the file as text lazily, so that it is never fully in memory
+        csv_file = io.TextIOWrapper(self.csv_file.open('rb'), encoding='utf-8-sig', newline='')
+        try:
+            rows = enumerate(csv.reader(csv_file), start=1)
+
+            # the header is the first row
+            header = None
+            if self.has_header:
+                header = next(rows, (0, []))[1]
+
+            for processed, imported, errors in self._import_rows(rows, header, batch_size, self.max_rows):
+                self._record_progress(processed, imported, errors)
+        finally:
+            csv_file.close()
+
+    def _import_file_parallel(self, batch_size, workers):
+        csv_file = self.csv_file.open('rb')
+        try:
+            # the header is the first line
+            header = None
+            if self.has_header:
+                header = next(csv.reader([csv_file.readline().decode('utf-8-sig')]), [])
+            chunks = self.get_chunks(csv_file, csv_file.tell(), self.csv_file.size, workers * 4)
+        finally:
+            csv_file.close()
+
+        # rows spanning lines cannot be split on lines
+        if chunks is None:
+            self._import_file(batch_size)
+            return
+
+        # workers must open their own connections, rather than share ours
+        if transaction.get_connection().in_atomic_block:
+            raise RuntimeError(self.error_messages['parallel_in_transaction'])
+        connections.close_all()
+
+        chunk_results = {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+            futures = {executor.submit(import_csv_chunk, self.pk, header, start, end, batch_size): start
+                       for start, end in chunks}
+            for future in as_completed(futures):
+                try:
+                    processed, imported, errors = future.result()
+                except Exception:
+                    # the chunk was rolled back, the chunks not yet started are not imported either
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                chunk_results[futures[future]] = (processed, errors)
+                self._record_progress(processed, imported, [])
+
+        # the rows of each chunk are numbered from one, number them from the start of the file
+        row_offset = 1 if self.has_header else 0
+        errors = []
+        for start, end in chunks:
+            chunk_processed, chunk_errors = chunk_results[start]
+            errors.extend((row_offset + row_number, message) for row_number, message in chunk_errors)
+            row_offset += chunk_processed
+        self._record_progress(0, 0, errors)
+
+    def _import_chunk(self, header, start, end, batch_size):
+        """
+        Imports the rows between two byte offsets of the file in one transaction
+        :param header: list<string>
+            The header row of the csv file, None when there is none
+        :param start: int
+            The offset of the first line of the chunk
+        :param end: int
+            The offset after the last line of the chunk
+        :param batch_size: int
+            The number of rows to insert at a time
+        :return: tuple
+            The rows processed, the rows imported and the errors, rows numbered from one
+        """
+        csv_file = self.csv_file.open('rb')
+        try:
+            csv_file.seek(start)
+
+            def read_lines():
+                while csv_file.tell() < end:
+                    line = csv_file.readline()
+                    if not line:
+                        break
+                    yield line.decode('utf-8')
+
+            processed = 0
+            imported = 0
+            errors = []
+            with transaction.atomic():
+                rows = enumerate(csv.reader(read_lines()), start=1)
+                for batch_processed, batch_imported, batch_errors in self._import_rows(rows, header, batch_size):
+                    processed += batch_processed
+                    imported += batch_imported
+                    errors.extend(batch_errors)
+        finally:
+            csv_file.close()
+
+        return processed, imported, errors
+
+    def _import_rows(self, rows, header, batch_size, max_rows=None):
+        """
+        Imports numbered csv rows, a batch at a time
+        :param rows: iterable<tuple>
+            The row numbers and rows
+        :param header: list<string>
+            The header row of the csv file, None when there is none
+        :param batch_size: int
+            The number of rows to insert at a time
+        :param max_rows: int
+            The optional maximum number of rows to import
+        :return: generator<tuple>
+            The rows processed, the rows imported and the errors of each batch
+        """
+        fields = self.model.schema.non_evaluated_fields
+
+        # map the columns to the fields, by name when there is a header
+        if header is not None:
+            column_count = len(header)
+            columns = self.get_columns(header, fields)
+        else:
+            column_count = len(fields)
+            columns = list(range(column_count))
+
+        processed = 0
+        cleaned_rows = []
+        errors = []
+        for row_number, row in rows:
+            if max_rows is not None and processed >= max_rows:
+                errors.append((row_number, Model.error_messages['too_many_rows']))
+                break
+
+            processed += 1
+            try:
+                if len(row) != column_count:
+                    raise ValidationError(Model.error_messages['column_count_mismatch'])
+
+                # empty cells are missing values
+                values = [row[x] if x is not None and row[x] != '' else None for x in columns]
+                cleaned_rows.append((row_number, self.model.clean_from_values(values, self.ignore_choices)))
+            except ValidationError as e:
+                errors.append((row_number, '; '.join(e.messages)))
+            except (ValueError, RuntimeError) as e:
+                errors.append((row_number, str(e)))
+
+            if len(cleaned_rows) + len(errors) >= batch_size:
+                yield (processed,) + self._insert_rows(cleaned_rows, errors)
+                processed = 0
+                cleaned_rows = []
+                errors = []
+
+        yield (processed,) + self._insert_rows(cleaned_rows, errors)
+
+    def _insert_rows(self, cleaned_rows, errors):
+        imported = 0
+        if len(cleaned_rows) > 0:
+            try:
+                self.model.bulk_create_instances([x for _, x in cleaned_rows])
+                imported = len(cleaned_rows)
+            except DatabaseError:
+                # find the failing rows by inserting them one by one
+                for row_number, cleaned_values in cleaned_rows:
+                    try:
+                        self.model.bulk_create_instances([cleaned_values])
+                        imported += 1
+                    except DatabaseError as e:
+                        errors.append((row_number, str(e)))
+
+        return imported, errors
+
+    def _record_progress(self, processed, imported, errors):
+        CSVFileImportError.objects.bulk_create([CSVFileImportError(csv_file_import=self, row=row_number,
+                                                                   message=message)
+                                                for row_number, message in errors])
+        self.rows_processed += processed
+        self.rows_imported += imported
+        self.rows_failed += len(errors)
+
+        # keep the progress visible to others
+        self.save(update_fields=['rows_processed', 'rows_imported', 'rows_failed'])
+
+    @classmethod
+    def get_chunks(cls, csv_file, start, end, count):
+        """
+        Splits a file into byte ranges aligned on line boundaries
+        :param csv_file: file
+            The file opened in binary mode
+        :param start: int
+            The offset of the first line to split from
+        :param end: int
+            The size of the file
+        :param count: int
+            The number of chunks to aim for
+        :return: list<tuple>
+            The start and end offsets of each chunk, None when a boundary falls within a quoted value
+        """
+        chunk_size = max(1, (end - start) // count)
+
+        offsets = [start]
+        for i in range(1, count):
+            # move on to the start of the next line
+            csv_file.seek(start + i * chunk_size)
+            csv_file.readline()
+            offset = csv_file.tell()
+            if offset >= end:
+                break
+            if offset > offsets[-1]:
+                offsets.append(offset)
+        offsets.append(end)
+
+        # quotes within values are doubled, so boundaries within quoted values follow an odd number of quotes
+        csv_file.seek(start)
+        quotes = 0
+        for offset in offsets[1:-1]:
+            while csv_file.tell() < offset:
+                block = csv_file.read(min(cls.quote_block_size, offset - csv_file.tell()))
+                if not block:
+                    break
+                quotes += block.count(b'"')
+            if quotes % 2 != 0:
+                return None
+
+        return [(a, b) for a, b in zip(offsets, offsets[1:]) if b > a]
+
+    @classmethod
+    def get_columns(cls, header, fields):
+        """
+        Maps fields to the columns of a csv header, columns are matched on field names
+        :param header: list<string>
+            The header row of the csv file
+        :param fields: list<Field>
+            The fields to find columns for
+        :return: list<int>
+            The column index of each field, None for fields without a column
+        """
+        header_columns = {slugify(x): i for i, x in enumerate(header)}
+        return [header_columns.get(field.name) for field in fields]
+
+    @property
+    def rows_per_second(self):
+        """
+        The throughput of the import
+        :return: float
+            The number of rows processed per second, None if not started
+        """
+        if self.started is None:
+            return None
+
+        end = self.finished if self.finished is not None else timezone.now()
+        seconds = (end - self.started).total_seconds()
+        if seconds <= 0:
+            return None
+
+        return self.rows_processed / seconds
 
     class Meta:
         verbose_name_plural = "CSV File Imports"
 
     def __str__(self):
         return f"{self.csv_file} @ {self.created}"
+
+
+class CSVFileImportError(models.Model):
+    # the import the error belongs to
+    csv_file_import = models.ForeignKey(CSVFileImport, on_delete=models.CASCADE)
+    # the number of the row in the csv file
+    row = models.PositiveIntegerField()
+    # the reason the row was not imported
+    message = models.TextField()
+
+    class Meta:
+        verbose_name_plural = "CSV File Import Errors"
+        ordering = ('row',)
+
+    def __str__(self):
+        return f"Row {self.row}: {self.message}"
@@ -1,8 +1,48 @@
 from django.contrib import admin
 
-from flexible.imports import CSVFileImport
+from flexible.imports import CSVFileImport, CSVFileImportError
+
+
+class CSVFileImportErrorInline(admin.TabularInline):
+    model = CSVFileImportError
+    extra = 0
+    readonly_fields = [
+        'row',
+        'message',
+    ]
 
 
 @admin.register(CSVFileImport)
 class CSVFileImportAdmin(admin.ModelAdmin):
-    pass
+    list_display = [
+        '__str__',
+        'model',
+        'status',
+        'rows_processed',
+        'rows_imported',
+        'rows_failed',
+        'rows_per_second',
+    ]
+
+    readonly_fields = [
+        'status',
+        'rows_processed',
+        'rows_imported',
+        'rows_failed',
+        'rows_per_second',
+        'started',
+        'finished',
+    ]
+
+    inlines = [
+        CSVFileImportErrorInline,
+    ]
+
+    actions = [
+        'run_imports',
+    ]
+
+    def run_imports(self, request, queryset):
+        for csv_file_import in queryset:
+            csv_file_import.run()
+    run_imports.short_description = "Run selected CSV file imports"
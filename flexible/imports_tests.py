@@ -0,0 +1,164 @@
+import csv
+import io
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.files.base import ContentFile
+
+from flexible.imports import *
+from flexible.tests_utils import *
+
+
+class CSVFileImportTestsMixin:
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def create_csv_file_import(self, model, rows, **kwargs):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        for row in rows:
+            writer.writerow(row)
+
+        csv_file_import = CSVFileImport(model=model, **kwargs)
+        csv_file_import.csv_file.save('import.csv', ContentFile(output.getvalue().encode('utf-8')))
+        return csv_file_import
+
+
+class CSVFileImportTests(CSVFileImportTestsMixin, TestCase):
+    def test_csv_file_import_run(self):
+        model = create_mock_model()
+        fields = model.schema.fields
+        instances = [create_mock_model_instance(model)[0] for _ in range(3)]
+        count = model.instance_count
+
+        # evaluated fields are exported too, but ignored on import
+        rows = [[field.name for field in fields]]
+        for instance in instances:
+            rows.append([to_import_value(instance.get(field.name).value) if not field.evaluated else 'evaluated'
+                         for field in fields])
+
+        # a missing required value and a missing column
+        rows.append([''] + rows[1][1:])
+        rows.append(rows[1][1:])
+
+        csv_file_import = self.create_csv_file_import(model, rows)
+        csv_file_import.run(batch_size=2)
+
+        csv_file_import = CSVFileImport.objects.get(pk=csv_file_import.pk)
+        self.assertEqual(CSVFileImport.STATUS_FINISHED, csv_file_import.status)
+        self.assertEqual(5, csv_file_import.rows_processed)
+        self.assertEqual(3, csv_file_import.rows_imported)
+        self.assertEqual(2, csv_file_import.rows_failed)
+        self.assertIsNotNone(csv_file_import.rows_per_second)
+        self.assertEqual([5, 6], [x.row for x in csv_file_import.csvfileimporterror_set.all()])
+
+        imported = model.get_instances().order_by('-pk')[:3][::-1]
+        self.assertEqual(count + 3, model.instance_count)
+        for instance, imported_instance in zip(instances, imported):
+            self.assertTrue(imported_instance.equals(instance))
+
+    def test_csv_file_import_run_max_rows(self):
+        model = create_mock_model()
+        fields = model.schema.non_evaluated_fields
+        instance = create_mock_model_instance(model)[0]
+        row = [to_import_value(instance.get(field.name).value) for field in fields]
+
+        csv_file_import = self.create_csv_file_import(model, [row, row, row], has_header=False, max_rows=2)
+        csv_file_import.run()
+
+        self.assertEqual(2, csv_file_import.rows_imported)
+        self.assertEqual(1, csv_file_import.rows_failed)
+        self.assertEqual(Model.error_messages['too_many_rows'], csv_file_import.csvfileimporterror_set.get().message)
+
+
+# workers use connections of their own, so the data must be committed
+class CSVFileImportParallelTests(CSVFileImportTestsMixin, TransactionTestCase):
+    def test_csv_file_import_run_workers(self):
+        model = create_mock_model()
+        fields = model.schema.non_evaluated_fields
+        instance = create_mock_model_instance(model)[0]
+        count = model.instance_count
+
+        row = [to_import_value(instance.get(field.name).value) for field in fields]
+        rows = [[field.name for field in fields]] + [row] * 40
+        rows[10] = [''] + row[1:]
+        rows[30] = row[1:]
+
+        csv_file_import = self.create_csv_file_import(model, rows)
+        csv_file_import.run(batch_size=3, workers=2)
+
+        csv_file_import = CSVFileImport.objects.get(pk=csv_file_import.pk)
+        self.assertEqual(CSVFileImport.STATUS_FINISHED, csv_file_import.status)
+        self.assertEqual(40, csv_file_import.rows_processed)
+        self.assertEqual(38, csv_file_import.rows_imported)
+        self.assertEqual(count + 38, model.instance_count)
+        self.assertEqual([11, 31], [x.row for x in csv_file_import.csvfileimporterror_set.all()])
+
+    def test_csv_file_import_get_chunks(self):
+        csv_file = io.BytesIO(b'a,b\n1,2\n3,4\n5,6\n')
+        chunks = CSVFileImport.get_chunks(csv_file, 4, 16, 3)
+
+        # chunks cover every line once
+        self.assertEqual(4, chunks[0][0])
+        self.assertEqual(16, chunks[-1][1])
+        for (a, b), (c, d) in zip(chunks, chunks[1:]):
+            self.assertEqual(b, c)
+        for start, end in chunks:
+            self.assertEqual(b'\n', csv_file.getvalue()[end - 1:end])
+
+        # files are not split within quoted values spanning lines
+        csv_file = io.BytesIO(b'a,b\n1,"x\n""y""\nz"\n3,4\n5,6\n')
+        self.assertIsNone(CSVFileImport.get_chunks(csv_file, 4, len(csv_file.getvalue()), 3))
+
+    def test_csv_file_import_run_workers_quoted_lines(self):
+        model = create_mock_model()
+        fields = model.schema.non_evaluated_fields
+        instance = create_mock_model_instance(model)[0]
+        count = model.instance_count
+
+        # text values spanning lines are imported serially, the other values are short so that
+        # the file is split within the lines
+        text = '\n'.join(['"quoted" line'] * 100)
+        row = [to_import_value(instance.get(field.name).value) for field in fields]
+        row[[x.name for x in fields].index('testtextfield')] = text
+        row[[x.name for x in fields].index('testtextfieldwithmetrics')] = 'short'
+        rows = [[field.name for field in fields]] + [row] * 20
+
+        csv_file_import = self.create_csv_file_import(model, rows)
+        with mock.patch('flexible.imports.ProcessPoolExecutor', side_effect=AssertionError):
+            csv_file_import.run(batch_size=3, workers=2)
+
+        self.assertEqual(20, csv_file_import.rows_imported)
+        self.assertEqual(count + 20, model.instance_count)
+        imported = model.get_instances().order_by('-pk').first()
+        self.assertEqual(text, imported.get('testtextfield').value)
+
+    def test_csv_file_import_run_workers_failed(self):
+        model = create_mock_model()
+        fields = model.schema.non_evaluated_fields
+        instance = create_mock_model_instance(model)[0]
+        count = model.instance_count
+
+        row = [to_import_value(instance.get(field.name).value) for field in fields]
+        rows = [[field.name for field in fields]] + [row] * 40
+        csv_file_import = self.create_csv_file_import(model, rows)
+
+        # the workers are threads here, sharing the failing chunk imports
+        with mock.patch('flexible.imports.ProcessPoolExecutor', ThreadPoolExecutor), \
+                mock.patch.object(CSVFileImport, '_import_chunk', side_effect=DatabaseError('failed')):
+            with self.assertRaises(DatabaseError):
+                csv_file_import.run(batch_size=3, workers=2)
+
+        csv_file_import = CSVFileImport.objects.get(pk=csv_file_import.pk)
+        self.assertEqual(CSVFileImport.STATUS_FAILED, csv_file_import.status)
+        self.assertIsNotNone(csv_file_import.finished)
+        self.assertEqual(count, model.instance_count)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from flexible.metrics import MetricsRollup
+
+
+class Command(BaseCommand):
+    help = "Compacts the metrics rollups past the retention of their period, to be run periodically"
+
+    def handle(self, *args, **options):
+        MetricsRollup.compact()
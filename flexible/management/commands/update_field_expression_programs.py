@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from flexible.models import Model
+from flexible.expressions import FieldExpression
+
+
+class Command(BaseCommand):
+    help = "Serialises the field expressions of models into their programs, such as expressions stored before programs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_ids', nargs='*', type=int,
+                            help="The ids of the models to update, all models when not given")
+
+    def handle(self, *args, **options):
+        models = Model.objects.all()
+        if len(options['model_ids']) > 0:
+            models = Model.objects.filter(pk__in=options['model_ids'])
+
+        for model in models:
+            FieldExpression.update_programs(model.pk)
+            self.stdout.write(f"Updated the field expression programs of model {model}")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from flexible.models import Model
+
+
+class Command(BaseCommand):
+    help = "Builds the opted in indexes on the json of model instances concurrently, dropping the rest"
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_ids', nargs='*', type=int,
+                            help="The ids of the models to update, all models when not given")
+
+    def handle(self, *args, **options):
+        models = Model.objects.all()
+        if len(options['model_ids']) > 0:
+            models = Model.objects.filter(pk__in=options['model_ids'])
+
+        for model in models:
+            model.update_json_indexes(concurrently=True)
+            self.stdout.write(f"Updated the json indexes of model {model}")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from flexible.models import Model
+
+
+class Command(BaseCommand):
+    help = "Creates and fills the projections of models, replacing outdated ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_ids', nargs='*', type=int,
+                            help="The ids of the models to update, all projected models when not given")
+
+    def handle(self, *args, **options):
+        models = Model.objects.filter(project=True)
+        if len(options['model_ids']) > 0:
+            models = Model.objects.filter(pk__in=options['model_ids'])
+
+        for model in models:
+            model.update_projection()
+            self.stdout.write(f"Updated the projection of model {model}")
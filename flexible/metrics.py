@@ -0,0 +1,785 @@
+import datetime
+
+from collections import Counter
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Q, Count, Sum, Min, Max
+from django.db.models.functions import Trunc
+from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.fields.jsonb import KeyTextTransform
+from django.utils import timezone
+
+from flexible.sketches import HyperLogLog, SpaceSaving
+from flexible.models import Model, ModelInstance, ModelSchema, Field, IntegerField, DecimalField, BooleanField, \
+    DateField, DurationField, TextField, EmailField
+
+
+def truncate_time(value, period):
+    """
+    Truncates a time to the start of its period, in the current time zone
+    :param value: datetime
+        The time to truncate
+    :param period: string
+        The period, one of the MetricsRollup periods
+    :return: datetime
+        The start of the period
+    """
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    # hours keep the offset of the time, even when the hour repeats
+    if period == MetricsRollup.PERIOD_HOUR:
+        return value.replace(minute=0, second=0, microsecond=0)
+
+    # days and months start at local midnight, whose offset may differ from the time's on daylight saving days
+    aware = timezone.is_aware(value)
+    if aware:
+        value = timezone.make_naive(value)
+
+    value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == MetricsRollup.PERIOD_MONTH:
+        value = value.replace(day=1)
+
+    return timezone.make_aware(value) if aware else value
+
+
+def get_field_changes(model_id, changes):
+    """
+    Finds the changed values of a model's fields generating metrics, unchanged values are left out
+    :param model_id: int
+        The id of the model
+    :param changes: list<tuple>
+        The creation time, old and new json of each changed instance, None when there was or is none
+    :return: dict
+        The fields mapped to the creation time, removed and added values of each change
+    """
+    try:
+        fields = ModelSchema.for_model(model_id).fields
+    except Model.DoesNotExist:
+        # the model may be deleted along with its instances
+        return {}
+
+    field_changes = {}
+    for field in fields:
+        if not field.generate_metrics:
+            continue
+
+        values = []
+        for created, old, new in changes:
+            has_old = old is not None and field.name in old
+            has_new = new is not None and field.name in new
+            if has_old and has_new and old[field.name] == new[field.name]:
+                continue
+            if has_old or has_new:
+                values.append((created, [old[field.name]] if has_old else [], [new[field.name]] if has_new else []))
+
+        if len(values) > 0:
+            field_changes[field] = values
+
+    return field_changes
+
+
+def update_metrics(model_id, changes, create=True):
+    """
+    Updates the metrics and rollups of a model's fields with the changes to the json of its instances
+    :param model_id: int
+        The id of the model
+    :param changes: list<tuple>
+        The creation time, old and new json of each changed instance, None when there was or is none
+    :param create: bool
+        Should missing metrics and rollups be created?
+    """
+    field_changes = get_field_changes(model_id, changes)
+    if len(field_changes) == 0:
+        return
+
+    with transaction.atomic():
+        FieldMetrics.update_for_changes(field_changes, create)
+        MetricsRollup.update_for_changes(field_changes, create)
+
+
+# the statistics of the values of a field, kept from the json of model instances
+class Metrics(models.Model):
+    # the fields summed, ranged and averaged
+    numeric_field_types = (IntegerField, DecimalField, DurationField)
+    # the fields ranged
+    ranged_field_types = numeric_field_types + (DateField,)
+    # the fields counting their values
+    counted_field_types = (TextField, EmailField)
+
+    # the default number of most common values
+    default_top = 10
+
+    # the number of instances with the field in their json
+    count = models.PositiveIntegerField(default=0)
+    # the number of those missing a value
+    null_count = models.PositiveIntegerField(default=0)
+    # the number of true values, for boolean fields
+    true_count = models.PositiveIntegerField(default=0)
+    # the sum of the values, for numeric fields, durations in seconds
+    total = models.DecimalField(max_digits=32, decimal_places=10, default=0)
+    # the range of the values as they appear in the json, for numeric and date fields
+    minimum = JSONField(null=True, blank=True)
+    maximum = JSONField(null=True, blank=True)
+    # the serialised sketches of the values added, for text and email fields
+    distinct_sketch = models.BinaryField(null=True, blank=True)
+    frequency_sketch = models.BinaryField(null=True, blank=True)
+
+    @property
+    def value_count(self):
+        """
+        The number of values
+        :return: int
+            The number of instances with a value
+        """
+        return self.count - self.null_count
+
+    @property
+    def mean(self):
+        """
+        The mean of the values, for numeric fields
+        :return: Decimal
+            The mean, None when there are no values
+        """
+        if self.value_count == 0:
+            return None
+        return Decimal(self.total) / self.value_count
+
+    @property
+    def true_ratio(self):
+        """
+        The ratio of true values, for boolean fields
+        :return: float
+            The ratio, None when there are no values
+        """
+        if self.value_count == 0:
+            return None
+        return self.true_count / self.value_count
+
+    @property
+    def distinct_count(self):
+        """
+        The estimated number of distinct values added, for text and email fields
+        :return: int
+            The estimated number of distinct values, None when there is no sketch
+        """
+        if self.distinct_sketch is None:
+            return None
+        return HyperLogLog.from_bytes(self.distinct_sketch).estimate()
+
+    def get_frequent(self, top=default_top):
+        """
+        The estimated most frequent values added, for text and email fields
+        :param top: int
+            The number of values to return
+        :return: list<tuple>
+            The values and their estimated counts, most frequent first
+        """
+        if self.frequency_sketch is None:
+            return []
+        return SpaceSaving.from_bytes(self.frequency_sketch).top(top)
+
+    def get_instances(self):
+        """
+        The instances the metrics are kept from
+        :return: QuerySet<ModelInstance>
+            The instances
+        """
+        raise NotImplementedError
+
+    def get_sketches(self):
+        """
+        :return: tuple
+            The sketches of the distinct and frequent values, empty when no values were added
+        """
+        distinct = HyperLogLog.from_bytes(self.distinct_sketch) if self.distinct_sketch is not None \
+            else HyperLogLog()
+        frequency = SpaceSaving.from_bytes(self.frequency_sketch) if self.frequency_sketch is not None \
+            else SpaceSaving()
+
+        return distinct, frequency
+
+    def set_sketches(self, distinct, frequency):
+        """
+        :param distinct: HyperLogLog
+            The sketch of the distinct values
+        :param frequency: SpaceSaving
+            The sketch of the frequent values
+        """
+        self.distinct_sketch = distinct.to_bytes()
+        self.frequency_sketch = frequency.to_bytes()
+
+    def update_sketches(self, counts):
+        """
+        Updates the sketches with the changes to the counts of values. Removed values are taken
+        off the frequent values, the distinct values only grow until the metrics are built again
+        :param counts: iterable<tuple>
+            The values and the change of their counts
+        """
+        distinct, frequency = self.get_sketches()
+
+        for value, count in counts:
+            if count > 0:
+                distinct.add(value)
+                frequency.add(value, count)
+            elif count < 0:
+                frequency.remove(value, -count)
+
+        self.set_sketches(distinct, frequency)
+
+    def merge_sketches(self, other):
+        """
+        Merges the sketches of other metrics into these, such as the metrics of other time buckets
+        :param other: Metrics
+            The metrics to merge
+        """
+        if other.distinct_sketch is None:
+            return
+        if self.distinct_sketch is None:
+            self.distinct_sketch = other.distinct_sketch
+            self.frequency_sketch = other.frequency_sketch
+            return
+
+        distinct = HyperLogLog.from_bytes(self.distinct_sketch)
+        distinct.merge(HyperLogLog.from_bytes(other.distinct_sketch))
+        frequency = SpaceSaving.from_bytes(self.frequency_sketch)
+        frequency.merge(SpaceSaving.from_bytes(other.frequency_sketch))
+
+        self.distinct_sketch = distinct.to_bytes()
+        self.frequency_sketch = frequency.to_bytes()
+
+    def merge(self, other):
+        """
+        Merges other metrics of the same field into these
+        :param other: Metrics
+            The metrics to merge
+        """
+        self.count += other.count
+        self.null_count += other.null_count
+        self.true_count += other.true_count
+        self.total += other.total
+        self.minimum = min((x for x in (self.minimum, other.minimum) if x is not None), default=None)
+        self.maximum = max((x for x in (self.maximum, other.maximum) if x is not None), default=None)
+        self.merge_sketches(other)
+
+    def to_dict(self, top=default_top):
+        """
+        The metrics as a dict, holding the metrics supported by the field
+        :param top: int
+            The number of most frequent values
+        :return: dict
+            The metrics of the field
+        """
+        metrics = {
+            'count': self.count,
+            'null_count': self.null_count,
+        }
+
+        field = self.field
+        if isinstance(field, self.numeric_field_types):
+            metrics.update({
+                'sum': self.total,
+                'mean': self.mean,
+            })
+        if isinstance(field, self.ranged_field_types):
+            metrics.update({
+                'min': self.minimum,
+                'max': self.maximum,
+            })
+        if isinstance(field, BooleanField):
+            metrics['true_ratio'] = self.true_ratio
+        if isinstance(field, self.counted_field_types):
+            metrics.update({
+                'distinct': self.distinct_count,
+                'frequent': self.get_frequent(top),
+            })
+
+        return metrics
+
+    @classmethod
+    def get_aggregates(cls, field):
+        """
+        The aggregates building the metrics of a field from instances
+        :param field: Field
+            The field to build the metrics of
+        :return: dict
+            The names of the metrics mapped to their aggregates
+        """
+        aggregates = {
+            'count': Count('pk', filter=Q(json__has_key=field.name)),
+            'null_count': Count('pk', filter=Q(json__contains={field.name: None})),
+        }
+        if isinstance(field, BooleanField):
+            aggregates['true_count'] = Count('pk', filter=Q(json__contains={field.name: True}))
+        if isinstance(field, cls.numeric_field_types):
+            aggregates['total'] = Sum(field.json_expression)
+        if isinstance(field, cls.ranged_field_types):
+            aggregates['minimum'] = Min(field.json_expression)
+            aggregates['maximum'] = Max(field.json_expression)
+
+        return aggregates
+
+    @classmethod
+    def get_value_counts(cls, field, instances, *group_by):
+        """
+        Counts the values of a field in the json of instances
+        :param field: Field
+            The field to count the values of
+        :param instances: QuerySet<ModelInstance>
+            The instances
+        :param group_by: list<string>
+            The optional other values to count by
+        :return: QuerySet
+            The other values, the values and their counts
+        """
+        return instances.filter(json__has_key=field.name) \
+            .annotate(metrics_value=KeyTextTransform(field.name, 'json')) \
+            .filter(metrics_value__isnull=False) \
+            .order_by().values_list(*group_by, 'metrics_value').annotate(metrics_count=Count('pk'))
+
+    def set_aggregates(self, values):
+        """
+        Sets the metrics to built values
+        :param values: dict
+            The values of the aggregates
+        """
+        self.count = values['count']
+        self.null_count = values['null_count']
+        self.true_count = values.get('true_count') or 0
+        self.total = values.get('total') or 0
+        self.minimum = values.get('minimum')
+        self.maximum = values.get('maximum')
+        self.distinct_sketch = None
+        self.frequency_sketch = None
+
+    def apply(self, removed, added):
+        """
+        Applies removed and added values, the range is built again when one of its ends is removed
+        :param removed: list
+            The removed values, as they appear in the json
+        :param added: list
+            The added values, as they appear in the json
+        """
+        field = self.field
+        removed_values = [x for x in removed if x is not None]
+        added_values = [x for x in added if x is not None]
+
+        self.count += len(added) - len(removed)
+        self.null_count += (len(added) - len(added_values)) - (len(removed) - len(removed_values))
+
+        if isinstance(field, BooleanField):
+            self.true_count += sum(1 for x in added_values if x) - sum(1 for x in removed_values if x)
+
+        if isinstance(field, self.numeric_field_types):
+            self.total += sum(Decimal(str(x)) for x in added_values) - sum(Decimal(str(x)) for x in removed_values)
+
+        outdated_range = False
+        if isinstance(field, self.ranged_field_types):
+            # removing an end of the range leaves the next value unknown
+            if self.minimum in removed_values or self.maximum in removed_values:
+                outdated_range = True
+            elif len(added_values) > 0:
+                self.minimum = min(added_values + ([self.minimum] if self.minimum is not None else []))
+                self.maximum = max(added_values + ([self.maximum] if self.maximum is not None else []))
+
+        if isinstance(field, self.counted_field_types):
+            counts = Counter(str(x) for x in added_values)
+            counts.subtract(str(x) for x in removed_values)
+            if any(x != 0 for x in counts.values()):
+                self.update_sketches(counts.items())
+
+        self.save()
+
+        if outdated_range:
+            values = self.get_instances().aggregate(minimum=Min(field.json_expression),
+                                                    maximum=Max(field.json_expression))
+            self.minimum = values['minimum']
+            self.maximum = values['maximum']
+            self.save(update_fields=['minimum', 'maximum'])
+
+    class Meta:
+        abstract = True
+
+
+class FieldMetricsQuerySet(models.QuerySet):
+    def for_model(self, model):
+        """
+        Filters down to the metrics of a model's fields
+        :param model: Model
+            The model of the fields
+        :return: QuerySet<FieldMetrics>
+            The metrics of the model's fields
+        """
+        return self.filter(field__model=model, field__generate_metrics=True)
+
+
+# the running statistics of a field with generate_metrics set, over all instances of its model
+class FieldMetrics(Metrics):
+    # the field the metrics are for
+    field = models.OneToOneField(Field, on_delete=models.CASCADE)
+
+    objects = FieldMetricsQuerySet.as_manager()
+
+    def get_instances(self):
+        return ModelInstance.objects.filter(model_id=self.field.model_id)
+
+    def to_dict(self, top=Metrics.default_top):
+        metrics = super().to_dict(top)
+        # the most common values, as estimated by the sketch
+        if isinstance(self.field, self.counted_field_types):
+            metrics['top'] = metrics['frequent']
+        return metrics
+
+    @classmethod
+    def get_model_metrics(cls, model, top=Metrics.default_top):
+        """
+        The metrics of a model's fields
+        :param model: Model
+            The model to get the metrics of
+        :param top: int
+            The number of most common values of text and email fields
+        :return: dict
+            The field names mapped to the metrics of the fields
+        """
+        fields = {x.pk: x for x in ModelSchema.for_model(model.pk).fields}
+
+        metrics = {}
+        for field_metrics in cls.objects.for_model(model).order_by('field__index'):
+            field_metrics.field = fields[field_metrics.field_id]
+            metrics[field_metrics.field.name] = field_metrics.to_dict(top)
+
+        return metrics
+
+    @classmethod
+    def update_for_changes(cls, field_changes, create=True):
+        """
+        Updates the metrics of fields with the changes to their values
+        :param field_changes: dict
+            The fields mapped to the creation time, removed and added values of each change
+        :param create: bool
+            Should missing metrics be created? They are built from all instances
+        """
+        with transaction.atomic():
+            metrics = {x.field_id: x for x in cls.objects.select_for_update().filter(field__in=field_changes.keys())}
+
+            for field, changes in field_changes.items():
+                field_metrics = metrics.get(field.pk)
+                if field_metrics is None:
+                    # the changes are saved already, so building from all instances includes them
+                    if create:
+                        cls.build(field)
+                    continue
+
+                field_metrics.field = field
+                field_metrics.apply([x for _, removed, _ in changes for x in removed],
+                                    [x for _, _, added in changes for x in added])
+
+    @classmethod
+    def build(cls, field):
+        """
+        Builds the metrics of a field from all instances of its model, replacing any previous
+        :param field: Field
+            The field to build the metrics of
+        :return: FieldMetrics
+            The built metrics
+        """
+        instances = ModelInstance.objects.filter(model_id=field.model_id)
+        values = instances.aggregate(**cls.get_aggregates(field))
+
+        with transaction.atomic():
+            field_metrics, _ = cls.objects.select_for_update().get_or_create(field=field)
+            field_metrics.set_aggregates(values)
+
+            if isinstance(field, cls.counted_field_types):
+                # the counts are streamed into the sketches, holding no more than the sketches
+                field_metrics.update_sketches(cls.get_value_counts(field, instances).iterator())
+
+            field_metrics.save()
+
+        return field_metrics
+
+    class Meta:
+        verbose_name_plural = "Field Metrics"
+
+    def __str__(self):
+        return f"{self.field} metrics"
+
+
+# the statistics of a field with generate_metrics set, over the instances created within a period
+class MetricsRollup(Metrics):
+    PERIOD_HOUR = 'hour'
+    PERIOD_DAY = 'day'
+    PERIOD_MONTH = 'month'
+
+    PERIOD_CHOICES = [
+        (PERIOD_HOUR, "Hour"),
+        (PERIOD_DAY, "Day"),
+        (PERIOD_MONTH, "Month"),
+    ]
+
+    # the periods from the finest to the coarsest
+    periods = (PERIOD_HOUR, PERIOD_DAY, PERIOD_MONTH)
+
+    # how long rollups of each period are kept, before compacting them into the next
+    # coarser period, or deleting them when coarsest. None keeps them forever
+    retention = {
+        PERIOD_HOUR: datetime.timedelta(days=2),
+        PERIOD_DAY: datetime.timedelta(days=90),
+        PERIOD_MONTH: None,
+    }
+
+    # the field the rollup is for
+    field = models.ForeignKey(Field, on_delete=models.CASCADE)
+    # the period of the rollup
+    period = models.CharField(max_length=8, choices=PERIOD_CHOICES)
+    # the start of the period
+    start = models.DateTimeField()
+
+    @property
+    def end(self):
+        """
+        The end of the period
+        :return: datetime
+            The start of the next period
+        """
+        if self.period == self.PERIOD_HOUR:
+            return self.start + datetime.timedelta(hours=1)
+
+        # days and months end at the next local midnight, days are not always 24 hours long
+        aware = timezone.is_aware(self.start)
+        start = timezone.make_naive(self.start) if aware else self.start
+        if self.period == self.PERIOD_DAY:
+            end = start + datetime.timedelta(days=1)
+        else:
+            end = (start + datetime.timedelta(days=32)).replace(day=1)
+
+        return timezone.make_aware(end) if aware else end
+
+    def get_instances(self):
+        return ModelInstance.objects.filter(model_id=self.field.model_id, created__gte=self.start,
+                                            created__lt=self.end)
+
+    @classmethod
+    def get_starts(cls, now=None):
+        """
+        The earliest times held by rollups of each period, rollups of earlier times are compacted.
+        Periods start on the start of the next coarser period, so that whole periods are compacted
+        :param now: datetime
+            The optional current time
+        :return: dict
+            The periods mapped to their earliest times, None when not limited
+        """
+        if now is None:
+            now = timezone.now()
+
+        starts = {}
+        for period, coarser in zip(cls.periods, cls.periods[1:] + (None,)):
+            retention = cls.retention[period]
+            if retention is None:
+                starts[period] = None
+            elif coarser is None:
+                starts[period] = truncate_time(now - retention, period)
+            else:
+                starts[period] = truncate_time(now - retention, coarser)
+
+        # finer periods never reach further back than coarser ones
+        for period, coarser in reversed(list(zip(cls.periods, cls.periods[1:]))):
+            if starts[coarser] is not None and (starts[period] is None or starts[period] < starts[coarser]):
+                starts[period] = starts[coarser]
+
+        return starts
+
+    @classmethod
+    def get_period(cls, created, starts):
+        """
+        The period of the rollup holding an instance
+        :param created: datetime
+            The creation time of the instance
+        :param starts: dict
+            The earliest times held by rollups of each period
+        :return: string
+            The period, None when the instance is past retention
+        """
+        for period in cls.periods:
+            if starts[period] is None or created >= starts[period]:
+                return period
+        return None
+
+    @classmethod
+    def update_for_changes(cls, field_changes, create=True):
+        """
+        Updates the rollups of fields with the changes to their values. Changes go to the finest
+        rollup holding the instance, which may be past the retention of its period until compacted
+        :param field_changes: dict
+            The fields mapped to the creation time, removed and added values of each change
+        :param create: bool
+            Should missing rollups be created?
+        """
+        starts = cls.get_starts()
+
+        with transaction.atomic():
+            # the rollups which may hold the changed instances, of any period
+            existing = {}
+            for field, changes in field_changes.items():
+                for period in cls.periods:
+                    period_starts = set(truncate_time(x, period) for x, _, _ in changes)
+                    for rollup in cls.objects.select_for_update().filter(field=field, period=period,
+                                                                        start__in=period_starts):
+                        existing[(field, period, rollup.start)] = rollup
+
+            # the removed and added values of each rollup
+            rollup_changes = {}
+            for field, changes in field_changes.items():
+                for created, removed, added in changes:
+                    key = next((x for x in ((field, y, truncate_time(created, y)) for y in cls.periods)
+                                if x in existing), None)
+                    if key is None:
+                        period = cls.get_period(created, starts)
+                        if period is None or not create:
+                            continue
+                        key = (field, period, truncate_time(created, period))
+                        # no rollup holds the instance, so its removed values were never added
+                        removed = []
+
+                    rollup_removed, rollup_added = rollup_changes.setdefault(key, ([], []))
+                    rollup_removed.extend(removed)
+                    rollup_added.extend(added)
+
+            for (field, period, start), (removed, added) in rollup_changes.items():
+                rollup = existing.get((field, period, start))
+                if rollup is None:
+                    rollup = cls(field=field, period=period, start=start)
+
+                rollup.field = field
+                rollup.apply(removed, added)
+
+    @classmethod
+    def build(cls, field, now=None):
+        """
+        Builds the rollups of a field from all instances of its model, replacing any previous
+        :param field: Field
+            The field to build the rollups of
+        :param now: datetime
+            The optional current time
+        """
+        starts = cls.get_starts(now)
+        instances = ModelInstance.objects.filter(model_id=field.model_id)
+
+        rollups = {}
+        end = None
+        for period in cls.periods:
+            period_instances = instances
+            if starts[period] is not None:
+                period_instances = period_instances.filter(created__gte=starts[period])
+            if end is not None:
+                period_instances = period_instances.filter(created__lt=end)
+            end = starts[period]
+
+            period_instances = period_instances.annotate(rollup_start=Trunc('created', period))
+
+            grouped = period_instances.order_by().values('rollup_start').annotate(**cls.get_aggregates(field))
+            for values in grouped:
+                rollup = cls(field=field, period=period, start=values['rollup_start'])
+                rollup.set_aggregates(values)
+                rollups[(period, rollup.start)] = rollup
+
+            if isinstance(field, cls.counted_field_types):
+                # the counts are streamed into the sketches of the rollups
+                sketches = {}
+                for start, value, count in cls.get_value_counts(field, period_instances, 'rollup_start').iterator():
+                    distinct, frequency = sketches.setdefault(start, (HyperLogLog(), SpaceSaving()))
+                    distinct.add(value)
+                    frequency.add(value, count)
+                for start, (distinct, frequency) in sketches.items():
+                    rollups[(period, start)].set_sketches(distinct, frequency)
+
+            if end is None:
+                break
+
+        with transaction.atomic():
+            cls.objects.filter(field=field).delete()
+            cls.objects.bulk_create(rollups.values())
+
+    @classmethod
+    def compact(cls, now=None):
+        """
+        Compacts the rollups past the retention of their period into rollups of the next coarser
+        period, and deletes the rollups past the retention of the coarsest period
+        :param now: datetime
+            The optional current time
+        """
+        starts = cls.get_starts(now)
+
+        with transaction.atomic():
+            for period, coarser in zip(cls.periods, cls.periods[1:]):
+                if starts[period] is None:
+                    continue
+
+                compacted = {}
+                outdated = cls.objects.select_for_update().filter(period=period, start__lt=starts[period])
+                for rollup in outdated:
+                    key = (rollup.field_id, truncate_time(rollup.start, coarser))
+                    target = compacted.get(key)
+                    if target is None:
+                        target = cls.objects.select_for_update().filter(field_id=key[0], period=coarser,
+                                                                        start=key[1]).first()
+                        if target is None:
+                            target = cls(field_id=key[0], period=coarser, start=key[1])
+                        compacted[key] = target
+                    target.merge(rollup)
+
+                for target in compacted.values():
+                    target.save()
+                outdated.delete()
+
+            coarsest = cls.periods[-1]
+            if starts[coarsest] is not None:
+                cls.objects.filter(period=coarsest, start__lt=starts[coarsest]).delete()
+
+    @classmethod
+    def get_series(cls, field, period, start=None, end=None, top=Metrics.default_top):
+        """
+        The metrics of a field over time, rollups of finer periods are merged into the period,
+        rollups of coarser periods are kept whole
+        :param field: Field
+            The field to get the metrics of
+        :param period: string
+            The period of the series
+        :param start: datetime
+            The optional earliest time of the series
+        :param end: datetime
+            The optional time the series ends before
+        :param top: int
+            The number of most frequent values of text and email fields
+        :return: list<tuple>
+            The start of each period and its metrics, in time order
+        """
+        rollups = cls.objects.filter(field=field)
+        if start is not None:
+            rollups = rollups.filter(start__gte=start)
+        if end is not None:
+            rollups = rollups.filter(start__lt=end)
+
+        index = cls.periods.index(period)
+        series = {}
+        for rollup in rollups.order_by('start'):
+            # finer rollups are merged into the period
+            if cls.periods.index(rollup.period) <= index:
+                key = truncate_time(rollup.start, period)
+            else:
+                key = rollup.start
+
+            merged = series.get(key)
+            if merged is None:
+                merged = series[key] = cls(field=field, period=max(rollup.period, period, key=cls.periods.index),
+                                           start=key)
+            merged.merge(rollup)
+
+        return [(x, series[x].to_dict(top)) for x in sorted(series)]
+
+    class Meta:
+        verbose_name_plural = "Metrics Rollups"
+        unique_together = ('field', 'period', 'start')
+
+    def __str__(self):
+        return f"{self.field} {self.period} rollup @ {self.start}"
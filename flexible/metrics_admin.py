@@ -0,0 +1,78 @@
+from django.contrib import admin
+
+from flexible.models import Field
+from flexible.metrics import FieldMetrics, MetricsRollup
+
+
+@admin.register(FieldMetrics)
+class FieldMetricsAdmin(admin.ModelAdmin):
+    list_display = [
+        '__str__',
+        'count',
+        'null_count',
+        'true_count',
+        'total',
+        'minimum',
+        'maximum',
+    ]
+
+    readonly_fields = [
+        'field',
+        'count',
+        'null_count',
+        'true_count',
+        'total',
+        'minimum',
+        'maximum',
+    ]
+
+    actions = [
+        'build_metrics',
+    ]
+
+    def build_metrics(self, request, queryset):
+        for field in Field.objects.filter(pk__in=queryset.values('field')):
+            FieldMetrics.build(field)
+    build_metrics.short_description = "Build selected field metrics from all instances"
+
+
+@admin.register(MetricsRollup)
+class MetricsRollupAdmin(admin.ModelAdmin):
+    list_display = [
+        '__str__',
+        'period',
+        'start',
+        'count',
+        'null_count',
+        'total',
+    ]
+
+    list_filter = [
+        'period',
+    ]
+
+    readonly_fields = [
+        'field',
+        'period',
+        'start',
+        'count',
+        'null_count',
+        'true_count',
+        'total',
+        'minimum',
+        'maximum',
+    ]
+
+    actions = [
+        'build_rollups',
+        'compact_rollups',
+    ]
+
+    def build_rollups(self, request, queryset):
+        for field in Field.objects.filter(pk__in=queryset.values('field')):
+            MetricsRollup.build(field)
+    build_rollups.short_description = "Build the rollups of the selected fields from all instances"
+
+    def compact_rollups(self, request, queryset):
+        MetricsRollup.compact()
+    compact_rollups.short_description = "Compact all rollups past their retention"
@@ -0,0 +1,258 @@
+from collections import Counter
+from decimal import Decimal
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from flexible.metrics import *
+from flexible.tests_utils import *
+
+
+class FieldMetricsTests(TestCase):
+    def assertMetrics(self, model):
+        jsons = [x.json for x in model.get_instances() if x.json is not None]
+        metrics = FieldMetrics.get_model_metrics(model)
+        fields = [x for x in model.schema.fields if x.generate_metrics]
+        self.assertEqual([x.name for x in fields], list(metrics.keys()))
+
+        for field in fields:
+            field_metrics = metrics[field.name]
+            values = [x[field.name] for x in jsons if field.name in x]
+            not_null = [x for x in values if x is not None]
+
+            self.assertEqual(len(values), field_metrics['count'])
+            self.assertEqual(len(values) - len(not_null), field_metrics['null_count'])
+
+            if isinstance(field, FieldMetrics.numeric_field_types):
+                total = sum(Decimal(str(x)) for x in not_null)
+                self.assertEqual(total, field_metrics['sum'])
+                self.assertAlmostEqual(float(total) / len(not_null), float(field_metrics['mean']))
+            if isinstance(field, FieldMetrics.ranged_field_types):
+                self.assertEqual(min(not_null), field_metrics['min'])
+                self.assertEqual(max(not_null), field_metrics['max'])
+            if isinstance(field, BooleanField):
+                self.assertEqual(sum(1 for x in not_null if x) / len(not_null), field_metrics['true_ratio'])
+            if isinstance(field, FieldMetrics.counted_field_types):
+                counts = sorted(Counter(not_null).items(), key=lambda x: (-x[1], x[0]))
+                self.assertEqual(counts[:FieldMetrics.default_top], field_metrics['top'])
+
+    def test_field_metrics_updates(self):
+        model = create_mock_model()
+        fields = model.schema.fields
+        integer_field, date_field, text_field = fields[15], fields[18], fields[14]
+
+        # metrics are kept from the json of instances
+        instances = [create_mock_model_instance(model)[0] for _ in range(5)]
+        for instance in instances:
+            instance.update_json()
+        self.assertMetrics(model)
+
+        # updated values replace the old ones, including the ends of the range
+        maximum = max(instances, key=lambda x: x.json[integer_field.name])
+        for instance, field, value in ((maximum, integer_field, -10000), (instances[0], text_field, 'common'),
+                                       (instances[1], text_field, 'common'),
+                                       (instances[2], date_field, datetime.date(2000, 1, 1))):
+            field_instance = instance.get(field.name)
+            field_instance.value = value
+            field_instance.save()
+            instance.mark_changed([field.name])
+            instance.on_update()
+        self.assertMetrics(model)
+        self.assertEqual(('common', 2), FieldMetrics.get_model_metrics(model)['testtextfieldwithmetrics']['top'][0])
+
+        # missing values are counted as nulls
+        instances[3].get(integer_field.name).delete()
+        instances[3].fields[integer_field.name] = None
+        instances[3].mark_changed([integer_field.name])
+        instances[3].on_update()
+        self.assertMetrics(model)
+
+        # a missing integer is a null rather than a zero, leaving the range and mean to the values
+        integer_metrics = FieldMetrics.get_model_metrics(model)[integer_field.name]
+        values = [x.get(integer_field.name) for x in model.get_instances()]
+        values = [x.value for x in values if x is not None]
+        self.assertEqual(1, integer_metrics['null_count'])
+        self.assertEqual(min(values), integer_metrics['min'])
+        self.assertAlmostEqual(sum(values) / len(values), float(integer_metrics['mean']))
+
+        # deleted instances are removed
+        instances[2].delete()
+        self.assertMetrics(model)
+
+        # updating the json of all instances keeps the metrics
+        create_mock_model_instance(model)
+        model.update_instances_json(batch_size=2)
+        self.assertMetrics(model)
+
+    def test_field_metrics_build(self):
+        model = create_mock_model()
+        instances = [create_mock_model_instance(model)[0] for _ in range(3)]
+        for instance in instances:
+            instance.update_json()
+        expected = FieldMetrics.get_model_metrics(model)
+
+        # building from all instances gives the same metrics
+        FieldMetrics.objects.for_model(model).delete()
+        self.assertEqual({}, FieldMetrics.get_model_metrics(model))
+        for field in model.schema.fields:
+            if field.generate_metrics:
+                FieldMetrics.build(field)
+        self.assertEqual(expected, FieldMetrics.get_model_metrics(model))
+
+        # fields no longer generating metrics lose them
+        field = model.schema.get('testintegerfieldwithmetrics')
+        field = Field.objects.get(pk=field.pk)
+        field.generate_metrics = False
+        field.save()
+        self.assertNotIn(field.name, FieldMetrics.get_model_metrics(model))
+        self.assertFalse(FieldMetrics.objects.filter(field=field).exists())
+
+        # fields generating metrics have them built
+        field.generate_metrics = True
+        field.save()
+        self.assertEqual(expected[field.name], FieldMetrics.get_model_metrics(model)[field.name])
+
+        # saves leaving the flag as it was keep the metrics
+        field = Field.objects.get(pk=field.pk)
+        field.description = 'Described'
+        with mock.patch.object(FieldMetrics, 'build') as build, \
+                mock.patch.object(MetricsRollup, 'build') as rollup_build:
+            field.save()
+            field.save()
+        build.assert_not_called()
+        rollup_build.assert_not_called()
+        self.assertEqual(expected[field.name], FieldMetrics.get_model_metrics(model)[field.name])
+
+
+class MetricsRollupTests(TestCase):
+    def get_series(self, model, period):
+        return {x.name: MetricsRollup.get_series(x, period) for x in model.schema.fields if x.generate_metrics}
+
+    def test_metrics_rollups_updates(self):
+        model = create_mock_model()
+        instances = [create_mock_model_instance(model)[0] for _ in range(4)]
+        for instance in instances:
+            instance.update_json()
+
+        # building from all instances gives the same rollups
+        expected = self.get_series(model, MetricsRollup.PERIOD_HOUR)
+        for field in model.schema.fields:
+            if field.generate_metrics:
+                MetricsRollup.build(field)
+        self.assertEqual(expected, self.get_series(model, MetricsRollup.PERIOD_HOUR))
+
+        # rollups are kept as instances change, totalling the metrics of the fields
+        instances[0].delete()
+        instances[1].get('testintegerfieldwithmetrics').delete()
+        instances[1].fields['testintegerfieldwithmetrics'] = None
+        instances[1].mark_changed(['testintegerfieldwithmetrics'])
+        instances[1].on_update()
+
+        metrics = FieldMetrics.get_model_metrics(model)
+        for name, series in self.get_series(model, MetricsRollup.PERIOD_MONTH).items():
+            self.assertEqual(1, len(series))
+            self.assertEqual({x: y for x, y in metrics[name].items() if x != 'top'}, series[0][1])
+
+    @override_settings(USE_TZ=True, TIME_ZONE='Australia/Sydney')
+    def test_metrics_rollups_daylight_saving(self):
+        # daylight saving ends on the 5th of april and starts on the 4th of october 2026 in sydney
+        created = timezone.make_aware(datetime.datetime(2026, 4, 5, 12, 30))
+        day = truncate_time(created, MetricsRollup.PERIOD_DAY)
+        self.assertEqual(timezone.make_aware(datetime.datetime(2026, 4, 5)), day)
+        self.assertEqual(datetime.timedelta(hours=11), day.utcoffset())
+        self.assertEqual(datetime.timedelta(hours=25), MetricsRollup(period=MetricsRollup.PERIOD_DAY, start=day).end - day)
+
+        month = truncate_time(timezone.make_aware(datetime.datetime(2026, 10, 20, 8)), MetricsRollup.PERIOD_MONTH)
+        self.assertEqual(datetime.timedelta(hours=10), month.utcoffset())
+        end = MetricsRollup(period=MetricsRollup.PERIOD_MONTH, start=month).end
+        self.assertEqual(timezone.make_aware(datetime.datetime(2026, 11, 1)), end)
+        self.assertEqual(datetime.timedelta(hours=11), end.utcoffset())
+
+        # the hours of the day keep their own offsets
+        hour = truncate_time(timezone.make_aware(datetime.datetime(2026, 4, 5, 14, 45)), MetricsRollup.PERIOD_HOUR)
+        self.assertEqual(timezone.make_aware(datetime.datetime(2026, 4, 5, 14)), hour)
+
+        # built rollups start where updated rollups do
+        model = create_mock_model()
+        instance = create_mock_model_instance(model)[0]
+        ModelInstance.objects.filter(pk=instance.pk).update(created=created)
+        field = next(x for x in model.schema.fields if x.generate_metrics)
+        MetricsRollup.build(field, now=created + datetime.timedelta(days=10))
+        rollups = MetricsRollup.objects.filter(field=field, period=MetricsRollup.PERIOD_DAY)
+        self.assertEqual(1, rollups.count())
+        self.assertTrue(rollups.filter(start=day).exists())
+
+    def test_metrics_rollups_compact(self):
+        model = create_mock_model()
+        instances = [create_mock_model_instance(model)[0] for _ in range(6)]
+        for instance in instances:
+            instance.update_json()
+
+        # spread the instances over more than a year
+        now = timezone.now()
+        for days, instance in zip((0, 1, 5, 40, 150, 400), instances):
+            ModelInstance.objects.filter(pk=instance.pk).update(created=now - datetime.timedelta(days=days))
+        fields = [x for x in model.schema.fields if x.generate_metrics]
+
+        # newer instances are rolled up by finer periods
+        for field in fields:
+            MetricsRollup.build(field, now)
+        periods = Counter(MetricsRollup.objects.filter(field=fields[0]).values_list('period', flat=True))
+        self.assertEqual({'hour': 2, 'day': 2, 'month': 2}, dict(periods))
+        expected = self.get_series(model, MetricsRollup.PERIOD_MONTH)
+        self.assertEqual(sum(1 for x in instances if x.json['testintegerfieldwithmetrics'] is not None),
+                         sum(x['count'] for _, x in expected['testintegerfieldwithmetrics']))
+
+        # compacting rollups of the past into coarser ones gives the same as building them
+        for field in fields:
+            MetricsRollup.build(field, now - datetime.timedelta(days=1000))
+        self.assertEqual({'hour'}, set(MetricsRollup.objects.values_list('period', flat=True)))
+        MetricsRollup.compact(now)
+        self.assertEqual(expected, self.get_series(model, MetricsRollup.PERIOD_MONTH))
+        self.assertEqual(dict(periods),
+                         dict(Counter(MetricsRollup.objects.filter(field=fields[0]).values_list('period', flat=True))))
+
+        # rollups past the retention of the coarsest period are deleted
+        with mock.patch.dict(MetricsRollup.retention, {MetricsRollup.PERIOD_MONTH: datetime.timedelta(days=365)}):
+            MetricsRollup.compact(now)
+        self.assertEqual(1, MetricsRollup.objects.filter(field=fields[0], period=MetricsRollup.PERIOD_MONTH).count())
+
+    def test_metrics_rollups_uncompacted_updates(self):
+        model = create_mock_model()
+        instance = create_mock_model_instance(model)[0]
+        instance.update_json()
+
+        # the instance was created days ago, and its rollups were not compacted since
+        now = timezone.now()
+        created = now - datetime.timedelta(days=3)
+        ModelInstance.objects.filter(pk=instance.pk).update(created=created)
+        instance = ModelInstance.objects.get(pk=instance.pk)
+        fields = [x for x in model.schema.fields if x.generate_metrics]
+        for field in fields:
+            MetricsRollup.build(field, created)
+        self.assertEqual({'hour'}, set(MetricsRollup.objects.values_list('period', flat=True)))
+
+        # changes go to the hour rollup still holding the instance
+        field_name = 'testtextfieldwithmetrics'
+        field_instance = instance.get(field_name)
+        if field_instance is not None:
+            field_instance.delete()
+        instance.fields[field_name] = None
+        instance.mark_changed([field_name])
+        instance.on_update()
+        instance.fields[field_name] = model.schema.get(field_name).create_instance(instance, 'changed')
+        instance.mark_changed([field_name])
+        instance.on_update()
+
+        self.assertEqual({'hour'}, set(MetricsRollup.objects.values_list('period', flat=True)))
+        rollup = MetricsRollup.objects.get(field__name=field_name)
+        self.assertEqual((1, 0), (rollup.count, rollup.null_count))
+
+        # compacting moves the rollups on to their period
+        call_command('compact_metrics_rollups')
+        self.assertEqual({'day'}, set(MetricsRollup.objects.values_list('period', flat=True)))
+        metrics = MetricsRollup.get_series(model.schema.get(field_name), MetricsRollup.PERIOD_DAY)[0][1]
+        self.assertEqual((1, 0), (metrics['count'], metrics['null_count']))
+        self.assertIn(('changed', 1), metrics['frequent'])
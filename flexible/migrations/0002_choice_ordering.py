@@ -0,0 +1,37 @@
+# Generated by Django 2.2.24 on 2026-10-16 21:23
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flexible', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='datefieldchoice',
+            options={'ordering': ('index',), 'verbose_name_plural': 'Date Field choices'},
+        ),
+        migrations.AlterModelOptions(
+            name='decimalfieldchoice',
+            options={'ordering': ('index',), 'verbose_name_plural': 'Decimal Field choices'},
+        ),
+        migrations.AlterModelOptions(
+            name='durationfieldchoice',
+            options={'ordering': ('index',), 'verbose_name_plural': 'Duration Field choices'},
+        ),
+        migrations.AlterModelOptions(
+            name='emailfieldchoice',
+            options={'ordering': ('index',), 'verbose_name_plural': 'Email Field choices'},
+        ),
+        migrations.AlterModelOptions(
+            name='integerfieldchoice',
+            options={'ordering': ('index',), 'verbose_name_plural': 'Integer Field choices'},
+        ),
+        migrations.AlterModelOptions(
+            name='textfieldchoice',
+            options={'ordering': ('index', 'value'), 'verbose_name_plural': 'Text Field choices'},
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 2.2.24 on 2026-10-16 21:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flexible', '0002_choice_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvfileimport',
+            name='finished',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='csvfileimport',
+            name='has_header',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='csvfileimport',
+            name='ignore_choices',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='csvfileimport',
+            name='max_rows',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='csvfileimport',
+            name='model',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='flexible.Model'),
+        ),
+        migrations.AddField(
+            model_name='csvfileimport',
+            name='rows_failed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='csvfileimport',
+            name='rows_imported',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='csvfileimport',
+            name='rows_processed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='csvfileimport',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='csvfileimport',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], default='pending', max_length=16),
+        ),
+        migrations.CreateModel(
+            name='CSVFileImportError',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.PositiveIntegerField()),
+                ('message', models.TextField()),
+                ('csv_file_import', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='flexible.CSVFileImport')),
+            ],
+            options={
+                'verbose_name_plural': 'CSV File Import Errors',
+                'ordering': ('row',),
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.24 on 2026-10-16 21:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flexible', '0003_csv_file_import_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='field',
+            name='index_json',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='model',
+            name='index_json',
+            field=models.BooleanField(default=False),
+        ),
+    ]
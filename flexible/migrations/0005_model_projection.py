@@ -0,0 +1,18 @@
+# Generated by Django 2.2.24 on 2026-10-16 21:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flexible', '0004_json_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='model',
+            name='project',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.24 on 2026-10-16 21:48
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flexible', '0005_model_projection'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FieldMetrics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('null_count', models.PositiveIntegerField(default=0)),
+                ('true_count', models.PositiveIntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=10, default=0, max_digits=32)),
+                ('minimum', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('maximum', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('field', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='flexible.Field')),
+            ],
+            options={
+                'verbose_name_plural': 'Field Metrics',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.24 on 2026-10-16 21:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flexible', '0006_field_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fieldmetrics',
+            name='distinct_sketch',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fieldmetrics',
+            name='frequency_sketch',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.24 on 2026-10-16 22:00
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def date_model_instances(apps, schema_editor):
+    # the creation times of existing instances are unknown, date them at the creation of their model, the earliest
+    # they could have been created, rather than all at the time of the migration
+    Model = apps.get_model('flexible', 'Model')
+    ModelInstance = apps.get_model('flexible', 'ModelInstance')
+    ModelInstance.objects.update(created=models.Subquery(Model.objects.filter(pk=models.OuterRef('model_id'))
+                                                         .values('created')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flexible', '0007_metrics_sketches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='modelinstance',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(date_model_instances, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='MetricsRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('null_count', models.PositiveIntegerField(default=0)),
+                ('true_count', models.PositiveIntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=10, default=0, max_digits=32)),
+                ('minimum', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('maximum', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('distinct_sketch', models.BinaryField(blank=True, null=True)),
+                ('frequency_sketch', models.BinaryField(blank=True, null=True)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('month', 'Month')], max_length=8)),
+                ('start', models.DateTimeField()),
+                ('field', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='flexible.Field')),
+            ],
+            options={
+                'verbose_name_plural': 'Metrics Rollups',
+                'unique_together': {('field', 'period', 'start')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.24 on 2026-10-16 22:07
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flexible', '0008_metrics_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fieldexpression',
+            name='program',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -3,14 +3,27 @@ import logging
 import html
 import csv
 import io
+import itertools
+import uuid
+import hashlib
+import json
 import datetime
+import bisect
 
 from django import forms
-from django.db import models
-from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import models, transaction, connection
+from django.db.models import prefetch_related_objects
+from django.db.models.functions import Cast
+from django.db.models.query import ModelIterable
+from django.db.backends.utils import names_digest, truncate_name
+from django.core.cache import cache
+from django.urls import reverse, NoReverseMatch
+from django.dispatch import Signal
+from django.core.exceptions import ObjectDoesNotExist, ValidationError, FieldError
 from django.utils.translation import gettext as _
 from django.utils.text import slugify
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.fields.jsonb import KeyTextTransform
 
 from polymorphic.models import PolymorphicModel
 
@@ -21,6 +34,10 @@ from decimal import Decimal, InvalidOperation
 
 logger = logging.getLogger(__file__)
 
+# sent when the saved json of model instances changes, with the model id and a list of
+# the creation time, old and new json of each instance, None when there was or is none
+model_instances_json_changed = Signal(providing_args=['model_id', 'changes'])
+
 
 def selectors_escape(s):
     """
@@ -36,11 +53,18 @@ def selectors_escape(s):
     return s
 
 
+class Echo:
+    # a file-like object returning what is written, lets csv.writer produce lines one at a time
+    def write(self, value):
+        return value
+
+
 # the flexible model definition
 class Model(models.Model):
     error_messages = {
         'column_count_mismatch': _("Column count is mismatched"),
         'too_many_rows': _("Too many csv rows provided"),
+        'concurrent_index_in_transaction': _("Json indexes cannot be built concurrently inside a transaction"),
     }
 
     # the name of the model
@@ -53,10 +77,13 @@ class Model(models.Model):
     ready = models.BooleanField(default=False)
     # a reference to the default model where this model is copied from
     copied_from = models.ForeignKey('self', null=True, blank=True, default=None, on_delete=models.SET_NULL)
+    # should the json of the model's instances be indexed for containment queries?
+    index_json = models.BooleanField(default=False)
+    # should the model's instances be projected into a wide table?
+    project = models.BooleanField(default=False)
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._fields = None
+    # the compiled schema of the model, resolved once for the model object
+    _schema = None
 
     def create_instance(self):
         """
@@ -90,6 +117,243 @@ class Model(models.Model):
         """
         return self.modelinstance_set.all()
 
+    @property
+    def instances(self):
+        """
+        The instances of the model, filtered and ordered by field names under the fields namespace
+        :return: QuerySet<ModelInstance>
+            The set of instances of this model
+        """
+        return ModelInstance.objects.for_model(self)
+
+    def update_json_indexes(self, concurrently=False):
+        """
+        Creates the opted in indexes on the json of the model's instances and drops the rest.
+        A GIN index serves containment queries on the whole json, a btree index on the json
+        value of each indexed field serves json_filter and json_order_by
+        :param concurrently: bool
+            Should the indexes be built and dropped without locking out writes? This must run outside
+            a transaction, as the update_json_indexes command does. Indexes left invalid by a failed
+            concurrent build are built again
+        """
+        if concurrently and transaction.get_connection().in_atomic_block:
+            raise RuntimeError(self.error_messages['concurrent_index_in_transaction'])
+
+        table = connection.ops.quote_name(ModelInstance._meta.db_table)
+        query = ModelInstance.objects.for_model(self).query
+        compiler = query.get_compiler(connection=connection)
+        prefix = f'flexible_json_{self.pk}'
+        option = ' CONCURRENTLY' if concurrently else ''
+
+        # the indexes are partial, covering the instances of this model only
+        indexes = {}
+        if self.index_json:
+            indexes[prefix] = (f"USING gin ({connection.ops.quote_name('json')} jsonb_path_ops)", [])
+        for field in self.get_fields().filter(index_json=True):
+            sql, params = field.json_expression.resolve_expression(query).as_sql(compiler, connection)
+            # the name changes with the expression, so that outdated indexes are replaced
+            digest = names_digest(sql % tuple(params), length=8)
+            indexes[f'{prefix}_{field.pk}_{digest}'] = (f"(({sql}))", list(params))
+
+        existing = self._get_json_index_validity()
+        valid = {x for x, is_valid in existing.items() if is_valid}
+        with connection.cursor() as cursor:
+            for name in existing.keys() - (indexes.keys() & valid):
+                cursor.execute(f"DROP INDEX{option} IF EXISTS {connection.ops.quote_name(name)}")
+            for name in indexes.keys() - valid:
+                sql, params = indexes[name]
+                cursor.execute(f"CREATE INDEX{option} {connection.ops.quote_name(name)} ON {table} {sql} "
+                               f"WHERE {connection.ops.quote_name('model_id')} = %s", params + [self.pk])
+
+    def drop_json_indexes(self):
+        """
+        Drops all indexes on the json of the model's instances
+        """
+        with connection.cursor() as cursor:
+            for name in self.get_json_indexes():
+                cursor.execute(f"DROP INDEX IF EXISTS {connection.ops.quote_name(name)}")
+
+    def get_json_indexes(self):
+        """
+        The indexes on the json of the model's instances, including those left invalid
+        :return: set<string>
+            The names of the indexes
+        """
+        return set(self._get_json_index_validity())
+
+    def _get_json_index_validity(self):
+        """
+        :return: dict
+            The names of the indexes on the json of the model's instances mapped to whether they are valid
+        """
+        prefix = f'flexible_json_{self.pk}'
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT index_class.relname, pg_index.indisvalid FROM pg_index "
+                           "JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid "
+                           "JOIN pg_class table_class ON table_class.oid = pg_index.indrelid "
+                           "WHERE table_class.relname = %s AND index_class.relname LIKE %s",
+                           [ModelInstance._meta.db_table, f'{prefix}%'])
+            rows = cursor.fetchall()
+
+        return {name: is_valid for name, is_valid in rows if name == prefix or name.startswith(f'{prefix}_')}
+
+    @property
+    def projection_table(self):
+        """
+        The name of the wide table projecting the model's instances
+        :return: string
+            The table name
+        """
+        return f'flexible_projection_{self.pk}'
+
+    def update_projection(self):
+        """
+        Creates the wide table projecting the model's instances, replacing any previous
+        one, and fills it. The table has a typed column per field, read from the instance json.
+        The new table is filled without locking the instances, then swapped in by a short transaction,
+        readers see the previous table until then. Instances created or deleted meanwhile are caught
+        up after the swap, those updated meanwhile are refreshed when next saved
+        """
+        # instances are projected from their json, compile any missing
+        if self.modelinstance_set.filter(json__isnull=True).exists():
+            self.update_instances_json()
+
+        table = connection.ops.quote_name(self.projection_table)
+        new_table_name = f'{self.projection_table}_new'
+        new_table = connection.ops.quote_name(new_table_name)
+        definitions = self._get_projection_definitions(self.get_projection_columns())
+
+        with connection.cursor() as cursor:
+            # concurrent updates of the projection wait for each other
+            cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", [self.projection_table])
+            try:
+                last_id = self.modelinstance_set.aggregate(last_id=models.Max('pk'))['last_id'] or 0
+
+                cursor.execute(f"DROP TABLE IF EXISTS {new_table}")
+                cursor.execute(f"CREATE TABLE {new_table} ({definitions})")
+                self._fill_projection(table=new_table_name)
+
+                with transaction.atomic():
+                    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+                    cursor.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+                    cursor.execute(f"ALTER TABLE {table} RENAME CONSTRAINT "
+                                   f"{connection.ops.quote_name(f'{new_table_name}_pkey')} TO "
+                                   f"{connection.ops.quote_name(f'{self.projection_table}_pkey')}")
+                    # the column definitions identify the table, so that outdated ones are replaced
+                    cursor.execute(f"COMMENT ON TABLE {table} IS %s", [names_digest(definitions, length=8)])
+
+                # catch up with the instances created and deleted while filling
+                created_ids = list(self.modelinstance_set.filter(pk__gt=last_id).values_list('pk', flat=True))
+                if len(created_ids) > 0:
+                    self._fill_projection(created_ids)
+                cursor.execute(f"DELETE FROM {table} WHERE NOT EXISTS (SELECT 1 FROM "
+                               f"{connection.ops.quote_name(ModelInstance._meta.db_table)} WHERE "
+                               f"{connection.ops.quote_name('id')} = {table}."
+                               f"{connection.ops.quote_name('model_instance_id')})")
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", [self.projection_table])
+
+        self.schema.projection_updated = True
+
+    def refresh_projection(self, model_instance_ids=None):
+        """
+        Refreshes the rows of the wide table projecting the model's instances. Tables missing
+        columns or fields are left as they are until replaced by update_projection
+        :param model_instance_ids: list<int>
+            The optional ids of the instances to refresh, all when not given
+        :return: bool
+            True when refreshed, False when the table is outdated
+        """
+        schema = self.schema
+
+        # check the table once per schema, the schema is replaced when the fields change
+        if not schema.projection_updated:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT obj_description(to_regclass(%s), 'pg_class')", [self.projection_table])
+                digest = cursor.fetchone()[0]
+
+            # the column definitions identify the table, outdated tables are checked again each time
+            definitions = self._get_projection_definitions(self.get_projection_columns())
+            if digest != names_digest(definitions, length=8):
+                logger.warning(f"The projection of model {self.pk} is outdated, update it to refresh it")
+                return False
+
+            schema.projection_updated = True
+
+        self._fill_projection(model_instance_ids)
+        return True
+
+    def _fill_projection(self, model_instance_ids=None, table=None):
+        columns = self.get_projection_columns()
+        if table is None:
+            table = self.projection_table
+        names = ', '.join([connection.ops.quote_name('model_instance_id')] + [x[0] for x in columns])
+        values = ', '.join([connection.ops.quote_name('id')] + [x[2] for x in columns])
+        params = [x for column in columns for x in column[3]] + [self.pk]
+        updates = ', '.join(f"{x[0]} = EXCLUDED.{x[0]}" for x in columns)
+
+        sql = (f"INSERT INTO {connection.ops.quote_name(table)} ({names}) "
+               f"SELECT {values} FROM {connection.ops.quote_name(ModelInstance._meta.db_table)} "
+               f"WHERE {connection.ops.quote_name('model_id')} = %s AND {connection.ops.quote_name('json')} IS NOT NULL")
+        if model_instance_ids is not None:
+            sql += f" AND {connection.ops.quote_name('id')} = ANY(%s)"
+            params.append(list(model_instance_ids))
+        if len(updates) > 0:
+            sql += f" ON CONFLICT ({connection.ops.quote_name('model_instance_id')}) DO UPDATE SET {updates}"
+        else:
+            sql += " ON CONFLICT DO NOTHING"
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def drop_projection(self):
+        """
+        Drops the wide table projecting the model's instances
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {connection.ops.quote_name(self.projection_table)}")
+            cursor.execute(f"DROP TABLE IF EXISTS {connection.ops.quote_name(f'{self.projection_table}_new')}")
+
+    def delete_projection_rows(self, model_instance_ids):
+        """
+        Deletes the rows of deleted instances from the wide table projecting the model's instances,
+        the table does not reference the instances so that replacing it leaves them unlocked
+        :param model_instance_ids: list<int>
+            The ids of the deleted instances
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [connection.ops.quote_name(self.projection_table)])
+            if cursor.fetchone()[0] is not None:
+                cursor.execute(f"DELETE FROM {connection.ops.quote_name(self.projection_table)} "
+                               f"WHERE {connection.ops.quote_name('model_instance_id')} = ANY(%s)",
+                               [list(model_instance_ids)])
+
+    def get_projection_columns(self):
+        """
+        The columns of the wide table projecting the model's instances, a column per field
+        typed as the values of the field's instances
+        :return: list<tuple>
+            The quoted column name, database type, json value sql and its params of each column
+        """
+        query = ModelInstance.objects.for_model(self).query
+        compiler = query.get_compiler(connection=connection)
+
+        columns = []
+        for field in self.schema.fields:
+            value_field = field.value_field
+            expression = Cast(KeyTextTransform(field.name, 'json'), value_field)
+            sql, params = expression.resolve_expression(query).as_sql(compiler, connection)
+            columns.append((connection.ops.quote_name(truncate_name(field.name, connection.ops.max_name_length())),
+                            value_field.db_type(connection), sql, list(params)))
+
+        return columns
+
+    def _get_projection_definitions(self, columns):
+        # the rows of deleted instances are deleted by delete_projection_rows, rather than a foreign key
+        # locking the instances of every model while the table is replaced
+        return ', '.join([f"{connection.ops.quote_name('model_instance_id')} integer PRIMARY KEY"] +
+                         [f"{column} {db_type}" for column, db_type, _, _ in columns])
+
     def copy(self, name=None):
         """
         Copies the model
@@ -134,37 +398,57 @@ class Model(models.Model):
 
     def js(self, indent=''):
         """
-        The expressions of the model as js
+        The expressions of the model as js, generated each time, see ModelSchema.js for the cached js.
+        Each expression becomes a function, bound by flexibleBindExpressions in scripts/flexible.js
+        to the inputs of the fields its conditions read
         :return: string
             The expressions of this model as js
         """
+        expressions = list(self.modelexpression_set.all())
+        if len(expressions) == 0:
+            return ''
+
+        fields = {x.name: x for x in self.schema.fields}
+
+        # the parts are joined once, rather than growing the string with each
+        parts = []
+        function_names = []
+        # the input ids mapped to the indices of the expressions reading them
+        dependents = {}
+        # the indices of the expressions which may read any input
+        any_dependents = []
+        for i, expression in enumerate(expressions):
+            function_name = f'onFieldSetChange{i}'
+            function_names.append(function_name)
+            parts.extend([
+                indent + f'function {function_name}()\n',
+                indent + '{\n',
+                indent + f'{expression.js(indent + JS_INDENT)}\n',
+                indent + '}\n',
+                indent + '\n',
+            ])
+
+            dependencies = expression.dependencies()
+            if dependencies is None:
+                any_dependents.append(i)
+                continue
+            for name in sorted(dependencies):
+                if name in fields:
+                    dependents.setdefault(f'id_{name}', []).append(i)
+
+        parts.append(indent + f'flexibleBindExpressions([{", ".join(function_names)}], '
+                              f'{json.dumps(dependents, sort_keys=True)}, {json.dumps(any_dependents)});')
+
+        return ''.join(parts)
 
-        expressions = self.modelexpression_set.all()
-        js = ''
-        if expressions.count() > 0:
-            js_on_field_set_change_func_name = 'onFieldSetChange'
-            js = indent + f'function {js_on_field_set_change_func_name}()\n'
-            js = js + indent + '{\n'
-
-            for expression in expressions:
-                js = js + indent + f'{expression.js(indent + JS_INDENT)}\n'
-            js = js + indent + '}\n'
-
-            field_change_js = f'$(\'form :input\').on(\'keypress change focusout\', function()\n'
-            field_change_js = field_change_js + indent + JS_INDENT + '{\n'
-            field_change_js = field_change_js + indent + JS_INDENT + JS_INDENT + f'{js_on_field_set_change_func_name}();\n'
-            field_change_js = field_change_js + indent + JS_INDENT + '})'
-
-            document_ready_js = '$(document).ready(function()\n'
-            document_ready_js = document_ready_js + indent + '{\n'
-            document_ready_js = document_ready_js + indent + JS_INDENT + f'{js_on_field_set_change_func_name}();\n'
-            document_ready_js = document_ready_js + indent + JS_INDENT + f'{field_change_js}\n'
-            document_ready_js = document_ready_js + indent + '});'
-
-            js = js + indent + f'\n'
-            js = js + indent + document_ready_js
-
-        return js
+    @property
+    def js_url(self):
+        """
+        The url serving the cached js of the model, versioned so that browsers may cache it
+        :return: string
+            The url of the js, requires the flexible urls to be included
+        """
+        return reverse('flexible:model_js', args=[self.pk]) + f'?v={self.schema.js_version}'
 
     def clean_values(self, fields):
         """
@@ -174,12 +458,93 @@ class Model(models.Model):
         :return: dict
             The cleaned dictionary of fields
         """
-        expressions = self.modelexpression_set.all()
-        for expression in expressions:
-            expression.execute(fields)
+        for expression in self.schema.model_expressions:
+            expression(fields)
 
         return fields
 
+    def update_instances_json(self, batch_size=1000):
+        """
+        Updates the compiled json of all instances of the model, evaluating
+        the evaluated fields for a batch of instances at a time
+        :param batch_size: int
+            The number of instances to update at a time
+        """
+        schema = self.schema
+        instances = self.modelinstance_set.order_by('pk').with_field_values()
+
+        last_pk = None
+        while True:
+            if last_pk is not None:
+                batch = list(instances.filter(pk__gt=last_pk)[:batch_size])
+            else:
+                batch = list(instances[:batch_size])
+
+            if len(batch) == 0:
+                break
+
+            evaluated_columns = schema.evaluate_many(batch)
+            saved_jsons = [x._saved_json for x in batch]
+
+            for row, model_instance in enumerate(batch):
+                model_instance.json = self._get_instance_json(schema, model_instance, evaluated_columns, row)
+
+            ModelInstance.objects.bulk_update(batch, ['json'])
+            last_pk = batch[-1].pk
+
+            changes = [(x.created, saved_json, x.json) for saved_json, x in zip(saved_jsons, batch)
+                       if saved_json != x.json]
+            if len(changes) > 0:
+                model_instances_json_changed.send(sender=ModelInstance, model_id=self.pk, changes=changes)
+            for model_instance in batch:
+                model_instance._saved_json = dict(model_instance.json)
+
+            if self.project:
+                self.refresh_projection([x.pk for x in batch])
+
+    def iter_csv(self, chunk_size=1000):
+        """
+        Iterates over the instances of the model as csv lines, header first.
+        Instances are read with a server-side cursor a chunk at a time,
+        so the lines can be streamed with a StreamingHttpResponse
+        :param chunk_size: int
+            The number of instances to read at a time
+        :return: generator<string>
+            The csv lines
+        """
+        fields = self.schema.fields
+        writer = csv.writer(Echo())
+
+        # the header holds the field names
+        yield writer.writerow([field.name for field in fields])
+
+        instances = self.modelinstance_set.order_by('pk').iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(itertools.islice(instances, chunk_size))
+            if len(chunk) == 0:
+                break
+
+            # compile the json of any instances without, loading their fields in one pass
+            outdated = [x for x in chunk if x.json is None]
+            if len(outdated) > 0:
+                ModelInstance.load_fields(outdated)
+                for model_instance in outdated:
+                    model_instance.to_json()
+
+            for model_instance in chunk:
+                yield writer.writerow([model_instance.json.get(field.name) for field in fields])
+
+    def export_csv(self, stream, chunk_size=1000):
+        """
+        Writes the instances of the model to a stream as csv, header first
+        :param stream: file
+            The stream to write to
+        :param chunk_size: int
+            The number of instances to read at a time
+        """
+        for line in self.iter_csv(chunk_size):
+            stream.write(line)
+
     def compatible(self, model):
         """
         Evaluates if two models are field-compatible with each other.
@@ -223,8 +588,8 @@ class Model(models.Model):
             Should the instance validation ignore field choices?
         """
         # get all non-evaluated fields
-        fields = self.get_non_evaluated_fields()
-        field_count = fields.count()
+        fields = self.schema.non_evaluated_fields
+        field_count = len(fields)
 
         # validate that the field count matches the value count
         if len(values) != field_count:
@@ -260,7 +625,7 @@ class Model(models.Model):
         # clean the values to begin
         cleaned_values = self.clean_from_values(values, ignore_choices)
         # get all non-evaluated fields
-        fields = self.get_non_evaluated_fields()
+        fields = self.schema.non_evaluated_fields
 
         # create a model instance
         model_instance = self.create_instance()
@@ -282,6 +647,111 @@ class Model(models.Model):
 
         return model_instance
 
+    def bulk_create_instances_from_values(self, rows, ignore_choices=True, batch_size=1000):
+        """
+        Creates instances from rows of values in one transaction, writing a batch
+        of rows at a time with one insert per field instance table
+        :param rows: iterable<list>
+            The lists of values to create from
+        :param ignore_choices: bool
+            Should the instance validation ignore field choices?
+        :param batch_size: int
+            The number of rows to validate and write at a time
+        :return: int
+            The number of created model instances
+        """
+        count = 0
+        rows = iter(rows)
+        with transaction.atomic():
+            while True:
+                # clean a batch of values to begin, nothing is written for the batch if any are invalid
+                cleaned_rows = [self.clean_from_values(values, ignore_choices)
+                                for values in itertools.islice(rows, batch_size)]
+                if len(cleaned_rows) == 0:
+                    break
+
+                count += len(self.bulk_create_instances(cleaned_rows))
+
+        return count
+
+    def bulk_create_instances(self, cleaned_rows):
+        """
+        Creates instances from rows of cleaned values, with one insert per model instance and
+        field instance table. The json of the instances is compiled before they are inserted
+        :param cleaned_rows: list<list>
+            The lists of cleaned values, as returned by clean_from_values
+        :return: list<ModelInstance>
+            The created model instances
+        """
+        schema = self.schema
+        # get all non-evaluated fields
+        fields = schema.non_evaluated_fields
+
+        # build the model instances along with their field instances, grouped by field instance table
+        model_instances = []
+        field_instances = {}
+        for cleaned_values in cleaned_rows:
+            model_instance = ModelInstance(model=self)
+            model_instance._model_fields = list(schema.fields)
+            model_instance._field_instances = {}
+            for field, cleaned_value in zip(fields, cleaned_values):
+                field_instance = None
+                # None values are just ignored
+                if cleaned_value is not None:
+                    field_instance = field.build_instance(model_instance, cleaned_value)
+                    field_instances.setdefault(type(field_instance), []).append(field_instance)
+                model_instance._field_instances[field.name] = field_instance
+            model_instances.append(model_instance)
+
+        # compile the json of the instances together
+        evaluated_columns = schema.evaluate_many(model_instances)
+        for row, model_instance in enumerate(model_instances):
+            model_instance.json = self._get_instance_json(schema, model_instance, evaluated_columns, row)
+
+        with transaction.atomic():
+            ModelInstance.objects.bulk_create(model_instances)
+
+            for field_instance_type, instances in field_instances.items():
+                # the model instances had no ids when the field instances were built
+                for field_instance in instances:
+                    field_instance.model_instance_id = field_instance.model_instance.pk
+                field_instance_type.objects.bulk_create(instances)
+
+            if len(model_instances) > 0:
+                model_instances_json_changed.send(sender=ModelInstance, model_id=self.pk,
+                                                  changes=[(x.created, None, x.json) for x in model_instances])
+            for model_instance in model_instances:
+                model_instance._saved_json = dict(model_instance.json)
+
+            if self.project and len(model_instances) > 0:
+                self.refresh_projection([x.pk for x in model_instances])
+
+        return model_instances
+
+    @classmethod
+    def _get_instance_json(cls, schema, model_instance, evaluated_columns, row):
+        """
+        Gets the json of a model instance evaluated along with others
+        :param schema: ModelSchema
+            The schema of the model
+        :param model_instance: ModelInstance
+            The model instance, with its field instances loaded
+        :param evaluated_columns: dict
+            The evaluated field names mapped to the column of evaluated values, see ModelSchema.evaluate_many
+        :param row: int
+            The row of the model instance in the columns
+        :return: dict
+            The json of the model instance
+        """
+        json_dict = {}
+        for field in schema.fields:
+            if not field.evaluated:
+                json_dict[field.name] = field.instance_to_json(model_instance.get(field.name))
+            else:
+                json_dict[field.name] = field.to_json(evaluated_columns[field.name][row])
+
+        return json_dict
+
     @property
     def fields(self):
         """
@@ -289,15 +759,23 @@ class Model(models.Model):
         :return: dict
             The field names mapped to the fields
         """
-        # if this object has no fields, and model isn't brand new
-        if self._fields is None and self.pk is not None:
-            # get the field models from the model
-            fields = self.get_fields()
-            self._fields = {}
-            for field in fields:
-                self._fields[field.name] = field
+        # brand new models have no fields
+        if self.pk is None:
+            return None
 
-        return self._fields
+        return self.schema.field_map
+
+    @property
+    def schema(self):
+        """
+        The compiled schema of the model, shared process wide. The schema is resolved once
+        for the model object, until it is invalidated in this process
+        :return: ModelSchema
+            The compiled schema
+        """
+        if self._schema is None or self._schema.invalidated or self._schema.model_id != self.pk:
+            self._schema = ModelSchema.for_model(self.pk)
+        return self._schema
 
     @property
     def fieldset_id(self):
@@ -324,14 +802,279 @@ class Model(models.Model):
         return self.name
 
 
+# the queryset for instances of a Model
+class ModelInstanceQuerySet(models.QuerySet):
+    # lookups whose values are cast to the type of the field
+    cast_lookups = ('exact', 'iexact', 'gt', 'gte', 'lt', 'lte', 'in', 'range')
+    # the namespace of lookups on field values, e.g. fields__age__gt
+    field_lookups_namespace = 'fields'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._with_field_values = False
+        self._field_model_id = None
+
+    def with_field_values(self):
+        """
+        Fetches the field values of all model instances alongside them,
+        using a constant number of queries for every evaluation
+        :return: QuerySet<ModelInstance>
+            The model instances with field values
+        """
+        queryset = self.select_related('model')
+        queryset._with_field_values = True
+        return queryset
+
+    def matching(self, expression_or_group):
+        """
+        Filters down to the instances matching the conditions of a model
+        expression or condition group, evaluated by the database
+        :param expression_or_group: ModelExpression or ConditionGroup
+            The expression or group holding the conditions
+        :return: QuerySet<ModelInstance>
+            The matching model instances
+        """
+        return self.filter(expression_or_group.to_q(), model=expression_or_group.model)
+
+    def for_model(self, model):
+        """
+        Filters down to the instances of a model, from then on filtering and ordering
+        also accept the names of the model's fields under the fields namespace, such as
+        fields__age__gt, querying the field values
+        :param model: Model
+            The model of the instances
+        :return: QuerySet<ModelInstance>
+            The instances of the model
+        """
+        queryset = self.filter(model=model)
+        queryset._field_model_id = model.pk
+        return queryset
+
+    def order_by(self, *field_names):
+        schema = self._get_schema()
+        if schema is None:
+            return super().order_by(*field_names)
+
+        # order on field values through annotated subqueries
+        annotations = {}
+        ordering = []
+        for field_name in field_names:
+            descending = isinstance(field_name, str) and field_name.startswith('-')
+            name = field_name[1:] if descending else field_name
+            field = self._get_field(schema, name.split('__')) if isinstance(name, str) else None
+
+            if field is None:
+                ordering.append(field_name)
+                continue
+            if field.evaluated:
+                raise FieldError(f"Cannot order by evaluated field '{field.name}'")
+
+            annotation = f'{field.name}_field_value'
+            field_instances = getattr(field, field.instance_set_name).model.objects
+            annotations[annotation] = models.Subquery(field_instances.filter(field_id=field.pk,
+                                                                             model_instance_id=models.OuterRef('pk'))
+                                                      .values('value')[:1])
+            ordering.append(f'-{annotation}' if descending else annotation)
+
+        queryset = self.annotate(**annotations) if len(annotations) > 0 else self
+        return super(ModelInstanceQuerySet, queryset).order_by(*ordering)
+
+    def _filter_or_exclude(self, negate, *args, **kwargs):
+        schema = self._get_schema()
+        if schema is not None:
+            args = (self._field_values_q(schema, models.Q(*args, **kwargs)),)
+            kwargs = {}
+
+        return super()._filter_or_exclude(negate, *args, **kwargs)
+
+    def json_filter(self, **lookups):
+        """
+        Filters on the json values of fields, which can be served by the json indexes of
+        the model. Values are compared as they appear in the json
+        :param lookups: dict
+            The lookups, keyed by field name and optional lookup type
+        :return: QuerySet<ModelInstance>
+            The filtered instances
+        """
+        schema = self._get_json_schema()
+
+        annotations = {}
+        q = models.Q()
+        for key, value in lookups.items():
+            parts = key.split('__')
+            field = schema.get(parts[0])
+            if field is None:
+                raise FieldError(f"Unknown field '{parts[0]}'")
+
+            lookup = '__'.join(parts[1:]) or 'exact'
+            # equality is a containment query, served by the GIN index
+            if lookup == 'exact':
+                q &= models.Q(json__contains={field.name: value})
+            else:
+                annotation = f'{field.name}_json_value'
+                annotations[annotation] = field.json_expression
+                q &= models.Q(**{f'{annotation}__{lookup}': value})
+
+        queryset = self.annotate(**annotations) if len(annotations) > 0 else self
+        return queryset.filter(q)
+
+    def json_order_by(self, *field_names):
+        """
+        Orders by the json values of fields, which can be served by the json indexes of
+        the model
+        :param field_names: list<string>
+            The field names, prefixed with '-' for descending order
+        :return: QuerySet<ModelInstance>
+            The ordered instances
+        """
+        schema = self._get_json_schema()
+
+        annotations = {}
+        ordering = []
+        for field_name in field_names:
+            descending = field_name.startswith('-')
+            name = field_name[1:] if descending else field_name
+            field = schema.get(name)
+            if field is None:
+                raise FieldError(f"Unknown field '{name}'")
+
+            annotation = f'{field.name}_json_value'
+            annotations[annotation] = field.json_expression
+            ordering.append(models.F(annotation).desc() if descending else models.F(annotation).asc())
+
+        return self.annotate(**annotations).order_by(*ordering)
+
+    def _get_json_schema(self):
+        schema = self._get_schema()
+        if schema is None:
+            raise RuntimeError("Json lookups need the instances of a model, see Model.instances")
+        return schema
+
+    def _field_values_q(self, schema, q):
+        """
+        Translates the lookups on field names of a query into lookups on field values
+        :param schema: ModelSchema
+            The schema of the model
+        :param q: Q
+            The query to translate
+        :return: Q
+            The translated query
+        """
+        translated = models.Q()
+        translated.connector = q.connector
+        translated.negated = q.negated
+
+        for child in q.children:
+            if isinstance(child, models.Q):
+                translated.children.append(self._field_values_q(schema, child))
+                continue
+
+            key, value = child
+            parts = key.split('__')
+            field = self._get_field(schema, parts)
+            if field is None:
+                translated.children.append(child)
+                continue
+            if field.evaluated:
+                raise FieldError(f"Cannot filter on evaluated field '{field.name}'")
+
+            lookup = '__'.join(parts[2:]) or 'exact'
+            field_instance_type = getattr(field, field.instance_set_name).model
+            field_instances = field_instance_type.objects.filter(field_id=field.pk)
+
+            # instances missing the value have no field instance
+            if lookup == 'isnull':
+                has_value = models.Q(pk__in=field_instances.values('model_instance_id'))
+                translated.children.append(~has_value if value else has_value)
+                continue
+
+            # cast the value to the type of the field
+            if lookup in self.cast_lookups:
+                to_python = field.value_field.to_python
+                if lookup in ('in', 'range'):
+                    value = [to_python(x) for x in value]
+                else:
+                    value = to_python(value)
+
+            field_instances = field_instances.filter(**{f'value__{lookup}': value})
+            translated.children.append(models.Q(pk__in=field_instances.values('model_instance_id')))
+
+        return translated
+
+    def _get_schema(self):
+        if self._field_model_id is None:
+            return None
+        return ModelSchema.for_model(self._field_model_id)
+
+    @classmethod
+    def _get_field(cls, schema, parts):
+        # field values are looked up under their own namespace, apart from the fields of model instances
+        if len(parts) < 2 or parts[0] != cls.field_lookups_namespace:
+            return None
+
+        field = schema.get(parts[1])
+        if field is None:
+            raise FieldError(f"Unknown field '{parts[1]}'")
+        return field
+
+    def _clone(self):
+        queryset = super()._clone()
+        queryset._with_field_values = self._with_field_values
+        queryset._field_model_id = self._field_model_id
+        return queryset
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super()._fetch_all()
+
+        # only load field values once, and only for model instance results
+        if fetched or self._iterable_class is not ModelIterable:
+            return
+        if self._with_field_values:
+            ModelInstance.load_fields(self._result_cache)
+        else:
+            ModelInstance.resolve_schemas(self._result_cache)
+
+
 # an instance of a Model
 class ModelInstance(models.Model):
     # fields of the model instance
     _field_instances = None
+    # field models of the model, in index order
+    _model_fields = None
+    # the compiled schema of the model, resolved once for the instances fetched together
+    _schema = None
+    # names of the fields changed since the json was last updated
+    _changed_fields = None
+    # the json as last saved, to find how saving changes it
+    _saved_json = None
     # the model of the instance
     model = models.ForeignKey(Model, on_delete=models.CASCADE)
     # the compiled json for the model instance
     json = JSONField(blank=True, null=True)
+    # when the instance was created, metrics are rolled up by it
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = ModelInstanceQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        model_instance = super().from_db(db, field_names, values)
+        if 'json' in field_names and model_instance.json is not None:
+            model_instance._saved_json = dict(model_instance.json)
+        return model_instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'json' not in update_fields:
+            return
+
+        if self.json != self._saved_json:
+            model_instances_json_changed.send(sender=ModelInstance, model_id=self.model_id,
+                                              changes=[(self.created, self._saved_json, self.json)])
+            self._saved_json = dict(self.json) if self.json is not None else None
 
     def get(self, field_name, default=None):
         """
@@ -360,21 +1103,20 @@ class ModelInstance(models.Model):
 
         # update json if forced or if we don't have json yet
         if force_update or self.json is None:
-            fields = self.model.get_fields()
+            # (re)load the field instances in one pass, any loaded ones may be outdated
+            if force_update or self._field_instances is None:
+                ModelInstance.load_fields([self])
+
+            fields = self._model_fields
+            schema = self.schema
             json_dict = {}
 
             # go through the fields, performing either evaluation or value fetching
             for field in fields:
                 if not field.evaluated:
-                    try:
-                        value = field.get_instance(self).value
-                    # catch not exist only on get instance
-                    except ObjectDoesNotExist:
-                        value = None
+                    json_dict[field.name] = field.instance_to_json(self._field_instances.get(field.name))
                 else:
-                    value = field.evaluate(obj)
-
-                json_dict[field.name] = field.to_json(value)
+                    json_dict[field.name] = field.to_json(schema.compiled_expression(field)(obj))
 
             # set the instance's json to the created dict
             self.json = json_dict
@@ -425,9 +1167,99 @@ class ModelInstance(models.Model):
         if obj is None:
             obj = self
 
+        changed_fields = self._changed_fields
+        self._changed_fields = None
+
+        # only update the json affected by changed fields when we know them
+        if changed_fields is not None and self.json is not None:
+            schema = self.schema
+            # the json is outdated if the model's fields changed since
+            if set(self.json.keys()) == set(x.name for x in schema.fields):
+                json_dict = dict(self.json)
+
+                for field_name in changed_fields:
+                    field = schema.get(field_name)
+                    if field is not None and not field.evaluated:
+                        json_dict[field_name] = field.instance_to_json(self.fields.get(field_name))
+
+                for field_name in schema.dependents(changed_fields):
+                    field = schema.get(field_name)
+                    json_dict[field_name] = field.to_json(schema.compiled_expression(field)(obj))
+
+                self.json = json_dict
+                self.save()
+                return
+
         self.json = self.to_json(force_update=True, obj=obj)
         self.save()
 
+    def update_values(self, values):
+        """
+        Updates the values of the model instance in one transaction, the current values are
+        loaded in one pass and the differences written with one statement per field instance
+        table and kind of change
+        :param values: dict
+            The field names mapped to the cleaned values, None removes a value
+        :return: list<string>
+            The names of the fields whose values changed
+        """
+        field_instances = self.fields
+
+        # the differences, grouped by field instance table
+        new_instances = {}
+        changed_instances = {}
+        removed_instances = {}
+        changed_fields = []
+        for field in self.schema.non_evaluated_fields:
+            if field.name not in values:
+                continue
+
+            value = values[field.name]
+            field_instance = field_instances.get(field.name)
+            if field_instance is None:
+                if value is None:
+                    continue
+                field_instance = field.build_instance(self, value)
+                new_instances.setdefault(type(field_instance), []).append(field_instance)
+            elif value is None:
+                removed_instances.setdefault(type(field_instance), []).append(field_instance.pk)
+                field_instance = None
+            elif field_instance.value != value:
+                field_instance.value = value
+                changed_instances.setdefault(type(field_instance), []).append(field_instance)
+            else:
+                continue
+
+            field_instances[field.name] = field_instance
+            changed_fields.append(field.name)
+
+        try:
+            with transaction.atomic():
+                for field_instance_type, pks in removed_instances.items():
+                    field_instance_type.objects.filter(pk__in=pks).delete()
+                for field_instance_type, instances in changed_instances.items():
+                    field_instance_type.objects.bulk_update(instances, ['value'])
+                for field_instance_type, instances in new_instances.items():
+                    field_instance_type.objects.bulk_create(instances)
+        except Exception:
+            # nothing was written, so the loaded field instances no longer reflect the instance
+            self._field_instances = None
+            raise
+
+        return changed_fields
+
+    def mark_changed(self, field_names):
+        """
+        Marks fields as changed, so that the next json update only
+        updates the json affected by the changed fields
+        :param field_names: list<string>
+            The names of the changed fields
+        """
+        if self._changed_fields is None:
+            self._changed_fields = set()
+
+        self._changed_fields.update(field_names)
+
     def on_update(self, obj=None):
         """
         Should be called when the model instance is updated
@@ -439,6 +1271,9 @@ class ModelInstance(models.Model):
 
         self.update_json(obj)
 
+        if self.model.project:
+            self.model.refresh_projection([self.pk])
+
     def equals(self, other):
         """
         Compares the instance against another for content equality
@@ -464,21 +1299,98 @@ class ModelInstance(models.Model):
         """
         # if this object has no field instances, and instance isn't brand new
         if self._field_instances is None and self.pk is not None:
-            # get the field models from the model
-            fields = self.model.get_fields()
-            # create and fill the field instances dictionary
-            self._field_instances = {}
-            for field in fields:
-                if not field.evaluated:
-                    try:
-                        # some instances may miss fields, account for it
-                        field_instance = field.get_instance(self)
-                        self._field_instances[field.name] = field_instance
-                    except ObjectDoesNotExist:
-                        self._field_instances[field.name] = None
+            ModelInstance.load_fields([self])
 
         return self._field_instances
 
+    @property
+    def schema(self):
+        """
+        The compiled schema of the instance's model, resolved once for the instances
+        fetched or loaded together, until it is invalidated in this process
+        :return: ModelSchema
+            The compiled schema
+        """
+        if self._schema is None or self._schema.invalidated or self._schema.model_id != self.model_id:
+            self._schema = ModelSchema.for_model(self.model_id)
+        return self._schema
+
+    @classmethod
+    def resolve_schemas(cls, model_instances):
+        """
+        Resolves the schemas of many model instances, once per model
+        :param model_instances: list<ModelInstance>
+            The model instances to resolve the schemas of
+        :return: dict
+            The model ids mapped to their schemas
+        """
+        schemas = {}
+        for model_instance in model_instances:
+            schema = schemas.get(model_instance.model_id)
+            if schema is None:
+                schema = schemas[model_instance.model_id] = ModelSchema.for_model(model_instance.model_id)
+            model_instance._schema = schema
+
+        return schemas
+
+    @classmethod
+    def load_fields(cls, model_instances, fields=None):
+        """
+        Loads the field instances of many model instances in one pass,
+        using at most one query per field instance table
+        :param model_instances: list<ModelInstance>
+            The model instances to load the field instances for
+        :param fields: list<Field>
+            The optional fields of the model instances, taken from the schemas when not provided
+        """
+        model_instances = [x for x in model_instances if x.pk is not None]
+        if len(model_instances) == 0:
+            return
+
+        # get the field models of all models involved, resolving their schemas once per model
+        if fields is None:
+            fields = []
+            for schema in cls.resolve_schemas(model_instances).values():
+                fields.extend(schema.fields)
+
+        # group the fields by model, gathering the instance sets to fetch
+        model_fields = {}
+        instance_sets = set()
+        for field in fields:
+            model_fields.setdefault(field.model_id, []).append(field)
+            if not field.evaluated:
+                instance_sets.add(field.instance_set_name)
+
+        # discard previously fetched field instances, they may be outdated
+        for model_instance in model_instances:
+            prefetched = getattr(model_instance, '_prefetched_objects_cache', {})
+            for instance_set in instance_sets:
+                prefetched.pop(instance_set, None)
+
+        # fetch the field instances, one query per instance set
+        prefetch_related_objects(model_instances, *instance_sets)
+
+        # create and fill the field instances dictionary of each model instance
+        for model_instance in model_instances:
+            field_instances = {}
+            for instance_set in instance_sets:
+                for field_instance in getattr(model_instance, instance_set).all():
+                    field_instances[field_instance.field_id] = field_instance
+
+            model_instance._model_fields = model_fields.get(model_instance.model_id, [])
+            model_instance._field_instances = {}
+            for field in model_instance._model_fields:
+                if field.evaluated:
+                    continue
+
+                # some instances may miss fields, account for it
+                field_instance = field_instances.get(field.pk)
+                if field_instance is not None:
+                    # the field instance references the loaded models, saving lookups
+                    field_instance.field = field
+                    field_instance.model_instance = model_instance
+                model_instance._field_instances[field.name] = field_instance
+
     @property
     def description(self):
         """
@@ -486,16 +1398,18 @@ class ModelInstance(models.Model):
         :return: string
             The description of the model instance
         """
-        # get the description components
-        components = ModelDescriptionComponent.objects.filter(
-            field__in=self.model.field_set.all()).order_by('index')
+        # get the description fields
+        fields = self.schema.description_fields
 
-        if components.count() > 0:
+        if len(fields) > 0:
             description = ''
 
-            for component in components:
-                instance = component.field.get_instance(self)
-                description = f"{description}{instance.value} "
+            for field in fields:
+                instance = self.fields.get(field.name)
+                if instance is not None:
+                    description = f"{description}{instance.value} "
+                else:
+                    description = f"{description} "
         else:
             description = None
 
@@ -585,9 +1499,20 @@ class Field(PolymorphicModel):
     evaluated = models.BooleanField(default=False)
     # should the fields metrics be generated?
     generate_metrics = models.BooleanField(default=False)
+    # should the field's json value be indexed?
+    index_json = models.BooleanField(default=False)
 
     choice_field_placeholder = _("Select an option...")
 
+    error_messages = {
+        'reserved_name': _("The field name '%(name)s' is reserved"),
+    }
+
+    # the names taken by the columns of the model's projection
+    reserved_names = ('model_instance_id',)
+    # the generate_metrics flag as it was last loaded or saved, metrics are only built again when it changes
+    _saved_generate_metrics = None
+
     def create_instance(self, model_instance, value):
         """
         :param model_instance: ModelInstance
@@ -599,6 +1524,29 @@ class Field(PolymorphicModel):
         """
         raise NotImplementedError
 
+    @property
+    def value_field(self):
+        """
+        The database field holding the values of the field's instances
+        :return: models.Field
+            The value field of the field's instance type
+        """
+        return getattr(self, self.instance_set_name).model._meta.get_field('value')
+
+    def build_instance(self, model_instance, value):
+        """
+        Builds a field instance without saving it
+        :param model_instance: ModelInstance
+            The model instance to build a field instance for
+        :param value:
+            The value that the instance should hold
+        :return: FieldInstance
+            The unsaved field instance
+        """
+        value_field = self.value_field
+        # hold the value as it is read back from the database, the json is compiled from it
+        return value_field.model(field=self, model_instance=model_instance, value=value_field.to_python(value))
+
     def get_instance(self, model_instance):
         """
         :param model_instance: ModelInstance
@@ -682,11 +1630,11 @@ class Field(PolymorphicModel):
 
         return field
 
-    def prepare_form(self, form):
+    def prepare_form(self, form_class):
         """
-        Prepares a given form for the field
-        :param form: django.forms.Form
-            The form to prepare
+        Prepares the form class generated for the model with the field
+        :param form_class: type
+            The ModelInstanceForm subclass to prepare, with its base fields
         """
         pass
 
@@ -716,12 +1664,26 @@ class Field(PolymorphicModel):
         if not self.evaluated:
             raise RuntimeError("Field is not evaluated, but evaluate method is being called.")
 
+        return ModelSchema.for_model(self.model_id).compiled_expression(self)(obj)
+
+    def compile_expression(self, many=False):
+        """
+        Compiles the expression of the field into a callable
+        :param many: bool
+            Should the callable evaluate many objects at once?
+        :return: callable
+            The callable evaluating the field against an object,
+            or against objects and their columns of field values when many
+        """
         try:
             expression = self.fieldexpression
         except ObjectDoesNotExist:
-            raise RuntimeError("Field is evaluated, but does not have an expression")
+            def evaluate(*objs):
+                raise RuntimeError("Field is evaluated, but does not have an expression")
+            return evaluate
 
-        return expression.execute(obj=obj)
+        # the expression is compiled from its program, rather than loading all its parts
+        return expression.compile_program(many=many)
 
     def evaluate_json(self, obj):
         """
@@ -731,15 +1693,7 @@ class Field(PolymorphicModel):
         :return:
             The evaluated value of the field
         """
-        if not self.evaluated:
-            raise RuntimeError("Field is not evaluated, but evaluate method is being called.")
-
-        try:
-            expression = self.fieldexpression
-        except ObjectDoesNotExist:
-            raise RuntimeError("Field is evaluated, but does not have an expression")
-
-        return self.to_json(expression.execute(obj=obj))
+        return self.to_json(self.evaluate(obj))
 
     def to_json(self, value):
         """
@@ -751,6 +1705,20 @@ class Field(PolymorphicModel):
         """
         raise NotImplementedError
 
+    def instance_to_json(self, field_instance):
+        """
+        Returns the value of a field instance as json
+        :param field_instance: FieldInstance
+            The field instance, None when the model instance misses the field
+        :return:
+            The value converted to json, missing values are null for every field type
+        """
+        # some instances may miss fields, account for it
+        if field_instance is None:
+            return None
+
+        return self.to_json(field_instance.value)
+
     def from_json(self, json_string):
         """
         Converts a json string to a value
@@ -761,12 +1729,37 @@ class Field(PolymorphicModel):
         """
         raise NotImplementedError
 
+    @property
+    def json_expression(self):
+        """
+        The field's value in the json of model instances, as a database expression
+        :return: Expression
+            The json value of the field
+        """
+        return KeyTextTransform(self.name, 'json')
+
     def delete(self, using=None, keep_parents=False):
         super().delete(using, keep_parents)
 
+    def clean(self):
+        super().clean()
+
+        name = slugify(self.verbose_name)
+        if name in self.reserved_names:
+            raise ValidationError({'verbose_name': ValidationError(Field.error_messages['reserved_name'],
+                                                                   code='reserved_name', params={'name': name})})
+
     def save(self, *args, **kwargs):
         self.name = slugify(self.verbose_name)
         super().save(*args, **kwargs)
+        self._saved_generate_metrics = self.generate_metrics
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        field = super().from_db(db, field_names, values)
+        if 'generate_metrics' in field_names:
+            field._saved_generate_metrics = field.generate_metrics
+        return field
 
     def create_choice(self, value, index=None):
         """
@@ -819,6 +1812,16 @@ class Field(PolymorphicModel):
         """
         raise NotImplementedError
 
+    @property
+    def instance_set_name(self):
+        """
+        The name of the related set holding the field's instances,
+        the same name is used on both the field and the model instance
+        :return: string
+            The related set name
+        """
+        return f'{self.tiny_type_name}fieldinstance_set'
+
     @property
     def div_id(self):
         """
@@ -890,6 +1893,14 @@ class TextField(Field):
     # should the field be a large text area?
     text_area = models.BooleanField(default=False)
 
+    # the number of choices suggested at a time
+    choices_page_size = 20
+
+    # the casefolded values of the choices mapped to the values, built when first used
+    _choice_index = None
+    # the sorted prefixes of the choices and the digest of the choices, built when first used
+    _choice_prefix_index = None
+
     def create_instance(self, model_instance, value):
         return self.textfieldinstance_set.create(model_instance=model_instance, value=value)
 
@@ -916,16 +1927,24 @@ class TextField(Field):
     def get_choice_form_field(self):
         return forms.CharField()
 
-    def prepare_form(self, form):
+    def prepare_form(self, form_class):
         """
-        Prepares a given form for the field
-        :param form: django.forms.Form
-            The form to prepare
+        Prepares the form class generated for the model with the field
+        :param form_class: type
+            The ModelInstanceForm subclass to prepare, with its base fields
         """
         choices = self.choices
 
         if not self.dropdown and choices.count() > 0:
-            form.field_choices[self.name] = choices
+            # suggestions are fetched from the choices url as the user types
+            try:
+                choices_url = self.choices_url
+            except NoReverseMatch:
+                # the flexible urls are not included, embed the choices
+                form_class.base_field_choices[self.name] = choices
+            else:
+                form_class.base_field_choices[self.name] = choices_url
+                form_class.base_fields[self.name].widget.attrs['data-choices-url'] = choices_url
 
     def clean_value(self, value, ignore_choices=False):
         value = super().clean_value(value)
@@ -933,20 +1952,20 @@ class TextField(Field):
         if value:
             # validate the value is a string
             if not isinstance(value, str):
-                logger.warning(f"Invalid type provided for \'{self.verbose_name}\'", stack=True)
+                logger.warning(f"Invalid type provided for \'{self.verbose_name}\'")
                 value = str(value)
 
             # strip whitespace off the value
             value = value.strip()
 
-            # ensure before any choice checks that we have any choices
-            if self.textfieldchoice_set.all().count() > 0:
-                # if using fixed choices, find a choice corresponding to the value
-                if value is not None and self.fixed_choices and not ignore_choices:
-                    try:
-                        value = self.choices.get(value__iexact=value).value
-                    except ObjectDoesNotExist:
+            # if using fixed choices, find a choice corresponding to the value
+            if self.fixed_choices and not ignore_choices:
+                choice_index = self.choice_index
+                if len(choice_index) > 0:
+                    choice_value = choice_index.get(value.casefold())
+                    if choice_value is None:
                         raise ValidationError(f"{value} not in choices for \'{self.verbose_name}\'")
+                    value = choice_value
         else:
             # blank text becomes null
             value = None
@@ -970,7 +1989,101 @@ class TextField(Field):
 
     @property
     def choices(self):
-        return self.textfieldchoice_set.all().order_by('index', 'value')
+        return self.textfieldchoice_set.all()
+
+    @property
+    def choice_index(self):
+        """
+        The choices indexed for case insensitive lookups, built once from the choices,
+        which the fields of compiled schemas have prefetched. Schemas are compiled
+        again when choices change, the first choice of values differing in case wins
+        :return: dict
+            The casefolded values of the choices mapped to the values
+        """
+        if self._choice_index is None:
+            choice_index = {}
+            for choice in self.choices:
+                choice_index.setdefault(choice.value.casefold(), choice.value)
+            self._choice_index = choice_index
+
+        return self._choice_index
+
+    def _get_choice_prefix_index(self):
+        """
+        Gets the prefix index of the choices, the casefolded values and each of their later
+        words onwards sorted for prefix lookups, ranked by whether they start the value
+        :return: tuple
+            The sorted prefixes, the ranks, orders and values of the prefixes, and the digest of the choices
+        """
+        if self._choice_prefix_index is None:
+            values = [x.value for x in self.choices]
+
+            entries = []
+            for order, value in enumerate(values):
+                words = value.casefold().split()
+                for i in range(len(words)):
+                    entries.append((' '.join(words[i:]), 0 if i == 0 else 1, order, value))
+            entries.sort()
+
+            digest = hashlib.sha256('\n'.join(values).encode('utf-8')).hexdigest()[:16]
+            self._choice_prefix_index = ([x[0] for x in entries], [x[1:] for x in entries], digest)
+
+        return self._choice_prefix_index
+
+    def get_choice_matches(self, query):
+        """
+        Finds the choices with the query starting their value or any of their words,
+        choices starting with the query come first, then in the order of the choices
+        :param query: string
+            The start of the value or of a word, case insensitive
+        :return: list<string>
+            The values of the matching choices
+        """
+        prefixes, entries, _ = self._get_choice_prefix_index()
+        query = ' '.join(query.casefold().split())
+
+        matches = []
+        start = bisect.bisect_left(prefixes, query)
+        for i in range(start, len(prefixes)):
+            if not prefixes[i].startswith(query):
+                break
+            matches.append(entries[i])
+        matches.sort()
+
+        values = []
+        found = set()
+        for _, _, value in matches:
+            if value not in found:
+                found.add(value)
+                values.append(value)
+
+        return values
+
+    @property
+    def choices_version(self):
+        """
+        The digest of the choices, changes with them
+        :return: string
+            The digest of the choices
+        """
+        return self._get_choice_prefix_index()[2]
+
+    @property
+    def choices_url(self):
+        """
+        The url serving suggested choices, versioned so that browsers may cache them
+        :return: string
+            The url of the choices, requires the flexible urls to be included
+        """
+        return reverse('flexible:field_choices', args=[self.model_id, self.name]) + f'?v={self.choices_version}'
+
+    def clear_choice_index(self):
+        """
+        Clears the indexes of the choices, along with any prefetched choices, so that all are read again
+        """
+        self._choice_index = None
+        self._choice_prefix_index = None
+        getattr(self, '_prefetched_objects_cache', {}).pop('textfieldchoice_set', None)
 
     @property
     def tiny_type_name(self):
@@ -1025,12 +2138,16 @@ class IntegerField(Field):
 
         return int(json_string)
 
+    @property
+    def json_expression(self):
+        return Cast(super().json_expression, models.BigIntegerField())
+
     def create_choice(self, value, index=None):
         return self.integerfieldchoice_set.create(value=value, index=index)
 
     @property
     def choices(self):
-        return self.integerfieldchoice_set.all().order_by('index')
+        return self.integerfieldchoice_set.all()
 
     @property
     def tiny_type_name(self):
@@ -1109,12 +2226,16 @@ class DecimalField(Field):
 
         return self.clean_value(float(json_string))
 
+    @property
+    def json_expression(self):
+        return Cast(super().json_expression, models.FloatField())
+
     def create_choice(self, value, index=None):
         return self.decimalfieldchoice_set.create(value=value, index=index)
 
     @property
     def choices(self):
-        return self.decimalfieldchoice_set.all().order_by('index')
+        return self.decimalfieldchoice_set.all()
 
     @property
     def tiny_type_name(self):
@@ -1190,6 +2311,10 @@ class BooleanField(Field):
     def from_json(self, json_string):
         return self.clean_value(json_string)
 
+    @property
+    def json_expression(self):
+        return Cast(super().json_expression, models.BooleanField())
+
     def create_choice(self, value, index=None):
         raise NotImplementedError
 
@@ -1280,7 +2405,7 @@ class DateField(Field):
 
     @property
     def choices(self):
-        return self.datefieldchoice_set.all().order_by('index')
+        return self.datefieldchoice_set.all()
 
     @property
     def tiny_type_name(self):
@@ -1352,6 +2477,10 @@ class DurationField(Field):
 
         return datetime.timedelta(seconds=seconds)
 
+    @property
+    def json_expression(self):
+        return Cast(super().json_expression, models.BigIntegerField())
+
     def create_choice(self, value, index=None):
         return self.durationfieldchoice_set.create(value=value, index=index)
 
@@ -1371,7 +2500,7 @@ class DurationField(Field):
 
     @property
     def choices(self):
-        return self.durationfieldchoice_set.all().order_by('index')
+        return self.durationfieldchoice_set.all()
 
     @property
     def tiny_type_name(self):
@@ -1431,7 +2560,7 @@ class EmailField(Field):
 
     @property
     def choices(self):
-        return self.emailfieldchoice_set.all().order_by('index')
+        return self.emailfieldchoice_set.all()
 
     @property
     def tiny_type_name(self):
@@ -1498,3 +2627,335 @@ class ModelDescriptionComponent(models.Model):
     def __str__(self):
         return f"Description component for {self.field.model}'s " \
                f"{self.field} field at index {self.index}"
+
+
+# the compiled schema of a Model, built once per model version and shared process wide
+class ModelSchema:
+    # the cache key of the version shared by all schemas, changes when all are invalidated
+    version_cache_key = 'flexible_model_schema_version'
+    # the cache key of the version of a single model's schema
+    model_version_cache_key = 'flexible_model_schema_version_%d'
+    # the cache key of the js of a model's schema, by model id and version
+    js_cache_key = 'flexible_model_js_%d_%s'
+
+    # the compiled schemas of this process, model id => schema
+    _schemas = {}
+
+    def __init__(self, model_id, version):
+        """
+        Compiles the schema of a model, fields should be treated as read only
+        :param model_id: int
+            The id of the model to compile the schema for
+        :param version: tuple
+            The version the schema is compiled for
+        """
+        self._model_id = model_id
+        self._version = version
+
+        # get the field models from the model
+        fields = list(Field.objects.filter(model_id=model_id).order_by('index'))
+
+        # models without fields may be missing, which are not compiled
+        if len(fields) == 0 and not Model.objects.filter(pk=model_id).exists():
+            raise Model.DoesNotExist(f"No model found with id {model_id}")
+
+        # fetch the choices alongside, text fields are the only ones supporting choices
+        prefetch_related_objects([x for x in fields if isinstance(x, TextField)], 'textfieldchoice_set')
+
+        self._fields = tuple(fields)
+        self._field_map = {field.name: field for field in fields}
+        self._non_evaluated_fields = tuple(x for x in fields if not x.evaluated)
+        self._evaluated_fields = tuple(x for x in fields if x.evaluated)
+
+        # the fields making up the description of the model's instances
+        fields = {field.pk: field for field in fields}
+        components = ModelDescriptionComponent.objects.filter(model_id=model_id).order_by('index')
+        self._description_fields = tuple(fields[x.field_id] for x in components if x.field_id in fields)
+
+        # expressions are compiled when first used
+        self._compiled_expressions = {}
+        self._model_expressions = None
+        # the fields read by evaluated fields, built when first used
+        self._dependencies = None
+        # has the projection of the model been checked against the fields?
+        self.projection_updated = False
+        # the js of the model and its digest, generated when first used
+        self._js = None
+        # the form classes of the model by their base class and language, generated by the forms when first used
+        self.form_classes = {}
+        # has the schema been invalidated in this process? Holders of the schema resolve it again
+        self.invalidated = False
+
+    def get(self, field_name, default=None):
+        """
+        Gets a field from the schema
+        :param field_name: string
+            The field name
+        :param default:
+            The value to return when no field is found
+        :return: Field
+            The field with the given name
+        """
+        return self._field_map.get(field_name, default)
+
+    def compiled_expression(self, field, many=False):
+        """
+        Gets the compiled expression of an evaluated field, compiling it when first used
+        :param field: Field
+            The evaluated field
+        :param many: bool
+            Should the callable evaluate many objects at once?
+        :return: callable
+            The callable evaluating the field against an object,
+            or against objects and their columns of field values when many
+        """
+        expression = self._compiled_expressions.get((field.pk, many))
+        if expression is None:
+            schema_field = self._field_map.get(field.name)
+            # fields not part of the schema are compiled each time
+            if schema_field is None or schema_field.pk != field.pk:
+                return field.compile_expression(many=many)
+
+            expression = schema_field.compile_expression(many=many)
+            self._compiled_expressions[(field.pk, many)] = expression
+
+        return expression
+
+    def dependents(self, field_names):
+        """
+        Finds the evaluated fields affected by changes to the given fields
+        :param field_names: list<string>
+            The names of the changed fields
+        :return: set<string>
+            The names of the evaluated fields to evaluate again
+        """
+        # the dependency graph, evaluated field name => field names read by its expression
+        if self._dependencies is None:
+            dependencies = {}
+            for field in self._evaluated_fields:
+                try:
+                    dependencies[field.name] = field.fieldexpression.dependencies()
+                except ObjectDoesNotExist:
+                    # evaluating the field fails, so let it be evaluated again
+                    dependencies[field.name] = None
+            self._dependencies = dependencies
+
+        changed = set(field_names)
+        dependents = set()
+
+        # follow the graph until no other evaluated field is affected
+        found = True
+        while found:
+            found = False
+            for field_name, dependencies in self._dependencies.items():
+                if field_name in dependents:
+                    continue
+                if dependencies is None or not dependencies.isdisjoint(changed):
+                    dependents.add(field_name)
+                    changed.add(field_name)
+                    found = True
+
+        return dependents
+
+    def evaluate_many(self, model_instances):
+        """
+        Evaluates the evaluated fields for many model instances at once, the
+        field values of the instances are gathered into a column per field
+        :param model_instances: list<ModelInstance>
+            The model instances, with their field instances loaded
+        :return: dict
+            The evaluated field names mapped to the column of evaluated values
+        """
+        model_instances = list(model_instances)
+        ModelInstance.load_fields([x for x in model_instances if x._field_instances is None])
+
+        # the columns hold what the instances return when getting a field
+        columns = {}
+        for field in self._fields:
+            columns[field.name] = [x.get(field.name) for x in model_instances]
+
+        evaluated_columns = {}
+        for field in self._evaluated_fields:
+            evaluated_columns[field.name] = self.compiled_expression(field, many=True)(model_instances, columns)
+
+        return evaluated_columns
+
+    def _get_js(self):
+        """
+        Gets the js of the model and its digest, shared between processes through the cache
+        :return: tuple
+            The js and the digest of the js
+        """
+        if self._js is None:
+            key = self.js_cache_key % (self._model_id, '_'.join(self._version))
+            js = cache.get(key)
+            if js is None:
+                model = Model.objects.get(pk=self._model_id)
+                content = model.js()
+                js = (content, hashlib.sha256(content.encode('utf-8')).hexdigest()[:16])
+                cache.set(key, js)
+            self._js = js
+
+        return self._js
+
+    @property
+    def js(self):
+        """
+        The js of the model, generated once per version of the schema
+        :return: string
+            The expressions of the model as js
+        """
+        return self._get_js()[0]
+
+    @property
+    def js_version(self):
+        """
+        The digest of the js of the model, changes with its content
+        :return: string
+            The digest of the js
+        """
+        return self._get_js()[1]
+
+    @classmethod
+    def for_model(cls, model_id):
+        """
+        Gets the compiled schema of a model, compiling it when outdated
+        :param model_id: int
+            The id of the model
+        :return: ModelSchema
+            The compiled schema of the model
+        :raises Model.DoesNotExist:
+            When the model does not exist
+        """
+        version = cls._get_version(model_id)
+
+        schema = cls._schemas.get(model_id)
+        if schema is None or schema.version != version:
+            try:
+                schema = cls(model_id, version)
+            except Model.DoesNotExist:
+                # nothing is kept for missing models, so that requests for any id hold no memory
+                cls._schemas.pop(model_id, None)
+                cache.delete(cls.model_version_cache_key % model_id)
+                raise
+            cls._schemas[model_id] = schema
+
+        return schema
+
+    @classmethod
+    def invalidate(cls, model_id=None):
+        """
+        Invalidates compiled schemas in all processes sharing the cache
+        :param model_id: int
+            The id of the model to invalidate, all schemas are invalidated when None
+        """
+        if model_id is None:
+            cache.delete(cls.version_cache_key)
+            schemas = list(cls._schemas.values())
+            cls._schemas.clear()
+        else:
+            cache.delete(cls.model_version_cache_key % model_id)
+            schemas = [x for x in [cls._schemas.pop(model_id, None)] if x is not None]
+
+        for schema in schemas:
+            schema.invalidated = True
+
+    @classmethod
+    def _get_version(cls, model_id):
+        """
+        Gets the current version of a model's schema, the version
+        is kept in the cache so that it is shared between processes
+        :param model_id: int
+            The id of the model
+        :return: tuple
+            The version of the model's schema
+        """
+        keys = [cls.version_cache_key, cls.model_version_cache_key % model_id]
+        versions = cache.get_many(keys)
+
+        # start new versions for any missing, keeping those added concurrently
+        for key in keys:
+            if key not in versions:
+                cache.add(key, uuid.uuid4().hex, timeout=None)
+                versions[key] = cache.get(key)
+
+        return tuple(versions[key] for key in keys)
+
+    @property
+    def model_id(self):
+        """
+        The id of the model of the schema
+        :return: int
+            The model id
+        """
+        return self._model_id
+
+    @property
+    def version(self):
+        """
+        The version of the schema
+        :return: tuple
+            The version of the schema
+        """
+        return self._version
+
+    @property
+    def fields(self):
+        """
+        The fields of the model
+        :return: tuple<Field>
+            The fields of the model in index order
+        """
+        return self._fields
+
+    @property
+    def field_map(self):
+        """
+        The field names mapped to the fields of the model
+        :return: dict
+            The field names mapped to the fields
+        """
+        return dict(self._field_map)
+
+    @property
+    def non_evaluated_fields(self):
+        """
+        The non evaluated fields of the model
+        :return: tuple<Field>
+            The non evaluated fields in index order
+        """
+        return self._non_evaluated_fields
+
+    @property
+    def evaluated_fields(self):
+        """
+        The evaluated fields of the model
+        :return: tuple<Field>
+            The evaluated fields in index order
+        """
+        return self._evaluated_fields
+
+    @property
+    def model_expressions(self):
+        """
+        The compiled expressions of the model, compiled when first used
+        :return: tuple<callable>
+            The callables executing the expressions against a fields dict
+        """
+        if self._model_expressions is None:
+            model = Model(pk=self._model_id)
+            self._model_expressions = tuple(x.compile() for x in model.modelexpression_set.order_by('pk'))
+
+        return self._model_expressions
+
+    @property
+    def description_fields(self):
+        """
+        The fields making up the description of model instances
+        :return: tuple<Field>
+            The description fields in description component order
+        """
+        return self._description_fields
+
+    def __str__(self):
+        return f"Schema for model {self._model_id}"
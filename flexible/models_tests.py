@@ -1,12 +1,21 @@
-from django.test import TestCase
-from django.db.utils import IntegrityError
+import io
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from django.db import connection
+from django.db.utils import IntegrityError, DatabaseError
+from django.db.models import Q
+from django.core.exceptions import FieldError
 
 from flexible.models import *
 from flexible.choices import *
 from flexible.expressions import *
 from flexible.conditions import *
 from flexible.actions import *
-from flexible.tests_utils import create_mock_model, create_mock_model_instance, create_mock_model_with_shared_action
+from flexible.tests_utils import create_mock_model, create_mock_model_instance, create_mock_model_with_shared_action, \
+    create_mock_matched_field, to_import_value, run_on_commit_callbacks
 
 
 class ModelTests(TestCase):
@@ -1420,6 +1429,31 @@ class ModelTests(TestCase):
         aaa = action.js()
         self.assertIsNotNone(model_js)
 
+    def test_model_js_dependencies(self):
+        model = Model.objects.create(name='testModel')
+        text_field = TextField.objects.create(verbose_name='testTextField', required=True, model=model)
+        int_field = IntegerField.objects.create(verbose_name='testIntegerField', required=False, model=model)
+
+        # an expression reading the text field
+        expression = ModelExpression.objects.create(name='testExpression', model=model)
+        condition = TextFieldCondition.objects.create(field=text_field, rhs='matchingValue',
+                                                      condition=TextFieldCondition.CONDITION_MATCH, model=model)
+        expression.create_group().add_condition(condition=condition)
+        expression.add_action(action=ShowFieldAction.objects.create(field=int_field, model=model))
+
+        # an expression which may read any field
+        expression = ModelExpression.objects.create(name='testAnyExpression', model=model)
+        condition = HasAttributeCondition.objects.create(attribute_name='test', model=model)
+        expression.create_group().add_condition(condition=condition)
+        expression.add_action(action=HideFieldAction.objects.create(field=int_field, model=model))
+
+        # each expression is bound to the inputs its conditions read
+        model_js = model.js()
+        self.assertIn('function onFieldSetChange0()', model_js)
+        self.assertIn('function onFieldSetChange1()', model_js)
+        self.assertIn('flexibleBindExpressions([onFieldSetChange0, onFieldSetChange1], '
+                      '{"id_testtextfield": [0]}, [1]);', model_js)
+
     def test_model_expression_js_method_two_groups_one_condition_single_action(self):
         # create a model with three fields
         model = Model.objects.create(name='testModel')
@@ -1652,6 +1686,38 @@ class ModelTests(TestCase):
 
         raise NotImplementedError
 
+    def test_bulk_create_instances_from_values_method(self):
+        model = create_mock_model()
+        fields = model.schema.non_evaluated_fields
+        instances = [create_mock_model_instance(model)[0] for _ in range(3)]
+
+        rows = [[to_import_value(x.get(field.name).value) for field in fields] for x in instances]
+
+        # the json of each batch is compiled before the inserts and signalled once
+        receiver = mock.Mock()
+        model_instances_json_changed.connect(receiver)
+        try:
+            count = model.instance_count
+            created = model.bulk_create_instances_from_values(rows, batch_size=2)
+        finally:
+            model_instances_json_changed.disconnect(receiver)
+
+        self.assertEqual(3, created)
+        self.assertEqual(2, receiver.call_count)
+        self.assertEqual([2, 1], [len(x.kwargs['changes']) for x in receiver.call_args_list])
+        created_instances = list(model.modelinstance_set.order_by('pk'))[count:]
+        for instance, created_instance in zip(instances, created_instances):
+            self.assertIsNotNone(created_instance.json)
+            self.assertEqual(created_instance.json, created_instance.to_json(force_update=True))
+            self.assertTrue(created_instance.equals(instance))
+
+        # nothing is created when any row is invalid
+        count = model.instance_count
+        rows[2][0] = ''
+        with self.assertRaises(ValidationError):
+            model.bulk_create_instances_from_values(rows, batch_size=2)
+        self.assertEqual(count, model.instance_count)
+
     def test_model_equals_method(self):
         model = create_mock_model()
         instance_a, values_a = create_mock_model_instance(model)
@@ -1676,3 +1742,563 @@ class ModelTests(TestCase):
         expected, index = test('testdecimalfield', expected, index)
         expected, index = test('testdurationfield', expected, index)
         expected, index = test('testemailfield', expected, index)
+
+    def test_model_instance_load_fields_method(self):
+        model = create_mock_model()
+        instance_a, values_a = create_mock_model_instance(model)
+        instance_b, values_b = create_mock_model_instance(model)
+        fields = list(model.get_fields())
+
+        # fresh instances, so that nothing is loaded yet
+        instances = list(model.get_instances().order_by('pk'))
+
+        # one query per field instance table
+        with self.assertNumQueries(7):
+            ModelInstance.load_fields(instances, fields)
+
+        # the loaded field instances should need no further queries
+        with self.assertNumQueries(0):
+            for instance, values in zip(instances, [values_a, values_b]):
+                self.assertEqual(21, len(instance.fields))
+                for field_name, field_instance in instance.fields.items():
+                    self.assertEqual(values[field_name], field_instance.value)
+                    self.assertIsNotNone(field_instance.value_json)
+
+        # missing field instances are loaded as None
+        instances[0].fields['testtextfield'].delete()
+        ModelInstance.load_fields(instances, fields)
+        self.assertIsNone(instances[0].fields['testtextfield'])
+        self.assertIsNotNone(instances[1].fields['testtextfield'])
+
+    def test_model_instance_update_values_method(self):
+        model = create_mock_model()
+        instance, values = create_mock_model_instance(model)
+        instance.fields['testtextfield'].delete()
+        instance = ModelInstance.objects.get(pk=instance.pk)
+
+        # add and update text values, remove an email value, update an integer value, keep the rest
+        changes = {'testtextfield': 'added', 'testrequiredtextfield': 'updated', 'testemailfield': None,
+                   'testintegerfield': values['testintegerfield'] + 1,
+                   'testdecimalfield': values['testdecimalfield']}
+
+        # the values are loaded in one pass, then one statement per table and kind of change
+        with self.assertNumQueries(7 + 2 + 2 + 2 + 1):
+            changed = instance.update_values(changes)
+        self.assertEqual({'testtextfield', 'testrequiredtextfield', 'testemailfield', 'testintegerfield'},
+                         set(changed))
+
+        fresh = ModelInstance.objects.get(pk=instance.pk)
+        self.assertIsNone(fresh.fields['testemailfield'])
+        for field_name, field_instance in fresh.fields.items():
+            expected = changes.get(field_name, values[field_name])
+            self.assertEqual(expected, field_instance.value if field_instance is not None else None)
+            self.assertEqual(expected, instance.get(field_name).value if instance.get(field_name) else None)
+
+        # nothing is written when any change fails
+        with mock.patch.object(IntegerFieldInstance.objects, 'bulk_update', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                fresh.update_values({'testtextfield': 'failed', 'testintegerfield': 0})
+        self.assertIsNone(fresh._field_instances)
+        self.assertEqual('added', fresh.fields['testtextfield'].value)
+        self.assertEqual(values['testintegerfield'] + 1, fresh.fields['testintegerfield'].value)
+
+    def test_model_instance_with_field_values_method(self):
+        model = create_mock_model()
+        expected = [create_mock_model_instance(model)[1] for _ in range(0, 3)]
+
+        # compile the schema up front
+        self.assertIsNotNone(model.schema)
+
+        # model instances with models, then one query per field instance table
+        with self.assertNumQueries(8):
+            instances = list(model.get_instances().with_field_values().order_by('pk'))
+        self.assertEqual(3, len(instances))
+
+        # field values and descriptions need no further queries
+        with self.assertNumQueries(0):
+            for instance, values in zip(instances, expected):
+                for field_name, value in values.items():
+                    self.assertEqual(value, instance.get(field_name).value)
+                self.assertEqual(f"{values['testrequiredtextfield']} ", instance.description)
+
+        # the json should match an instance without field values
+        for instance in instances:
+            self.assertDictEqual(ModelInstance.objects.get(pk=instance.pk).to_json(force_update=True),
+                                 instance.to_json())
+
+    def test_model_schema(self):
+        model = create_mock_model()
+        schema = model.schema
+
+        # a compiled schema needs no queries
+        with self.assertNumQueries(0):
+            self.assertIs(schema, model.schema)
+            self.assertEqual(28, len(schema.fields))
+            self.assertEqual(21, len(schema.non_evaluated_fields))
+            self.assertEqual(7, len(schema.evaluated_fields))
+            self.assertEqual(2, schema.get('testrequiredtextfield').choices.count())
+            self.assertEqual(['testrequiredtextfield'], [x.name for x in schema.description_fields])
+            self.assertEqual(set(schema.field_map.keys()), set(model.fields.keys()))
+
+        self.assertEqual([x.pk for x in model.get_fields()], [x.pk for x in schema.fields])
+
+        # adding a field compiles a new schema
+        TextField.objects.create(model=model, index=28, verbose_name='TestNewTextField', required=False)
+        self.assertIsNot(schema, model.schema)
+        self.assertEqual(29, len(model.schema.fields))
+
+        # adding a choice compiles a new schema
+        schema = model.schema
+        schema.get('testtextfield').create_choice('new choice', index=0)
+        self.assertIsNot(schema, model.schema)
+        self.assertEqual(1, model.schema.get('testtextfield').choices.count())
+
+        # changing a field expression compiles a new schema
+        schema = model.schema
+        expression = schema.get('testevaluatedtextfield').fieldexpression
+        expression.create_group(index=1)
+        self.assertIsNot(schema, model.schema)
+
+        # schemas compiled for other models are unaffected
+        other_schema = create_mock_model().schema
+        schema = model.schema
+        TextField.objects.create(model=model, index=29, verbose_name='TestOtherTextField', required=False)
+        self.assertIsNot(schema, model.schema)
+        self.assertIs(other_schema, ModelSchema.for_model(other_schema.model_id))
+
+        # instances fetched together resolve the schema once
+        model = create_mock_model()
+        for _ in range(3):
+            create_mock_model_instance(model)
+        schema = model.schema
+        with mock.patch.object(ModelSchema, 'for_model', wraps=ModelSchema.for_model) as for_model:
+            instances = list(ModelInstance.objects.filter(model=model).with_field_values())
+            for instance in instances:
+                self.assertIs(schema, instance.schema)
+                instance.description
+                instance.update_values({})
+            self.assertEqual(1, for_model.call_count)
+
+        # until the schema is invalidated
+        TextField.objects.create(model=model, index=28, verbose_name='TestNewTextField', required=False)
+        self.assertTrue(schema.invalidated)
+        self.assertIsNot(schema, instances[0].schema)
+        self.assertIs(model.schema, instances[0].schema)
+
+    def test_model_schema_compiled_expressions(self):
+        model = create_mock_model()
+        model_instance, values = create_mock_model_instance(model)
+        schema = model.schema
+        expected = {x.name: x.fieldexpression.execute(model_instance) for x in schema.evaluated_fields}
+
+        # expressions are compiled once, then evaluated without queries
+        for field in schema.evaluated_fields:
+            field.evaluate(model_instance)
+        model.clean_values(values)
+
+        with self.assertNumQueries(0):
+            for field in schema.evaluated_fields:
+                self.assertEqual(expected[field.name], field.evaluate(model_instance))
+            model.clean_values(values)
+
+        # changing an expression compiles it again
+        field = schema.get('testevaluatedintegerfield')
+        action = field.fieldexpression.fieldexpressionaction_set.get().action
+        action.value = 2
+        action.save()
+        self.assertEqual(2, field.evaluate(model_instance))
+
+    def test_field_expression_programs(self):
+        model = create_mock_model()
+        model_instances = [create_mock_model_instance(model) for _ in range(3)]
+        fields = list(model.get_fields())
+        create_mock_matched_field(model, fields[7], model_instances[0][1][fields[7].name])
+        schema = model.schema
+        objs = [x for x, _ in model_instances]
+        expected = {x.name: [x.fieldexpression.compile()(y) for y in objs] for x in schema.evaluated_fields}
+
+        # programs are serialised once for all the changes to the model, when they are committed
+        self.assertEqual(1, len([x for _, x in connection.run_on_commit
+                                 if getattr(x, 'program_model_id', None) == model.pk]))
+        run_on_commit_callbacks()
+
+        # programs evaluate as the expressions they are serialised from
+        self.assertEqual(expected, ModelSchema.for_model(model.pk).evaluate_many(objs))
+        for field in schema.evaluated_fields:
+            expression = FieldExpression.objects.get(field=field)
+            self.assertEqual(expression.serialise(), expression.program)
+            self.assertEqual(expected[field.name], [field.evaluate(x) for x in objs])
+
+        # stored programs compile from the single row of the expression
+        field = schema.get('testmatchedtextfield')
+        loaded_field = Field.objects.get(pk=field.pk)
+        with self.assertNumQueries(1):
+            loaded_field.compile_expression()
+
+        # programs outlive the versions of the schema held by the cache
+        expression = FieldExpression.objects.get(field=field)
+        ModelSchema.invalidate()
+        with self.assertNumQueries(0):
+            expression.compile_program()
+
+        # expressions stored before programs are serialised by the command
+        FieldExpression.objects.filter(field__model=model).update(program=None)
+        call_command('update_field_expression_programs', model.pk, stdout=io.StringIO())
+        self.assertEqual(expression.serialise(), FieldExpression.objects.get(field=field).program)
+
+        # changing any part of an expression serialises it again
+        condition = TextFieldCondition.objects.get(field=fields[7])
+        condition.rhs = model_instances[1][1][fields[7].name]
+        condition.save()
+        # until committed, expressions compile from their parts without storing their programs
+        self.assertEqual(['unmatched', 'matched', 'unmatched'],
+                         [Field.objects.get(pk=field.pk).compile_expression()(x) for x in objs])
+        self.assertNotEqual(condition.rhs, FieldExpression.objects.get(field=field).program['cases'][0][0][1][0][0][3])
+        run_on_commit_callbacks()
+        self.assertEqual(condition.rhs, FieldExpression.objects.get(field=field).program['cases'][0][0][1][0][0][3])
+        self.assertEqual(['unmatched', 'matched', 'unmatched'],
+                         [Field.objects.get(pk=field.pk).compile_expression()(x) for x in objs])
+
+        # invalid expressions raise when evaluated
+        FieldExpression.objects.get(field=field).fieldexpressionaction_set.all().delete()
+        self.assertEqual("Actions count does not match groups count",
+                         FieldExpression.objects.get(field=field).serialise()['error'])
+        with self.assertRaises(RuntimeError):
+            Field.objects.get(pk=field.pk).compile_expression()(objs[0])
+
+    def test_model_update_instances_json(self):
+        model = create_mock_model()
+        model_instances = [create_mock_model_instance(model) for _ in range(5)]
+        fields = list(model.get_fields())
+
+        # an expression matching only the first instance
+        create_mock_matched_field(model, fields[7], model_instances[0][1][fields[7].name])
+
+        model.update_instances_json(batch_size=2)
+
+        for model_instance, values in model_instances:
+            json = ModelInstance.objects.get(pk=model_instance.pk).json
+            self.assertEqual(model_instance.to_json(force_update=True), json)
+            self.assertEqual('matched' if model_instance == model_instances[0][0] else 'unmatched',
+                             json['testmatchedtextfield'])
+
+    def test_model_schema_evaluate_many(self):
+        model = create_mock_model()
+        model_instances = [create_mock_model_instance(model)[0] for _ in range(3)]
+        schema = model.schema
+
+        ModelInstance.load_fields(model_instances)
+        schema.evaluate_many(model_instances)
+
+        # evaluated columns need no queries once compiled
+        with self.assertNumQueries(0):
+            evaluated_columns = schema.evaluate_many(model_instances)
+
+        for field in schema.evaluated_fields:
+            self.assertEqual([field.evaluate(x) for x in model_instances], evaluated_columns[field.name])
+
+    def test_model_schema_dependents(self):
+        model = create_mock_model()
+        fields = list(model.get_fields())
+        create_mock_matched_field(model, fields[7], 'rhs')
+        schema = model.schema
+
+        self.assertEqual({'testmatchedtextfield'}, schema.dependents([fields[7].name]))
+        self.assertEqual(set(), schema.dependents([fields[0].name]))
+
+    def test_model_instance_update_json_changed_fields(self):
+        model = create_mock_model()
+        fields = list(model.get_fields())
+        model_instance, values = create_mock_model_instance(model)
+        create_mock_matched_field(model, fields[7], 'rhs')
+        model_instance.update_json()
+        self.assertEqual('unmatched', model_instance.json['testmatchedtextfield'])
+
+        field_instance = model_instance.get(fields[7].name)
+        field_instance.value = 'rhs'
+        field_instance.save()
+        model_instance.mark_changed([fields[7].name])
+        model.schema.dependents([])
+
+        # only the changed field and its dependents are updated
+        with self.assertNumQueries(1):
+            model_instance.update_json()
+
+        self.assertEqual('matched', model_instance.json['testmatchedtextfield'])
+        self.assertEqual(ModelInstance.objects.get(pk=model_instance.pk).to_json(force_update=True),
+                         model_instance.json)
+
+    def test_model_export_csv_method(self):
+        model = create_mock_model()
+        instances = [create_mock_model_instance(model)[0] for _ in range(5)]
+        for instance in instances[:3]:
+            instance.update_json()
+
+        stream = io.StringIO()
+        model.export_csv(stream, chunk_size=2)
+        rows = list(csv.reader(io.StringIO(stream.getvalue())))
+
+        fields = model.schema.fields
+        self.assertEqual([x.name for x in fields], rows[0])
+        self.assertEqual(6, len(rows))
+
+        # instances without json have it compiled
+        for instance, row in zip(instances, rows[1:]):
+            json = ModelInstance.objects.get(pk=instance.pk).json
+            self.assertEqual(next(csv.reader([instance.to_csv()])), row)
+            self.assertEqual([str(json[x.name]) if json[x.name] is not None else '' for x in fields], row)
+
+    def test_model_instances_field_lookups(self):
+        model = create_mock_model()
+        fields = list(model.get_fields())
+        integer_field, boolean_field, date_field, text_field = fields[8], fields[10], fields[11], fields[7]
+
+        instances = []
+        values = []
+        for _ in range(6):
+            instance, values_dict = create_mock_model_instance(model)
+            instances.append(instance)
+            values.append(values_dict)
+        text_field.get_instance(instances[-1]).delete()
+        values[-1][text_field.name] = None
+
+        def expected(predicate):
+            return {x.pk for x, v in zip(instances, values) if predicate(v)}
+
+        def pks(queryset):
+            return {x.pk for x in queryset}
+
+        threshold = values[0][integer_field.name]
+        self.assertEqual(expected(lambda v: v[integer_field.name] > threshold),
+                         pks(model.instances.filter(**{f'fields__{integer_field.name}__gt': threshold})))
+
+        # values are cast to the type of the field
+        self.assertEqual(expected(lambda v: v[integer_field.name] <= threshold and v[boolean_field.name]),
+                         pks(model.instances.filter(**{f'fields__{integer_field.name}__lte': str(threshold),
+                                                       f'fields__{boolean_field.name}': 'True'})))
+        day = values[0][date_field.name]
+        self.assertEqual(expected(lambda v: v[date_field.name] == day),
+                         pks(model.instances.filter(**{f'fields__{date_field.name}': day.isoformat()})))
+
+        self.assertEqual(expected(lambda v: v[text_field.name] is None),
+                         pks(model.instances.filter(**{f'fields__{text_field.name}__isnull': True})))
+        self.assertEqual(expected(lambda v: v[integer_field.name] != threshold),
+                         pks(model.instances.exclude(**{f'fields__{integer_field.name}': threshold})))
+        self.assertEqual(expected(lambda v: v[integer_field.name] == threshold or v[boolean_field.name]),
+                         pks(model.instances.filter(Q(**{f'fields__{integer_field.name}': threshold}) |
+                                                    Q(**{f'fields__{boolean_field.name}': True}))))
+
+        # model instance fields are still available
+        self.assertEqual({instances[0].pk}, pks(model.instances.filter(pk=instances[0].pk)))
+
+        ordered = [x.pk for x in model.instances.order_by(f'-fields__{integer_field.name}', 'pk')]
+        self.assertEqual([x.pk for x, _ in sorted(zip(instances, values),
+                                                  key=lambda x: (-x[1][integer_field.name], x[0].pk))], ordered)
+
+        with self.assertRaises(FieldError):
+            model.instances.filter(**{f'fields__{fields[22].name}': 1})
+
+        with self.assertRaises(FieldError):
+            model.instances.filter(fields__missingfield=1)
+
+        # fields may take the names of model instance fields, which keep their own lookups
+        integer_name = integer_field.name
+        integer_field.verbose_name = 'created'
+        integer_field.save()
+        self.assertEqual({x.pk for x in instances}, pks(model.instances.filter(created__lte=timezone.now())))
+        self.assertEqual(len(instances), model.instances.order_by('created').count())
+        self.assertEqual(expected(lambda v: v[integer_name] > threshold),
+                         pks(model.instances.filter(fields__created__gt=threshold)))
+        self.assertIsNotNone(model.copy('copied').get_fields().get(name='created'))
+
+        # only the projection's key column is reserved, reported when cleaning the field
+        field = IntegerField(model=model, index=30, verbose_name='model_instance_id', required=False)
+        with self.assertRaises(ValidationError) as context:
+            field.full_clean()
+        self.assertIn('verbose_name', context.exception.message_dict)
+
+    def test_model_json_indexes(self):
+        model = create_mock_model()
+        fields = list(model.get_fields())
+        integer_field, date_field = fields[8], fields[11]
+
+        model.update_json_indexes()
+        self.assertEqual(set(), model.get_json_indexes())
+
+        model.index_json = True
+        model.save()
+        for field in (integer_field, date_field):
+            field.index_json = True
+            field.save()
+        model.update_json_indexes()
+        self.assertEqual(3, len(model.get_json_indexes()))
+
+        # the indexes serve the json lookups
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        for queryset in (model.instances.json_filter(**{integer_field.name: 1}),
+                         model.instances.json_filter(**{f'{integer_field.name}__gt': 1}),
+                         model.instances.json_order_by(date_field.name)):
+            self.assertIn('flexible_json_', queryset.explain())
+
+        # renamed fields have their indexes replaced
+        indexes = model.get_json_indexes()
+        integer_field.verbose_name = 'RenamedIntegerField'
+        integer_field.save()
+        model.update_json_indexes()
+        self.assertEqual(2, len(indexes & model.get_json_indexes()))
+        self.assertEqual(3, len(model.get_json_indexes()))
+
+        date_field.index_json = False
+        date_field.save()
+        model.update_json_indexes()
+        self.assertEqual(2, len(model.get_json_indexes()))
+
+        # concurrent builds cannot run inside a transaction
+        with self.assertRaisesMessage(RuntimeError, Model.error_messages['concurrent_index_in_transaction']):
+            model.update_json_indexes(concurrently=True)
+
+        model_id = model.pk
+        model.delete()
+        self.assertEqual(set(), Model(pk=model_id).get_json_indexes())
+
+    def test_model_instances_json_lookups(self):
+        model = create_mock_model()
+        fields = list(model.get_fields())
+        integer_field, date_field, evaluated_field = fields[8], fields[11], fields[22]
+
+        instances = []
+        for _ in range(6):
+            instance = create_mock_model_instance(model)[0]
+            instance.update_json()
+            instances.append(instance)
+        jsons = {x.pk: x.json for x in instances}
+
+        def expected(predicate):
+            return {pk for pk, json in jsons.items() if predicate(json)}
+
+        def pks(queryset):
+            return {x.pk for x in queryset}
+
+        threshold = jsons[instances[0].pk][integer_field.name]
+        self.assertEqual(expected(lambda x: x[integer_field.name] == threshold),
+                         pks(model.instances.json_filter(**{integer_field.name: threshold})))
+        self.assertEqual(expected(lambda x: x[integer_field.name] > threshold),
+                         pks(model.instances.json_filter(**{f'{integer_field.name}__gt': threshold})))
+
+        # evaluated fields are in the json
+        self.assertEqual(set(jsons), pks(model.instances.json_filter(**{evaluated_field.name: 1})))
+
+        ordered = [x.pk for x in model.instances.json_order_by(f'-{date_field.name}')]
+        self.assertEqual(sorted((jsons[x][date_field.name] for x in ordered), reverse=True),
+                         [jsons[x][date_field.name] for x in ordered])
+
+        with self.assertRaises(FieldError):
+            model.instances.json_filter(missing=1)
+
+    def test_model_projection(self):
+        model = create_mock_model()
+        fields = list(model.get_fields())
+        integer_field, decimal_field, date_field, duration_field = fields[8], fields[9], fields[11], fields[12]
+        instances = [create_mock_model_instance(model)[0] for _ in range(3)]
+
+        model.project = True
+        model.save()
+        model.update_projection()
+
+        def projected():
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT * FROM "{model.projection_table}" ORDER BY model_instance_id')
+                columns = [x[0] for x in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        # a typed column per field, holding the value of each instance
+        rows = projected()
+        self.assertEqual(['model_instance_id'] + [x.name for x in model.schema.fields], list(rows[0].keys()))
+        self.assertEqual([x.pk for x in instances], [x['model_instance_id'] for x in rows])
+        for instance, row in zip(instances, rows):
+            for field in (integer_field, decimal_field, date_field, duration_field):
+                self.assertEqual(field.get_instance(instance).value, row[field.name])
+            self.assertEqual(1, row[fields[22].name])
+
+        # updated instances are refreshed
+        field_instance = integer_field.get_instance(instances[0])
+        field_instance.value += 1
+        field_instance.save()
+        instances[0].mark_changed([integer_field.name])
+        instances[0].on_update()
+        self.assertEqual(field_instance.value, projected()[0][integer_field.name])
+
+        # new fields leave the table outdated until it is replaced
+        TextField.objects.create(model=model, index=28, verbose_name='TestProjectedTextField', required=False)
+        field_instance.value += 1
+        field_instance.save()
+        instances[0].mark_changed([integer_field.name])
+        instances[0].on_update()
+        self.assertFalse(model.refresh_projection())
+        self.assertNotIn('testprojectedtextfield', projected()[0])
+        self.assertEqual(field_instance.value - 1, projected()[0][integer_field.name])
+
+        call_command('update_projections', model.pk, stdout=io.StringIO())
+        rows = projected()
+        self.assertIn('testprojectedtextfield', rows[0])
+        self.assertEqual(field_instance.value, rows[0][integer_field.name])
+        self.assertEqual(3, len(rows))
+        self.assertTrue(model.refresh_projection([instances[1].pk]))
+
+        # the projection's key column cannot be taken by a field
+        with self.assertRaises(ValidationError):
+            TextField(model=model, index=29, verbose_name='model_instance_id', required=False).full_clean()
+
+        # the table references no instances, rows of deleted instances are deleted by the signal
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+                           [model.projection_table])
+            self.assertEqual(0, cursor.fetchone()[0])
+        instances[2].delete()
+        self.assertEqual(2, len(projected()))
+
+        # instances deleted while the table is filled are caught up after the swap
+        fill_projection = model._fill_projection
+
+        def fill_deleting(*args, **kwargs):
+            fill_projection(*args, **kwargs)
+            if kwargs.get('table') is not None:
+                instances[1].delete()
+
+        with mock.patch.object(model, '_fill_projection', side_effect=fill_deleting):
+            model.update_projection()
+        self.assertEqual([instances[0].pk], [x['model_instance_id'] for x in projected()])
+
+        model.delete()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [model.projection_table])
+            self.assertIsNone(cursor.fetchone()[0])
+
+
+# concurrent index builds run outside of transactions
+class ModelJsonIndexesCommandTests(TransactionTestCase):
+    def test_update_json_indexes_command(self):
+        model = create_mock_model()
+        integer_field = list(model.get_fields())[8]
+        integer_field.index_json = True
+        integer_field.save()
+        model.index_json = True
+        model.save()
+
+        call_command('update_json_indexes', model.pk, stdout=io.StringIO())
+        indexes = model.get_json_indexes()
+        self.assertEqual(2, len(indexes))
+
+        # indexes left invalid by a failed build are built again
+        name = next(x for x in indexes if x != f'flexible_json_{model.pk}')
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE pg_index SET indisvalid = false WHERE indexrelid = %s::regclass", [name])
+        call_command('update_json_indexes', stdout=io.StringIO())
+        self.assertEqual(indexes, model.get_json_indexes())
+        self.assertTrue(all(model._get_json_index_validity().values()))
+
+        model.index_json = False
+        model.save()
+        call_command('update_json_indexes', model.pk, stdout=io.StringIO())
+        self.assertEqual({name}, model.get_json_indexes())
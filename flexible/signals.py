@@ -0,0 +1,135 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.core.exceptions import ObjectDoesNotExist
+
+from flexible.models import Model, Field, ModelInstance, ModelDescriptionComponent, ModelSchema, \
+                           model_instances_json_changed
+from flexible.choices import FieldChoice, TextFieldChoice
+from flexible.expressions import ModelExpression, ModelExpressionActionBase, \
+                                 FieldExpression, FieldExpressionActionBase
+from flexible.conditions import ConditionGroup, Condition, \
+                                ModelExpressionCondition, FieldExpressionCondition
+from flexible.actions import Action
+from flexible.metrics import FieldMetrics, MetricsRollup, update_metrics
+
+
+def get_schema_model_id(instance):
+    """
+    Finds the model whose schema is affected by changes to the given object
+    :param instance: django.db.models.Model
+        The changed object
+    :return: int
+        The id of the affected model, None if no schema is affected
+    """
+    if isinstance(instance, Model):
+        return instance.pk
+    if isinstance(instance, (Field, Condition, Action, ModelExpression, ModelDescriptionComponent)):
+        return instance.model_id
+    if isinstance(instance, (FieldChoice, FieldExpression)):
+        return instance.field.model_id
+    if isinstance(instance, (ConditionGroup, ModelExpressionActionBase, FieldExpressionActionBase)):
+        return get_schema_model_id(instance.expression)
+    if isinstance(instance, (ModelExpressionCondition, FieldExpressionCondition)):
+        return get_schema_model_id(instance.group)
+
+    return None
+
+
+@receiver([post_save, post_delete])
+def invalidate_model_schema(sender, instance, **kwargs):
+    """
+    Invalidates the compiled schema of the model affected by a saved or deleted object
+    """
+    if sender._meta.app_label != 'flexible':
+        return
+
+    try:
+        model_id = get_schema_model_id(instance)
+    except ObjectDoesNotExist:
+        # related objects may already be gone while cascading deletes, the object the cascade
+        # started from invalidates the schema of its model
+        return
+    if model_id is None:
+        return
+
+    ModelSchema.invalidate(model_id)
+    # the programs of the model's field expressions are serialised again once, after all the changes
+    FieldExpression.update_programs_on_commit(model_id)
+    # other processes may compile the old schema until the change is committed
+    transaction.on_commit(lambda: ModelSchema.invalidate(model_id))
+
+
+@receiver([post_save, post_delete], sender=TextFieldChoice)
+def clear_text_field_choice_index(sender, instance, **kwargs):
+    """
+    Clears the choice index of the field of a saved or deleted choice, when the choice holds the field.
+    The fields of compiled schemas are replaced along with the schema
+    """
+    if TextFieldChoice.field.is_cached(instance):
+        instance.field.clear_choice_index()
+
+
+@receiver(post_delete, sender=Model)
+def drop_model_json_indexes(sender, instance, **kwargs):
+    """
+    Drops the json indexes of a deleted model
+    """
+    instance.drop_json_indexes()
+
+
+@receiver(post_delete, sender=Model)
+def drop_model_projection(sender, instance, **kwargs):
+    """
+    Drops the projection of a deleted model
+    """
+    instance.drop_projection()
+
+
+@receiver(post_delete, sender=ModelInstance)
+def delete_model_instance_projection(sender, instance, **kwargs):
+    """
+    Deletes the row of a deleted model instance from the projection of its model
+    """
+    # the model may be deleted along with it
+    Model(pk=instance.model_id).delete_projection_rows([instance.pk])
+
+
+@receiver(post_save)
+def build_field_metrics(sender, instance, created, **kwargs):
+    """
+    Builds the metrics and rollups of a saved field that started generating metrics, or removes
+    them when it stopped. Saves leaving the flag as it was keep the metrics, the json updates them
+    """
+    if not isinstance(instance, Field):
+        return
+
+    # new fields, copies included, have no metrics yet
+    generated_metrics = not created and bool(instance._saved_generate_metrics)
+    if instance.generate_metrics == generated_metrics:
+        return
+
+    if instance.generate_metrics:
+        FieldMetrics.build(instance)
+        MetricsRollup.build(instance)
+    else:
+        FieldMetrics.objects.filter(field=instance).delete()
+        MetricsRollup.objects.filter(field=instance).delete()
+
+
+@receiver(model_instances_json_changed)
+def update_field_metrics(sender, model_id, changes, **kwargs):
+    """
+    Updates the metrics and rollups of a model's fields with the changed json of its instances
+    """
+    update_metrics(model_id, changes)
+
+
+@receiver(post_delete, sender=ModelInstance)
+def remove_field_metrics(sender, instance, **kwargs):
+    """
+    Removes the json of a deleted model instance from the metrics and rollups of the model's fields
+    """
+    if instance._saved_json is not None:
+        # the model may be deleted along with it, so metrics are not created
+        update_metrics(instance.model_id, [(instance.created, instance._saved_json, None)], create=False)
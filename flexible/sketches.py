@@ -0,0 +1,221 @@
+import hashlib
+import math
+import struct
+
+
+def hash_value(value):
+    """
+    Hashes a value into 64 bits, the same in every process
+    :param value: string
+        The value to hash
+    :return: int
+        The 64 bit hash
+    """
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+# estimates the number of distinct values in bounded memory, sketches of the same precision merge
+class HyperLogLog:
+    default_precision = 12
+
+    def __init__(self, precision=default_precision, registers=None):
+        """
+        :param precision: int
+            The number of hash bits indexing the registers, 4 to 16
+        :param registers: bytearray
+            The optional registers to start from
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError("Precision must be between 4 and 16")
+
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    def add(self, value):
+        """
+        Adds a value to the sketch
+        :param value: string
+            The value to add
+        """
+        x = hash_value(value)
+        index = x >> (64 - self.precision)
+        # the position of the first set bit of the remaining bits
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """
+        Merges another sketch into this one
+        :param other: HyperLogLog
+            The sketch to merge
+        """
+        if other.precision != self.precision:
+            raise ValueError("Sketches of different precisions cannot be merged")
+
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def estimate(self):
+        """
+        Estimates the number of distinct values added
+        :return: int
+            The estimated number of distinct values
+        """
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -x for x in self.registers)
+
+        # small cardinalities are better estimated by the empty registers
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+    def to_bytes(self):
+        """
+        :return: bytes
+            The serialised sketch
+        """
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        :param data: bytes
+            The serialised sketch
+        :return: HyperLogLog
+            The deserialised sketch
+        """
+        data = bytes(data)
+        return cls(precision=data[0], registers=bytearray(data[1:]))
+
+
+# finds the most frequent values in bounded memory, keeping the counts of a fixed number of values
+class SpaceSaving:
+    default_capacity = 64
+
+    # the serialised header and entry counts
+    header_format = '>H'
+    entry_format = '>QQI'
+
+    def __init__(self, capacity=default_capacity, counts=None):
+        """
+        :param capacity: int
+            The number of values to keep counts of
+        :param counts: dict
+            The optional values mapped to their counts and overestimation errors
+        """
+        self.capacity = capacity
+        self.counts = counts if counts is not None else {}
+
+    def add(self, value, count=1):
+        """
+        Adds occurrences of a value to the sketch
+        :param value: string
+            The value to add
+        :param count: int
+            The number of occurrences
+        """
+        value = str(value)
+        if value in self.counts:
+            total, error = self.counts[value]
+            self.counts[value] = (total + count, error)
+        elif len(self.counts) < self.capacity:
+            self.counts[value] = (count, 0)
+        else:
+            # the least frequent value is replaced, its count becomes the error of the new one
+            minimum = min(self.counts, key=lambda x: self.counts[x][0])
+            minimum_count = self.counts.pop(minimum)[0]
+            self.counts[value] = (minimum_count + count, minimum_count)
+
+    def remove(self, value, count=1):
+        """
+        Removes occurrences of a value from the sketch, the occurrences of values
+        not kept are only part of the overestimation of the kept ones
+        :param value: string
+            The value to remove
+        :param count: int
+            The number of occurrences
+        """
+        value = str(value)
+        if value not in self.counts:
+            return
+
+        total, error = self.counts[value]
+        total -= count
+        if total <= 0:
+            del self.counts[value]
+        else:
+            self.counts[value] = (total, min(error, total))
+
+    def merge(self, other):
+        """
+        Merges another sketch into this one
+        :param other: SpaceSaving
+            The sketch to merge
+        """
+        # values missing from a full sketch could have occurred up to its smallest count
+        own_minimum = self.get_minimum()
+        other_minimum = other.get_minimum()
+
+        counts = {}
+        for value in self.counts.keys() | other.counts.keys():
+            total, error = self.counts.get(value, (own_minimum, own_minimum))
+            other_total, other_error = other.counts.get(value, (other_minimum, other_minimum))
+            counts[value] = (total + other_total, error + other_error)
+
+        self.counts = dict(sorted(counts.items(), key=lambda x: -x[1][0])[:self.capacity])
+
+    def get_minimum(self):
+        """
+        :return: int
+            The smallest count when the sketch is full, otherwise 0
+        """
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(x[0] for x in self.counts.values())
+
+    def top(self, count):
+        """
+        The most frequent values
+        :param count: int
+            The number of values to return
+        :return: list<tuple>
+            The values and their estimated counts, most frequent first
+        """
+        return [(x, y[0]) for x, y in sorted(self.counts.items(), key=lambda x: (-x[1][0], x[0]))[:count]]
+
+    def to_bytes(self):
+        """
+        :return: bytes
+            The serialised sketch
+        """
+        parts = [struct.pack(self.header_format, self.capacity)]
+        for value, (total, error) in self.counts.items():
+            encoded = value.encode('utf-8')
+            parts.append(struct.pack(self.entry_format, total, error, len(encoded)))
+            parts.append(encoded)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        :param data: bytes
+            The serialised sketch
+        :return: SpaceSaving
+            The deserialised sketch
+        """
+        data = bytes(data)
+        capacity, = struct.unpack_from(cls.header_format, data)
+        offset = struct.calcsize(cls.header_format)
+
+        counts = {}
+        while offset < len(data):
+            total, error, length = struct.unpack_from(cls.entry_format, data, offset)
+            offset += struct.calcsize(cls.entry_format)
+            counts[data[offset:offset + length].decode('utf-8')] = (total, error)
+            offset += length
+
+        return cls(capacity=capacity, counts=counts)
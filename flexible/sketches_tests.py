@@ -0,0 +1,92 @@
+import random
+
+from django.test import SimpleTestCase
+
+from flexible.sketches import *
+
+
+class SketchesTests(SimpleTestCase):
+    def test_hyperloglog(self):
+        sketch = HyperLogLog()
+        self.assertEqual(0, sketch.estimate())
+
+        # small cardinalities are close to exact
+        for i in range(10):
+            sketch.add(f'value {i}')
+            sketch.add(f'value {i}')
+        self.assertEqual(10, sketch.estimate())
+
+        # large cardinalities are within a few percent
+        for i in range(50000):
+            sketch.add(f'value {i}')
+        self.assertAlmostEqual(50000, sketch.estimate(), delta=50000 * 0.05)
+
+        # sketches are compact and survive serialisation
+        data = sketch.to_bytes()
+        self.assertEqual(1 + (1 << HyperLogLog.default_precision), len(data))
+        self.assertEqual(sketch.estimate(), HyperLogLog.from_bytes(data).estimate())
+
+        with self.assertRaises(ValueError):
+            HyperLogLog(precision=17)
+
+    def test_hyperloglog_merge(self):
+        a, b, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for i in range(20000):
+            (a if i % 2 == 0 else b).add(f'value {i}')
+            both.add(f'value {i}')
+
+        # merging gives the sketch of all values
+        a.merge(b)
+        self.assertEqual(both.registers, a.registers)
+
+        with self.assertRaises(ValueError):
+            a.merge(HyperLogLog(precision=10))
+
+    def test_space_saving(self):
+        sketch = SpaceSaving(capacity=16)
+        randomizer = random.Random(0)
+        values = [f'frequent {i}' for i in range(5) for _ in range(200 - i * 10)] + \
+                 [f'rare {randomizer.randint(0, 1000)}' for _ in range(2000)]
+        randomizer.shuffle(values)
+        for value in values:
+            sketch.add(value)
+
+        # the frequent values are found, their counts are overestimated by at most the errors
+        top = sketch.top(5)
+        self.assertEqual({f'frequent {i}' for i in range(5)}, {x for x, _ in top})
+        for value, count in top:
+            self.assertGreaterEqual(count, values.count(value))
+            self.assertLessEqual(count - sketch.counts[value][1], values.count(value))
+
+        # the sketch survives serialisation
+        restored = SpaceSaving.from_bytes(sketch.to_bytes())
+        self.assertEqual(sketch.capacity, restored.capacity)
+        self.assertEqual(sketch.counts, restored.counts)
+
+    def test_space_saving_merge(self):
+        a, b = SpaceSaving(capacity=8), SpaceSaving(capacity=8)
+        a.add('x', 10)
+        a.add('y', 3)
+        b.add('x', 5)
+        b.add('z', 7)
+
+        a.merge(b)
+        self.assertEqual([('x', 15), ('z', 7), ('y', 3)], a.top(3))
+
+        # full sketches can only bound the values they dropped
+        for i in range(8):
+            b.add(f'value {i}')
+        a.merge(b)
+        self.assertEqual(8, len(a.counts))
+        self.assertEqual('x', a.top(1)[0][0])
+
+    def test_space_saving_remove(self):
+        sketch = SpaceSaving(capacity=4)
+        sketch.add('x', 10)
+        sketch.add('y', 3)
+
+        # removed occurrences are taken off the kept values, dropping the ones left without any
+        sketch.remove('x', 4)
+        sketch.remove('y', 3)
+        sketch.remove('z')
+        self.assertEqual([('x', 6)], sketch.top(3))
@@ -30,4 +30,121 @@ function durationFieldOnValueChange(self) {
     } catch(err) {
         console.log(err);
     }
-}
\ No newline at end of file
+}
+
+// how long typing must pause before expressions are evaluated again, in milliseconds
+var flexibleExpressionsDelay = 150;
+
+function flexibleBindExpressions(expressions, dependents, anyDependents) {
+    // the expressions waiting to be evaluated
+    var pending = {};
+    var timer = null;
+
+    function evaluate(indices) {
+        indices.sort(function(a, b) { return a - b; });
+        for (var i = 0; i < indices.length; i++) {
+            try {
+                expressions[indices[i]]();
+            } catch(err) {
+                console.log(err);
+            }
+        }
+    }
+
+    function dependentsOf(input) {
+        var indices = dependents[input.id];
+        if (indices === undefined) {
+            // inputs of duration fields are suffixed with their index
+            indices = dependents[input.id.replace(/_\d+$/, '')] || [];
+        }
+        return indices.concat(anyDependents);
+    }
+
+    function flush() {
+        timer = null;
+        var indices = Object.keys(pending).map(Number);
+        pending = {};
+        evaluate(indices);
+    }
+
+    function schedule(input, delay) {
+        var indices = dependentsOf(input);
+        if (indices.length == 0) {
+            return;
+        }
+        for (var i = 0; i < indices.length; i++) {
+            pending[indices[i]] = true;
+        }
+
+        if (timer !== null) {
+            clearTimeout(timer);
+        }
+        if (delay > 0) {
+            timer = setTimeout(flush, delay);
+        } else {
+            flush();
+        }
+    }
+
+    $(document).ready(function() {
+        evaluate(expressions.map(function(expression, i) { return i; }));
+
+        // typing is debounced, other changes are evaluated at once
+        $(document).on('input', 'form :input', function() {
+            schedule(this, flexibleExpressionsDelay);
+        });
+        $(document).on('change focusout', 'form :input', function() {
+            schedule(this, 0);
+        });
+    });
+}
+
+
+// how long typing must pause before choices are suggested, in milliseconds
+var flexibleChoicesDelay = 200;
+
+function flexibleBindChoices(input) {
+    // the suggestions are listed for the input as the user types
+    var list = document.createElement('datalist');
+    list.id = input.id + '_choices';
+    input.parentNode.appendChild(list);
+    input.setAttribute('list', list.id);
+
+    var timer = null;
+    var query = null;
+
+    function suggest() {
+        timer = null;
+        if (input.value == query) {
+            return;
+        }
+        query = input.value;
+
+        $.getJSON(input.getAttribute('data-choices-url'), {q: query}, function(data) {
+            // the user has typed on since
+            if (query != input.value) {
+                return;
+            }
+
+            $(list).empty();
+            for (var i = 0; i < data.results.length; i++) {
+                var option = document.createElement('option');
+                option.value = data.results[i];
+                list.appendChild(option);
+            }
+        });
+    }
+
+    $(input).on('input focus', function() {
+        if (timer !== null) {
+            clearTimeout(timer);
+        }
+        timer = setTimeout(suggest, flexibleChoicesDelay);
+    });
+}
+
+$(document).ready(function() {
+    $('form :input[data-choices-url]').each(function() {
+        flexibleBindChoices(this);
+    });
+});
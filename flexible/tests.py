@@ -1,5 +1,10 @@
 from flexible.actions_tests import *
+from flexible.choices_tests import *
 from flexible.forms_tests import *
 from flexible.models_tests import *
 from flexible.widgets_tests import *
 from flexible.conditions_tests import *
+from flexible.imports_tests import *
+from flexible.metrics_tests import *
+from flexible.sketches_tests import *
+from flexible.views_tests import *
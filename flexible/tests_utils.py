@@ -3,6 +3,7 @@ import random
 import string
 from decimal import Decimal
 
+from django.db import connection
 
 from flexible.models import *
 from flexible.choices import *
@@ -11,6 +12,14 @@ from flexible.conditions import *
 from flexible.actions import *
 
 
+def run_on_commit_callbacks():
+    # test cases never commit, run the callbacks waiting for the commit as if it happened
+    callbacks = connection.run_on_commit
+    connection.run_on_commit = []
+    for _, callback in callbacks:
+        callback()
+
+
 def create_random_string(range_begin=0, range_end=1337):
     range_begin = max(range_begin, 0)
     range_end = max(range_end, 0)
@@ -186,6 +195,30 @@ def create_mock_model_instance(model, model_instance=None):
     return model_instance, values_dict
 
 
+def create_mock_matched_field(model, field, rhs):
+    # an evaluated field returning 'matched' when the given text field matches rhs
+    index = model.field_set.order_by('-index')[0].index + 1
+    matched_field = TextField.objects.create(model=model, index=index, verbose_name='TestMatchedTextField',
+                                             required=False, evaluated=True)
+    expression = FieldExpression.objects.create(name='testMatchedTextField_FieldExpression', field=matched_field)
+    expression.create_group().add_condition(TextFieldCondition.objects.create(model=model, field=field, rhs=rhs))
+    expression.add_action(ReturnStringAction.objects.create(model=model, value='matched'))
+    expression.add_default_action(ReturnStringAction.objects.create(model=model, value='unmatched'))
+
+    return matched_field
+
+
+def to_import_value(value):
+    # values as they come from imports
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, datetime.date):
+        return value.strftime('%d/%m/%Y')
+    if isinstance(value, datetime.timedelta):
+        return str(int(value.total_seconds()))
+    return value
+
+
 def create_mock_field(model, field_type):
     if model.field_set.all().count() > 0:
         index = model.field_set.order_by('-index')[0].index + 1
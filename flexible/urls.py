@@ -0,0 +1,10 @@
+from django.urls import path
+
+from flexible import views
+
+app_name = 'flexible'
+
+urlpatterns = [
+    path('models/<int:model_id>/model.js', views.model_js, name='model_js'),
+    path('models/<int:model_id>/fields/<slug:field_name>/choices.json', views.field_choices, name='field_choices'),
+]
@@ -1,3 +1,156 @@
-from django.shortcuts import render
+from functools import wraps
 
-# Create your views here.
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, Http404
+from django.utils.cache import patch_cache_control
+from django.utils.module_loading import import_string
+from django.views.decorators.http import etag, require_safe
+
+from flexible.models import Model, ModelSchema, TextField
+
+# how long browsers may keep responses requested by their current version, in seconds
+VERSIONED_MAX_AGE = 60 * 60 * 24 * 365
+
+
+def get_model_permission():
+    """
+    The callable deciding which requests may read the js and choices of a model, set by
+    the dotted path FLEXIBLE_MODEL_PERMISSION and called with the request and model id
+    :return: callable
+        The permission, None when every request may read every model
+    """
+    path = getattr(settings, 'FLEXIBLE_MODEL_PERMISSION', None)
+    if path is None:
+        return None
+    return import_string(path)
+
+
+def model_permission_required(view):
+    """
+    Decorates a view of a model with FLEXIBLE_MODEL_PERMISSION, models the request
+    may not read are not found, so their ids cannot be told apart from missing ones
+    """
+    @wraps(view)
+    def wrapped_view(request, model_id, *args, **kwargs):
+        permission = get_model_permission()
+        if permission is not None and not permission(request, model_id):
+            raise Http404("No model found")
+        return view(request, model_id, *args, **kwargs)
+
+    return wrapped_view
+
+
+def patch_version_cache_control(request, response, version):
+    """
+    Lets browsers keep a response requested by its current version, others are checked against
+    the etag each time. Shared caches only keep responses every request may read
+    :param request: HttpRequest
+        The request, holding the requested version as v
+    :param response: HttpResponse
+        The response to patch
+    :param version: string
+        The current version of the response
+    """
+    # versioned urls never change
+    if request.GET.get('v') == version:
+        if get_model_permission() is None:
+            patch_cache_control(response, public=True, max_age=VERSIONED_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, private=True, max_age=VERSIONED_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+
+
+def get_model_js_version(request, model_id):
+    """
+    The etag of the js of a model
+    :param request: HttpRequest
+        The request for the js
+    :param model_id: int
+        The id of the model
+    :return: string
+        The digest of the js, None when the model does not exist
+    """
+    try:
+        return ModelSchema.for_model(model_id).js_version
+    except Model.DoesNotExist:
+        return None
+
+
+@require_safe
+@model_permission_required
+@etag(get_model_js_version)
+def model_js(request, model_id):
+    """
+    Serves the cached js of a model, unchanged js is not sent again to browsers holding it
+    """
+    try:
+        schema = ModelSchema.for_model(model_id)
+        js = schema.js
+    except Model.DoesNotExist:
+        raise Http404("No model found")
+
+    response = HttpResponse(js, content_type='application/javascript; charset=utf-8')
+    patch_version_cache_control(request, response, schema.js_version)
+    return response
+
+
+def get_field_choices(model_id, field_name):
+    """
+    The text field of a model's compiled schema suggesting choices
+    :param model_id: int
+        The id of the model
+    :param field_name: string
+        The name of the field
+    :return: TextField
+        The field
+    """
+    try:
+        field = ModelSchema.for_model(model_id).get(field_name)
+    except Model.DoesNotExist:
+        raise Http404("No model found")
+    if not isinstance(field, TextField):
+        raise Http404("No text field found")
+    return field
+
+
+def get_field_choices_version(request, model_id, field_name):
+    """
+    The etag of the choices of a field
+    :param request: HttpRequest
+        The request for the choices
+    :param model_id: int
+        The id of the model
+    :param field_name: string
+        The name of the field
+    :return: string
+        The digest of the choices
+    """
+    return get_field_choices(model_id, field_name).choices_version
+
+
+@require_safe
+@model_permission_required
+@etag(get_field_choices_version)
+def field_choices(request, model_id, field_name):
+    """
+    Serves a page of the choices of a text field matching the query q, as json
+    """
+    field = get_field_choices(model_id, field_name)
+
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    matches = field.get_choice_matches(request.GET.get('q', ''))
+    start = (page - 1) * field.choices_page_size
+    end = start + field.choices_page_size
+
+    response = JsonResponse({
+        'results': matches[start:end],
+        'page': page,
+        'has_next': end < len(matches),
+    })
+    patch_version_cache_control(request, response, field.choices_version)
+    return response
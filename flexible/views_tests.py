@@ -0,0 +1,138 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import path, include, reverse
+
+from flexible.forms import ModelInstanceForm
+from flexible.tests_utils import *
+
+# the flexible urls as they are included by projects
+urlpatterns = [
+    path('flexible/', include('flexible.urls')),
+]
+
+
+def can_read_model(request, model_id):
+    return request.user.is_authenticated
+
+
+@override_settings(ROOT_URLCONF='flexible.views_tests')
+class ViewsTests(TestCase):
+    def create_expression(self, model, text_field, int_field, rhs):
+        expression = ModelExpression.objects.create(name='testExpression', model=model)
+        group = expression.create_group()
+        condition = TextFieldCondition.objects.create(field=text_field, rhs=rhs,
+                                                      condition=TextFieldCondition.CONDITION_MATCH, model=model)
+        group.add_condition(condition=condition)
+        expression.add_action(action=ShowFieldAction.objects.create(field=int_field, model=model))
+
+    def test_model_js_view(self):
+        model = Model.objects.create(name='testModel')
+        text_field = TextField.objects.create(verbose_name='testTextField', required=True, model=model)
+        int_field = IntegerField.objects.create(verbose_name='testIntegerField', required=False, model=model)
+        self.create_expression(model, text_field, int_field, 'matchingValue')
+
+        # the js is served by a versioned url, which browsers may keep
+        url = model.js_url
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(model.js(), response.content.decode('utf-8'))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn(url, str(ModelInstanceForm(model).media))
+
+        # unchanged js is neither generated nor sent again
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+        # changing the expressions changes the js and its url
+        self.create_expression(model, text_field, int_field, 'anotherMatchingValue')
+        self.assertNotEqual(url, model.js_url)
+        response = self.client.get(url)
+        self.assertEqual(model.js(), response.content.decode('utf-8'))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        # missing models are not found
+        self.assertEqual(404, self.client.get(url.replace(str(model.pk), str(model.pk + 1000))).status_code)
+
+    def test_field_choices_view(self):
+        model = Model.objects.create(name='testModel')
+        field = TextField.objects.create(verbose_name='testTextField', required=False, model=model)
+        for i, value in enumerate(['New South Wales', 'Northern Territory', 'Queensland', 'South Australia',
+                                   'Western Australia']):
+            field.create_choice(value, index=i)
+
+        # the form fetches the choices rather than embedding them
+        form = ModelInstanceForm(model)
+        self.assertEqual(form.field_choices[field.name], form.fields[field.name].widget.attrs['data-choices-url'])
+        url, version = form.field_choices[field.name].split('?v=')
+
+        # values starting with the query come before values with a word starting with it
+        response = self.client.get(url, {'q': ' so', 'v': version})
+        self.assertEqual({'results': ['South Australia', 'New South Wales'], 'page': 1, 'has_next': False},
+                         response.json())
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(['New South Wales', 'Northern Territory'],
+                         self.client.get(url, {'q': 'N', 'v': version}).json()['results'])
+
+        # matches are paged
+        with mock.patch.object(TextField, 'choices_page_size', 1):
+            self.assertEqual({'results': ['South Australia'], 'page': 1, 'has_next': True},
+                             self.client.get(url, {'q': 'australia', 'v': version}).json())
+            self.assertEqual({'results': ['Western Australia'], 'page': 2, 'has_next': False},
+                             self.client.get(url, {'q': 'australia', 'page': 2, 'v': version}).json())
+
+        # unchanged choices are not sent again
+        etag = self.client.get(url, {'q': 'so'})['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(304, self.client.get(url, {'q': 'so'}, HTTP_IF_NONE_MATCH=etag).status_code)
+
+        # changed choices change the url
+        field.create_choice('Victoria', index=5)
+        self.assertNotEqual(version, ModelInstanceForm(model).field_choices[field.name].split('?v=')[1])
+        self.assertEqual(['Victoria'], self.client.get(url, {'q': 'vic'}).json()['results'])
+
+        # only text fields suggest choices
+        self.assertEqual(404, self.client.get(url.replace(field.name, 'missing')).status_code)
+
+    def test_model_permission(self):
+        model = Model.objects.create(name='testModel')
+        field = TextField.objects.create(verbose_name='testTextField', required=False, model=model)
+        field.create_choice('Queensland', index=0)
+        form = ModelInstanceForm(model)
+        urls = [model.js_url, form.field_choices[field.name]]
+
+        with override_settings(FLEXIBLE_MODEL_PERMISSION='flexible.views_tests.can_read_model'):
+            # models the request may not read are not found, whatever its etag
+            for url in urls:
+                response = self.client.get(url)
+                self.assertEqual(404, response.status_code)
+                self.assertEqual(404, self.client.get(url, HTTP_IF_NONE_MATCH='"etag"').status_code)
+
+            # models it may read are only kept by browsers
+            user = User.objects.create_user('reader')
+            self.client.force_login(user)
+            for url in urls:
+                path, version = url.split('?v=')
+                response = self.client.get(path, {'v': version})
+                self.assertEqual(200, response.status_code)
+                self.assertIn('private', response['Cache-Control'])
+                self.assertNotIn('public', response['Cache-Control'])
+
+    def test_missing_models(self):
+        model = Model.objects.create(name='testModel')
+        missing_id = model.pk + 1000
+        urls = [reverse('flexible:model_js', args=[missing_id]),
+                reverse('flexible:field_choices', args=[missing_id, 'testtextfield'])]
+
+        # missing models are not found, and leave neither a compiled schema nor a version behind
+        for url in urls:
+            self.assertEqual(404, self.client.get(url).status_code)
+            self.assertNotIn(missing_id, ModelSchema._schemas)
+            self.assertIsNone(cache.get(ModelSchema.model_version_cache_key % missing_id))
+
+        # models without fields are compiled
+        self.assertEqual(200, self.client.get(reverse('flexible:model_js', args=[model.pk])).status_code)
+        self.assertIn(model.pk, ModelSchema._schemas)
@@ -10,6 +10,8 @@ setup(name='django-flexible',
       packages=[
             'flexible',
             'flexible.migrations',
+            'flexible.management',
+            'flexible.management.commands',
       ],
       install_requires=[
             'django==2.2.24',